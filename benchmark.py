@@ -0,0 +1,360 @@
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from itertools import accumulate, islice
+from typing import NamedTuple
+
+from database import Database, LIST_MEMBERSHIPS_TABLE, NATIVE_DATES_TABLE
+from date_util import days_to_seconds, start_of_day, timestamp_to_swiss_date
+from report import TextReport
+from result_cache import DEFAULT_RESULT_CACHE_BYTES
+
+PUBLIC_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public.db")
+DEFAULT_REPEAT = 10
+INSERT_CHUNK_SIZE = 50000
+SAMPLE_TICKERS = 50
+# a case counts as regressed when its median is this much slower than in the baseline
+REGRESSION_RATIO = 1.25
+NAME_WORDS = ["Air", "Alpine", "Atlas", "Bank", "Capital", "Chemicals", "Digital", "Energy", "Foods", "Global",
+              "Health", "Industries", "Insurance", "Logistics", "Materials", "Media", "Metals", "Mining", "Motors",
+              "Networks", "Pharma", "Power", "Realty", "Retail", "Semiconductor", "Software", "Steel", "Systems",
+              "Telecom", "Textiles", "Utilities", "Water"]
+NAME_SUFFIXES = ["AG", "Corporation", "Group", "Holdings", "Inc", "International", "Limited", "SA"]
+# tables the generator refills, children before parents; reference tables (weights, countries, ...) are kept
+GENERATED_TABLES = ["notes", "list_changes", LIST_MEMBERSHIPS_TABLE, "earnings_dates", "bloomberg_earnings_dates",
+                    "bloomberg_scrape_batches", "securities_alt_names", "securities", "lists"]
+
+BenchmarkSample = NamedTuple("BenchmarkSample", [("ticker", str), ("tickers", list), ("pref_list", str),
+                                                 ("pref_lists", list), ("root_list", str), ("name", str),
+                                                 ("current_time", int)])
+BenchmarkResult = NamedTuple("BenchmarkResult", [("case", str), ("runs", int), ("p50_ms", float), ("p90_ms", float),
+                                                 ("p99_ms", float), ("max_ms", float), ("peak_kib", float)])
+
+
+def zipf_cum_weights(n, exponent=1.1):
+    # a few securities and lists attract most of the list changes, like the real coverage does
+    return list(accumulate(1.0 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def generate_database(path, securities=100000, list_changes=5000000, earnings_dates=1000000, lists=300, seed=1):
+    # synthetic data in the schema of public.db: reference tables are copied, everything else is generated
+    rng = random.Random(seed)
+    shutil.copyfile(PUBLIC_DB_PATH, path)
+    # repeats are timed against sqlite, not the result cache
+    db = Database(path, result_cache_bytes=0)
+    db.connect()
+    for table_name in GENERATED_TABLES:
+        db.cursor.execute(f"DELETE FROM {table_name}")
+
+    current_time = start_of_day(int(time.time()))
+    country_tickers = dict(db.run_query("SELECT country_id, ticker FROM countries ORDER BY country_id"))
+    currency_ids = [row[0] for row in db.run_query("SELECT currency_id FROM currencies")]
+    weight_ids = [row[0] for row in db.run_query("SELECT weight_id FROM weights")]
+    event_ids = dict(db.run_query("SELECT ticker, event_id FROM list_change_events"))
+
+    country_ids = rng.choices(list(country_tickers), cum_weights=zipf_cum_weights(len(country_tickers)), k=securities)
+    security_rows = [(security_id, f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)}",
+                      f"S{security_id:06d}.{country_tickers[country_id]}", country_id, rng.choice(currency_ids),
+                      f"https://ir.example.com/{security_id}")
+                     for security_id, country_id in enumerate(country_ids, start=1)]
+    db.cursor.executemany("INSERT INTO securities(security_id, name, ticker, country_id, currency_id, ir_website) "
+                          "VALUES (?, ?, ?, ?, ?, ?)", security_rows)
+    db.cursor.executemany("INSERT INTO securities_alt_names(alt_name, security_id) VALUES (?, ?)",
+                          [(f"{row[1].rsplit(' ', 1)[0]} Alt", row[0]) for row in security_rows[::20]])
+
+    # brokers at the top, regions below them and sector lists below the regions
+    levels = [0 if list_id <= max(1, lists // 30) else 1 if list_id <= max(2, lists // 6) else 2
+              for list_id in range(1, lists + 1)]
+    list_rows = []
+    for list_id, level in enumerate(levels, start=1):
+        parent_ids = [parent_id for parent_id, parent_level in enumerate(levels[:list_id - 1], start=1)
+                      if parent_level == level - 1]
+        list_rows.append((list_id, f"List {list_id}", rng.choice(weight_ids),
+                          rng.choice(parent_ids) if parent_ids else None, f"L{list_id:04d}"))
+    db.cursor.executemany("INSERT INTO lists(list_id, name, weight_id, parent_list_id, ticker) VALUES (?, ?, ?, ?, ?)",
+                          list_rows)
+
+    insert_in_chunks(db, "INSERT INTO list_changes(list_id, security_id, event_id, date_epoch, note) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                     generate_list_changes(rng, list_changes, securities, [row[0] for row in list_rows if row[3]],
+                                           event_ids, current_time))
+    insert_in_chunks(db, "INSERT INTO earnings_dates(security_id, date_epoch) VALUES (?, ?)",
+                     generate_earnings_dates(rng, earnings_dates, securities, current_time))
+
+    db.cursor.execute("INSERT INTO bloomberg_scrape_batches(scraped_epoch, source) VALUES (?, 'benchmark')",
+                      (current_time,))
+    scrape_batch_id = db.cursor.lastrowid
+    db.cursor.executemany("INSERT INTO bloomberg_earnings_dates(date_epoch, security_id, name, scrape_batch_id) "
+                          "VALUES (?, ?, 'Earnings Announcement', ?)",
+                          [(current_time + days_to_seconds(rng.randrange(1, 91)), security_id, scrape_batch_id)
+                           for security_id in range(1, securities + 1) if rng.random() < 0.6])
+    db.connection.commit()
+    db.record_write("lists", "securities")
+
+    db.rebuild_list_memberships()
+    db.rebuild_security_scores()
+    db.cursor.execute("ANALYZE")
+    return db
+
+
+def insert_in_chunks(db, sql, rows):
+    # generated rows are never all in memory at once
+    for chunk in iter(lambda: list(islice(rows, INSERT_CHUNK_SIZE)), []):
+        db.cursor.executemany(sql, chunk)
+
+
+def generate_list_changes(rng, number_of_changes, securities, list_ids, event_ids, current_time):
+    # runs of alternating add and remove events per (list, security), now and then an append or reduce in between;
+    # lists without a parent only group other lists and get no changes
+    security_ids = range(1, securities + 1)
+    security_weights = zipf_cum_weights(securities)
+    list_weights = zipf_cum_weights(len(list_ids))
+    first_time = current_time - days_to_seconds(5 * 365)
+    generated = 0
+
+    while generated < number_of_changes:
+        list_id = rng.choices(list_ids, cum_weights=list_weights)[0]
+        security_id = rng.choices(security_ids, cum_weights=security_weights)[0]
+        date_epoch = start_of_day(int(rng.uniform(first_time, current_time)))
+        remaining_in_run = min(1 + int(rng.expovariate(0.7)), number_of_changes - generated)
+        position = 0
+
+        while remaining_in_run > 0 and date_epoch <= current_time:
+            if position % 2 == 1 and rng.random() < 0.1:
+                event = rng.choice(["app", "red"])
+            else:
+                event = "add" if position % 2 == 0 else "rem"
+                position += 1
+            yield list_id, security_id, event_ids[event], date_epoch, None
+            date_epoch += days_to_seconds(1 + int(rng.expovariate(1.0 / 120)))
+            remaining_in_run -= 1
+            generated += 1
+
+
+def generate_earnings_dates(rng, number_of_dates, securities, current_time):
+    # quarterly reporting around the current time, with a few days of jitter per quarter
+    dates_per_security = -(-number_of_dates // securities)
+    first_time = current_time - days_to_seconds(91 * (dates_per_security - 2))
+
+    for security_id in range(1, securities + 1):
+        offset = rng.randrange(91)
+        for quarter in range(min(dates_per_security, number_of_dates - (security_id - 1) * dates_per_security)):
+            yield security_id, first_time + days_to_seconds(offset + 91 * quarter + rng.randrange(-3, 4))
+
+
+def choose_sample(db, seed=1):
+    rng = random.Random(seed)
+    tickers = [row[0] for row in db.run_query("SELECT ticker FROM securities ORDER BY security_id")]
+    busiest_ticker = db.run_query("SELECT s.ticker FROM list_changes c, securities s "
+                                  "WHERE s.security_id = c.security_id GROUP BY c.security_id "
+                                  "ORDER BY COUNT(*) DESC LIMIT 1")[0][0]
+    largest_lists = [row[0] for row in db.run_query(f"SELECT l.ticker FROM {LIST_MEMBERSHIPS_TABLE} m, lists l "
+                                                    "WHERE l.list_id = m.list_id AND l.parent_list_id IS NOT NULL "
+                                                    "AND m.value_sign > 0 GROUP BY m.list_id "
+                                                    "ORDER BY COUNT(*) DESC LIMIT 3")]
+    root_list = db.run_query("SELECT ticker FROM lists WHERE parent_list_id IS NULL ORDER BY list_id LIMIT 1")[0][0]
+    name = db.query_security(busiest_ticker).name.split()[0]
+
+    return BenchmarkSample(busiest_ticker, rng.sample(tickers, min(SAMPLE_TICKERS, len(tickers))), largest_lists[0],
+                           largest_lists, root_list, name, int(time.time()))
+
+
+def database_cases(sample):
+    # (case, function of db), case names start with the Database method they time
+    now, ticker, tickers, pref_list = sample.current_time, sample.ticker, sample.tickers, sample.pref_list
+    year_ago = now - days_to_seconds(365)
+    return [
+        ("query_all_securities", lambda db: list(db.query_all_securities())),
+        ("query_bloomberg_earnings_dates", lambda db: db.query_bloomberg_earnings_dates(ticker)),
+        ("query_change_events", lambda db: db.query_change_events(now - days_to_seconds(90), now)),
+        ("query_composite_scores", lambda db: db.query_composite_scores(20)),
+        ("query_dates_summaries", lambda db: db.query_dates_summaries(tickers)),
+        ("query_earnings_dates", lambda db: db.query_earnings_dates(ticker, NATIVE_DATES_TABLE)),
+        ("query_earnings_dates_for_tickers", lambda db: db.query_earnings_dates_for_tickers(tickers)),
+        ("query_earnings_dates_in_sources", lambda db: db.query_earnings_dates_in_sources(ticker, db.sources())),
+        ("query_histories", lambda db: db.query_histories(tickers)),
+        ("query_history", lambda db: list(db.query_history(ticker))),
+        ("query_list_components", lambda db: db.query_list_components(pref_list)),
+        ("query_list_components[as_of]", lambda db: db.query_list_components(pref_list, as_of=year_ago)),
+        ("query_list_components_as_of", lambda db: db.query_list_components_as_of(pref_list, year_ago)),
+        ("query_list_components_in_sources",
+         lambda db: db.query_list_components_in_sources(pref_list, db.sources())),
+        ("query_list_history", lambda db: list(db.query_list_history(pref_list))),
+        ("query_list_info", lambda db: db.query_list_info(pref_list)),
+        ("query_list_of_lists", lambda db: db.query_list_of_lists(sample.root_list)),
+        ("query_list_set", lambda db: db.query_list_set(sample.pref_lists, len(sample.pref_lists))),
+        ("query_list_set[union]", lambda db: db.query_list_set(sample.pref_lists, 1)),
+        ("query_list_tree", lambda db: db.query_list_tree(sample.root_list, 90)),
+        ("query_list_tree_components", lambda db: db.query_list_tree_components(sample.root_list)),
+        ("query_list_tree_members", lambda db: db.query_list_tree_members(sample.root_list)),
+        ("query_max_bloomberg_date_id", lambda db: db.query_max_bloomberg_date_id()),
+        ("query_missing_earnings", lambda db: db.query_missing_earnings(90, 100)),
+        ("query_native_earnings_dates", lambda db: db.query_native_earnings_dates(ticker)),
+        ("query_newest_earnings_date_for_ticker", lambda db: db.query_newest_earnings_date_for_ticker(ticker)),
+        ("query_next_earnings_date_for_ticker", lambda db: db.query_next_earnings_date_for_ticker(ticker)),
+        ("query_number_of_active_lists", lambda db: db.query_number_of_active_lists(ticker)),
+        ("query_number_of_bloomberg_dates_since", lambda db: db.query_number_of_bloomberg_dates_since(0)),
+        ("query_numbers_of_active_lists", lambda db: db.query_numbers_of_active_lists(tickers)),
+        ("query_points", lambda db: list(db.query_points(90))),
+        ("query_points[ticker]", lambda db: list(db.query_points(90, ticker=ticker))),
+        ("query_points[as_of]", lambda db: list(db.query_points(90, as_of=year_ago))),
+        ("query_points_in_sources", lambda db: list(db.query_points_in_sources(90, db.sources()))),
+        ("query_previous_earnings_date_for_ticker", lambda db: db.query_previous_earnings_date_for_ticker(ticker)),
+        ("query_primary_keys_by_ticker", lambda db: db.query_primary_keys_by_ticker("securities")),
+        ("query_score_epoch", lambda db: db.query_score_epoch()),
+        ("query_securities", lambda db: db.query_securities(tickers)),
+        ("query_security", lambda db: db.query_security(ticker)),
+        ("query_security_info", lambda db: list(db.query_security_info(sample.name))),
+        ("query_time_weighted_points", lambda db: list(db.query_time_weighted_points(90)[0])),
+        ("query_time_weighted_points_for_tickers", lambda db: db.query_time_weighted_points_for_tickers(tickers, 90)),
+        ("query_time_weighted_points_in_sources",
+         lambda db: list(db.query_time_weighted_points_in_sources(90, db.sources())[0])),
+        ("query_upcoming_earnings", lambda db: db.query_upcoming_earnings(now, now + days_to_seconds(14))),
+        ("query_url_for_ticker", lambda db: db.query_url_for_ticker(ticker)),
+    ]
+
+
+def report_cases(sample):
+    # (case, preferred.py function, menu arguments)
+    series_start, series_end = (timestamp_to_swiss_date(sample.current_time - days_to_seconds(days)) for days in (30, 0))
+    return [
+        ("preferred.query_list_components", "query_list_components", [sample.pref_list]),
+        ("preferred.query_list_of_lists", "query_list_of_lists", [sample.root_list]),
+        ("preferred.query_list_tree", "query_list_tree", [sample.root_list]),
+        ("preferred.query_intersection_of_lists", "query_intersection_of_lists", sample.pref_lists),
+        ("preferred.query_union_of_lists", "query_union_of_lists", sample.pref_lists),
+        ("preferred.query_difference_of_lists", "query_difference_of_lists", sample.pref_lists),
+        ("preferred.query_lists_at_least", "query_lists_at_least", ["2", *sample.pref_lists]),
+        ("preferred.query_points", "query_points", []),
+        ("preferred.query_time_weighted_points", "query_time_weighted_points", []),
+        ("preferred.query_composite_scores", "query_composite_scores", ["20"]),
+        ("preferred.query_upcoming_earnings", "query_upcoming_earnings", []),
+        ("preferred.query_missing_earnings", "query_missing_earnings", ["100"]),
+        ("preferred.query_ticker", "query_ticker", [sample.ticker]),
+        (f"preferred.query_ticker[{len(sample.tickers)}]", "query_ticker", sample.tickers),
+        ("preferred.query_security", "query_security", [sample.name]),
+        ("preferred.query_list_history", "query_list_history", [sample.pref_list]),
+        ("preferred.query_earnings_for_ticker", "query_earnings_for_ticker", [sample.ticker]),
+        ("preferred.query_list_series", "query_list_series", [sample.pref_list, series_start, series_end]),
+    ]
+
+
+def uncovered_query_methods(sample):
+    covered = {case.split("[")[0] for case, function in database_cases(sample)}
+    return sorted(name for name in dir(Database) if name.startswith("query_") and name not in covered)
+
+
+def time_case(case, function, repeat):
+    timings = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # peak memory from one extra run, so tracing does not slow down the timed runs
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+    return BenchmarkResult(case, repeat, percentiles[49], percentiles[89], percentiles[98], max(timings),
+                           peak / 1024)
+
+
+def run_benchmarks(db, repeat=DEFAULT_REPEAT, sample=None):
+    import preferred
+
+    sample = choose_sample(db) if sample is None else sample
+    # the merged views read the same file twice, as if public and private held the same data
+    if db.attached_schema is None:
+        db.attach_database(db.path)
+    results = [time_case(case, lambda: function(db), repeat) for case, function in database_cases(sample)]
+
+    preferred.db, preferred.report = db, TextReport()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        results += [time_case(case, lambda: getattr(preferred, function_name)(*arguments), repeat)
+                    for case, function_name, arguments in report_cases(sample)]
+    return results
+
+
+def table_sizes(db):
+    return {table_name: db.run_query(f"SELECT COUNT(*) FROM {table_name}")[0][0]
+            for table_name in ["securities", "list_changes", "earnings_dates", "bloomberg_earnings_dates", "lists"]}
+
+
+def save_baseline(path, db, results):
+    with open(path, "w") as file:
+        json.dump({"table_sizes": table_sizes(db), "results": {result.case: result._asdict() for result in results}},
+                  file, indent=2, sort_keys=True)
+
+
+def print_results(results, baseline=None):
+    baseline_results = {} if baseline is None else baseline["results"]
+    for result in results:
+        comparison = ""
+        if result.case in baseline_results and baseline_results[result.case]["p50_ms"] > 0:
+            ratio = result.p50_ms / baseline_results[result.case]["p50_ms"]
+            comparison = f" {ratio:.2f}x baseline{' REGRESSION' if ratio > REGRESSION_RATIO else ''}"
+        print(f"{result.case}: p50 {result.p50_ms:.2f} ms, p90 {result.p90_ms:.2f} ms, p99 {result.p99_ms:.2f} ms, "
+              f"max {result.max_ms:.2f} ms, peak {result.peak_kib:.0f} KiB{comparison}")
+
+
+def parse_arguments(argv):
+    parser = ArgumentParser(description="Synthetic data generator and query benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic database")
+    generate_parser.add_argument("path")
+    generate_parser.add_argument("--securities", type=int, default=100000)
+    generate_parser.add_argument("--list-changes", type=int, default=5000000)
+    generate_parser.add_argument("--earnings-dates", type=int, default=1000000)
+    generate_parser.add_argument("--lists", type=int, default=300)
+    generate_parser.add_argument("--seed", type=int, default=1)
+
+    run_parser = subparsers.add_parser("run", help="time every query and report on a database")
+    run_parser.add_argument("path")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument("--baseline", metavar="FILE", help="compare against a baseline saved earlier")
+    run_parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    run_parser.add_argument("--cached", action="store_true", help="time warm runs with the result cache on")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+
+    if arguments.command == "generate":
+        start = time.perf_counter()
+        db = generate_database(arguments.path, arguments.securities, arguments.list_changes,
+                               arguments.earnings_dates, arguments.lists, arguments.seed)
+        print(f"Generated {table_sizes(db)} in {time.perf_counter() - start:.0f} s")
+        db.close()
+        return
+
+    db = Database(arguments.path, result_cache_bytes=DEFAULT_RESULT_CACHE_BYTES if arguments.cached else 0)
+    db.connect()
+    sample = choose_sample(db)
+    for method_name in uncovered_query_methods(sample):
+        print(f"No benchmark case for Database.{method_name}", file=sys.stderr)
+
+    results = run_benchmarks(db, arguments.repeat, sample)
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if arguments.save is not None:
+        save_baseline(arguments.save, db, results)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
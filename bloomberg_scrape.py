@@ -0,0 +1,54 @@
+import os
+from typing import NamedTuple
+
+from bulk_loader import BulkLoader, read_records
+from earnings_date import EarningsDate
+
+BLOOMBERG_DATES_KIND = "bloomberg_earnings_dates"
+BLOOMBERG_SCRAPE_FIELDS = ["ticker", "date", "name"]
+MANUAL_SCRAPE_SOURCE = "manual"
+
+BloombergScrapeResult = NamedTuple("BloombergScrapeResult", [("scrape_batch_id", int), ("ingested", int),
+                                                             ("new", int), ("rejected_rows", list)])
+
+
+class BloombergScrapeLoader(BulkLoader):
+    def __init__(self, db, *args, **kwargs):
+        super().__init__(db, *args, **kwargs)
+        self.scrape_batch_id = None
+        self.scraped_keys = set()
+
+    def load_scrape(self, path):
+        return self.load_scrape_records(read_records(path), os.path.basename(path))
+
+    def load_scrape_records(self, records, source):
+        # every scrape gets its own batch, rows already stored are moved into it instead of being duplicated
+        previous_max_bloomberg_date_id = self.db.query_max_bloomberg_date_id()
+        self.scrape_batch_id = self.db.insert_bloomberg_scrape_batch(source)
+        self.scraped_keys = set()
+
+        try:
+            result = self.load_records(BLOOMBERG_DATES_KIND, records, BLOOMBERG_SCRAPE_FIELDS,
+                                       self.parse_scrape_row, self.db.upsert_bloomberg_earnings_dates)
+            self.db.connection.commit()
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
+        return BloombergScrapeResult(self.scrape_batch_id, result.inserted,
+                                     self.db.query_number_of_bloomberg_dates_since(previous_max_bloomberg_date_id),
+                                     result.rejected_rows)
+
+    def parse_scrape_row(self, fields, record):
+        ticker, swiss_date, name = fields
+        earnings_date = EarningsDate(ticker, swiss_date)
+        key = (earnings_date.timestamp, self.lookup("securities", earnings_date.security), name.strip())
+        if key in self.scraped_keys:
+            raise ValueError("Duplicate of an earlier row in this scrape")
+
+        self.scraped_keys.add(key)
+        return (*key, self.scrape_batch_id)
+
+    @staticmethod
+    def example_input():
+        return "bloomberg_scrape.csv or APD.US 30.01.20 Earnings Announcement for Period Ending Q4/2019"
@@ -0,0 +1,129 @@
+import csv
+import json
+from typing import NamedTuple
+
+from earnings_date import EarningsDate
+from list_change import ListChange
+from security import Security
+
+DEFAULT_BATCH_SIZE = 5000
+CSV_FILE_EXTENSION = ".csv"
+JSONL_FILE_EXTENSION = ".jsonl"
+LOADER_FIELDS = {"securities": ["name", "ticker", "country", "ir_website", "currency"],
+                 "earnings_dates": ["ticker", "date"],
+                 "list_changes": ["ticker", "list", "event", "date"]}
+
+RejectedRow = NamedTuple("RejectedRow", [("line_number", int), ("reason", str)])
+BulkLoadResult = NamedTuple("BulkLoadResult", [("kind", str), ("inserted", int), ("rejected_rows", list)])
+
+
+def read_records(path):
+    if path.endswith(CSV_FILE_EXTENSION):
+        with open(path, newline="") as csv_file:
+            reader = csv.DictReader(csv_file)
+            for record in reader:
+                yield reader.line_num, record
+    elif path.endswith(JSONL_FILE_EXTENSION):
+        with open(path) as jsonl_file:
+            for line_number, line in enumerate(jsonl_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+    else:
+        raise ValueError(f"Unsupported file type {path}, expected {CSV_FILE_EXTENSION} or {JSONL_FILE_EXTENSION}")
+
+
+class BulkLoader:
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.primary_keys_by_ticker = {}
+        self.new_security_tickers = set()
+
+    def load(self, kind, path):
+        if kind not in LOADER_FIELDS:
+            raise ValueError(f"Unknown kind {kind}, expected one of {', '.join(LOADER_FIELDS)}")
+
+        result = self.load_records(kind, read_records(path), LOADER_FIELDS[kind], getattr(self, f"parse_{kind}_row"),
+                                   getattr(self.db, f"insert_{kind}"))
+        if kind == "securities":
+            # new securities got ids on insert, reload them on the next lookup
+            self.primary_keys_by_ticker.pop("securities", None)
+        return result
+
+    def load_records(self, kind, records, fields, row_parser, insert_rows):
+        inserted = 0
+        rejected_rows = []
+        batch = []
+
+        for line_number, record in records:
+            try:
+                if not isinstance(record, dict):
+                    raise ValueError(f"Malformed line: {record}")
+                batch.append(row_parser(self.required_fields(fields, record), record))
+            except ValueError as e:
+                rejected_rows.append(RejectedRow(line_number, str(e)))
+                continue
+
+            if self.batch_size is not None and len(batch) >= self.batch_size:
+                inserted += self.insert_batch(insert_rows, batch)
+                batch = []
+
+        if batch:
+            inserted += self.insert_batch(insert_rows, batch)
+        return BulkLoadResult(kind, inserted, rejected_rows)
+
+    def insert_batch(self, insert_rows, batch):
+        try:
+            inserted = insert_rows(batch)
+            self.db.connection.commit()
+            return inserted
+        except Exception:
+            self.db.connection.rollback()
+            raise
+
+    @staticmethod
+    def required_fields(fields, record):
+        missing_fields = [field for field in fields if not record.get(field)]
+        if missing_fields:
+            raise ValueError(f"Missing field(s): {', '.join(missing_fields)}")
+        return [str(record[field]) for field in fields]
+
+    def primary_keys(self, table_name):
+        if table_name not in self.primary_keys_by_ticker:
+            self.primary_keys_by_ticker[table_name] = self.db.query_primary_keys_by_ticker(table_name)
+        return self.primary_keys_by_ticker[table_name]
+
+    def lookup(self, table_name, ticker):
+        try:
+            return self.primary_keys(table_name)[ticker]
+        except KeyError:
+            raise ValueError(f"Unknown {table_name} ticker {ticker}")
+
+    def parse_securities_row(self, fields, record):
+        security = Security(*fields)
+        # reject repeated tickers here, a unique index violation would fail the whole batch
+        if security.ticker in self.primary_keys("securities") or security.ticker in self.new_security_tickers:
+            raise ValueError(f"Security {security.ticker} already exists")
+
+        row = (security.name, security.ticker, self.lookup("countries", security.country),
+               self.lookup("currencies", security.currency), security.ir_website)
+        self.new_security_tickers.add(security.ticker)
+        return row
+
+    def parse_earnings_dates_row(self, fields, record):
+        earnings_date = EarningsDate(*fields)
+        return self.lookup("securities", earnings_date.security), earnings_date.timestamp
+
+    def parse_list_changes_row(self, fields, record):
+        note = record.get("note")
+        list_change = ListChange(*fields, None if not note else str(note))
+        return (self.lookup("securities", list_change.security_ticker), self.lookup("lists", list_change.pref_list),
+                self.lookup("list_change_events", list_change.event), list_change.timestamp, list_change.note)
+
+    @staticmethod
+    def example_input():
+        return "list_changes changes.csv 1000"
@@ -0,0 +1,41 @@
+import sys
+from argparse import ArgumentParser
+from socket import AF_UNIX, SOCK_STREAM, socket
+
+# stdlib only and no database imports, so a command costs little more than interpreter startup
+from server import DEFAULT_SOCKET_PATH, decode_message, encode_message
+
+
+def parse_arguments(argv):
+    parser = ArgumentParser(description="Run menu commands on a running preferred.py --serve")
+    parser.add_argument("command", nargs="*", help="menu command and its arguments, read line by line from stdin "
+                                                   "if left out")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--json", action="store_true", help="print query results as JSON lines")
+    return parser.parse_args(argv)
+
+
+def run_commands(socket_path, commands, as_json=False):
+    with socket(AF_UNIX, SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile("rb") as responses:
+            for command in commands:
+                connection.sendall(encode_message({"command": command, "json": as_json}))
+                response = decode_message(responses.readline())
+                sys.stdout.write(response["stdout"])
+                sys.stderr.write(response["stderr"])
+                sys.stdout.flush()
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    commands = [" ".join(arguments.command)] if arguments.command else \
+        (line.strip() for line in sys.stdin if line.strip())
+    try:
+        run_commands(arguments.socket, commands, arguments.json)
+    except (ConnectionError, FileNotFoundError) as e:
+        sys.exit(f"Could not reach server on {arguments.socket}. Reason: {e}")
+
+
+if __name__ == "__main__":
+    main()
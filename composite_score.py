@@ -0,0 +1,87 @@
+SECURITY_SCORES_TABLE = "security_scores"
+SCORE_EPOCH_TABLE = "security_scores_epoch"
+SCORE_HALF_LIFE_DAYS = 30
+# decay is stored relative to the epoch in SCORE_EPOCH_TABLE, so stored scores keep their order as time passes and
+# only need one common factor to be read at the current time; scores stored before the table existed use 01.01.20
+SCORE_EPOCH = 1577836800
+# the epoch is moved forward once it is this far behind, the factor then is 2 ** 12, far from overflowing
+SCORE_REBASE_DAYS = 360
+# a weight value of -2 halves a score, +2 multiplies it by 1.5
+WEIGHT_SCALE = 4.0
+
+
+def score_decay(timestamp, epoch):
+    return 2.0 ** ((timestamp - epoch) / (SCORE_HALF_LIFE_DAYS * 86400.0))
+
+
+def weight_factor(weight_value):
+    # lists without a parent, or rows without a weight, leave the score unchanged
+    return 1.0 if weight_value is None else 1.0 + weight_value / WEIGHT_SCALE
+
+
+def register_score_functions(connection):
+    # python functions instead of sqlite's pow(), which is missing from builds without the math functions
+    connection.create_function("score_decay", 2, score_decay, deterministic=True)
+    connection.create_function("weight_factor", 1, weight_factor, deterministic=True)
+
+
+# event_score is the decayed and list weighted sum of a security's events, score adds its country and currency weight
+SECURITY_SCORE_FACTORS_SQL = ("weight_factor((SELECT w.value FROM countries co, weights w "
+                              "WHERE co.country_id = s.country_id AND w.weight_id = co.weight_id)) * "
+                              "weight_factor((SELECT w.value FROM currencies cu, weights w "
+                              "WHERE cu.currency_id = s.currency_id AND w.weight_id = cu.weight_id))")
+SCORE_EPOCH_SQL = f"(SELECT epoch FROM {SCORE_EPOCH_TABLE})"
+# correlated on list_changes c and list_change_events e
+LIST_CHANGE_SCORE_SQL = (f"e.value * score_decay(c.date_epoch, {SCORE_EPOCH_SQL}) * "
+                         "weight_factor((SELECT w.value FROM lists l, weights w "
+                         "WHERE l.list_id = c.list_id AND w.weight_id = l.weight_id)) * "
+                         "weight_factor((SELECT w.value FROM lists l, lists p, weights w WHERE l.list_id = c.list_id "
+                         "AND p.list_id = l.parent_list_id AND w.weight_id = p.weight_id))")
+# condition on list_changes c narrows the securities
+SECURITY_SCORES_FROM_CHANGES_SQL = (f"SELECT s.security_id, x.event_score, x.event_score * {SECURITY_SCORE_FACTORS_SQL} "
+                                    f"FROM (SELECT c.security_id, SUM({LIST_CHANGE_SCORE_SQL}) AS event_score "
+                                    "FROM list_changes c, list_change_events e WHERE e.event_id = c.event_id "
+                                    "{condition} GROUP BY c.security_id) x, securities s "
+                                    "WHERE s.security_id = x.security_id")
+# parameters: list_id, date_epoch, event_id, security_id of one new list change
+ADD_LIST_CHANGE_SCORE_SQL = (f"INSERT INTO {SECURITY_SCORES_TABLE}(security_id, event_score, score) "
+                             f"SELECT s.security_id, x.event_score, x.event_score * {SECURITY_SCORE_FACTORS_SQL} "
+                             f"FROM (SELECT {LIST_CHANGE_SCORE_SQL} AS event_score FROM "
+                             "(SELECT ? AS list_id, ? AS date_epoch) c, list_change_events e WHERE e.event_id = ?) x, "
+                             "securities s WHERE s.security_id = ? ON CONFLICT(security_id) DO UPDATE SET "
+                             "event_score = event_score + excluded.event_score, score = score + excluded.score")
+REBUILD_SECURITY_SCORES_STATEMENTS = [
+    f"DELETE FROM {SECURITY_SCORES_TABLE}",
+    f"INSERT INTO {SECURITY_SCORES_TABLE}(security_id, event_score, score) "
+    f"{SECURITY_SCORES_FROM_CHANGES_SQL.format(condition='')}"]
+# parameters: weight_id of a changed weight twice; a list or parent list weight changes the event scores of the
+# securities with changes on the list, a country or currency weight only their score factor
+UPDATE_WEIGHT_SCORES_STATEMENTS = [
+    f"INSERT INTO {SECURITY_SCORES_TABLE}(security_id, event_score, score) "
+    + SECURITY_SCORES_FROM_CHANGES_SQL.format(
+        condition="AND c.security_id IN (SELECT w.security_id FROM list_changes w WHERE w.list_id IN "
+                  "(SELECT l.list_id FROM lists l LEFT JOIN lists p ON p.list_id = l.parent_list_id "
+                  "WHERE l.weight_id = ? OR p.weight_id = ?))")
+    + " ON CONFLICT(security_id) DO UPDATE SET event_score = excluded.event_score, score = excluded.score",
+    f"UPDATE {SECURITY_SCORES_TABLE} SET score = event_score * (SELECT {SECURITY_SCORE_FACTORS_SQL} "
+    f"FROM securities s WHERE s.security_id = {SECURITY_SCORES_TABLE}.security_id) WHERE security_id IN "
+    "(SELECT s.security_id FROM securities s LEFT JOIN countries co ON co.country_id = s.country_id "
+    "LEFT JOIN currencies cu ON cu.currency_id = s.currency_id WHERE co.weight_id = ? OR cu.weight_id = ?)"]
+
+# parameters: the new epoch; scores are divided by the decay between the old and the new epoch
+REBASE_SECURITY_SCORES_STATEMENTS = [
+    f"UPDATE {SECURITY_SCORES_TABLE} SET event_score = event_score / score_decay(?1, {SCORE_EPOCH_SQL}), "
+    f"score = score / score_decay(?1, {SCORE_EPOCH_SQL})",
+    f"UPDATE {SCORE_EPOCH_TABLE} SET epoch = ?1"]
+# one row, created by the scores migration and by the epoch migration for files that already had scores
+SCORE_EPOCH_STATEMENTS = [
+    f"CREATE TABLE IF NOT EXISTS {SCORE_EPOCH_TABLE} (epoch integer NOT NULL)",
+    f"INSERT INTO {SCORE_EPOCH_TABLE}(epoch) SELECT {SCORE_EPOCH} WHERE NOT EXISTS (SELECT 1 FROM {SCORE_EPOCH_TABLE})"]
+
+
+def security_scores_statements(connection):
+    register_score_functions(connection)
+    return [f"CREATE TABLE IF NOT EXISTS {SECURITY_SCORES_TABLE} (security_id integer PRIMARY KEY, "
+            "event_score real NOT NULL, score real NOT NULL, FOREIGN KEY(security_id) REFERENCES securities(security_id))",
+            f"CREATE INDEX IF NOT EXISTS security_scores_score_index ON {SECURITY_SCORES_TABLE}(score)",
+            *SCORE_EPOCH_STATEMENTS, *REBUILD_SECURITY_SCORES_STATEMENTS]
@@ -1,14 +1,99 @@
+import json
+import threading
 import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from sqlite3 import connect, IntegrityError
 from typing import NamedTuple
 
-from date_util import timestamp_to_swiss_date, days_to_seconds
+from composite_score import (ADD_LIST_CHANGE_SCORE_SQL, REBASE_SECURITY_SCORES_STATEMENTS,
+                             REBUILD_SECURITY_SCORES_STATEMENTS, register_score_functions, score_decay,
+                             SCORE_EPOCH_TABLE, SCORE_REBASE_DAYS, SECURITY_SCORES_TABLE,
+                             UPDATE_WEIGHT_SCORES_STATEMENTS)
+from date_util import timestamp_to_swiss_date, days_to_seconds, start_of_day
+from dual_database import (attached_database_statements, attached_ids_statements, detached_database_statements,
+                           MAIN_SOURCE, RECONCILED_TABLES)
+from migrations import upgrade
+from query_stats import QueryStatistics
+from reference_cache import ReferenceDataCache, REFERENCE_TABLES
+from result_cache import DEFAULT_FRESHNESS_SECONDS, DEFAULT_RESULT_CACHE_BYTES, ResultCache
+from security_search import (ensure_securities_search_index, fuzzy_query, min_shared_trigrams, phrase_query,
+                             SECURITIES_SEARCH_TABLE, text_trigrams, TRIGRAM_LENGTH)
 from time_factor_calculator import TimeFactorCalculator
 
 BLOOMBERG_DATES_TABLE = "bloomberg_earnings_dates"
 NATIVE_DATES_TABLE = "earnings_dates"
 READ_FILE_OPEN_MODE = "r"
+LIST_MEMBERSHIPS_TABLE = "list_memberships"
+# net event sign and latest change per (list, security) as derived from the full list_changes event log
+LIST_MEMBERSHIPS_FROM_CHANGES_SQL = ("SELECT c.list_id, c.security_id, SUM(e.value_sign), MAX(c.date_epoch), c.note "
+                                     "FROM list_changes c, list_change_events e WHERE e.event_id = c.event_id "
+                                     "GROUP BY c.list_id, c.security_id")
+STATEMENT_CACHE_SIZE = 256
+# read-only connections for queries run in parallel, writes stay on the single writer connection
+DEFAULT_READ_CONNECTIONS = 4
+INSERT_SECURITY_SQL = ("INSERT INTO securities(name, ticker, country_id, currency_id, ir_website) "
+                       "VALUES (?, ?, ?, ?, ?)")
+INSERT_EARNINGS_DATE_SQL = "INSERT INTO earnings_dates(security_id, date_epoch) VALUES (?, ?)"
+INSERT_SECURITY_ALT_NAME_SQL = "INSERT INTO securities_alt_names(alt_name, security_id) VALUES (?, ?)"
+INSERT_LIST_CHANGE_SQL = ("INSERT INTO list_changes(security_id, list_id, event_id, date_epoch, note) "
+                          "VALUES (?, ?, ?, ?, ?)")
+# parameters: list_id, security_id, date_epoch, note, event_id
+UPDATE_LIST_MEMBERSHIP_SQL = (f"INSERT INTO {LIST_MEMBERSHIPS_TABLE}(list_id, security_id, value_sign, since_epoch, "
+                              "note) SELECT ?, ?, value_sign, ?, ? FROM list_change_events WHERE event_id = ? "
+                              "ON CONFLICT(list_id, security_id) DO UPDATE SET "
+                              "value_sign = value_sign + excluded.value_sign, "
+                              "note = CASE WHEN excluded.since_epoch > since_epoch THEN excluded.note ELSE note END, "
+                              "since_epoch = MAX(since_epoch, excluded.since_epoch)")
+# parameters: date_epoch, security_id, name, scrape_batch_id
+UPSERT_BLOOMBERG_EARNINGS_DATE_SQL = ("INSERT INTO bloomberg_earnings_dates(date_epoch, security_id, name, "
+                                      "scrape_batch_id) VALUES (?, ?, ?, ?) "
+                                      "ON CONFLICT(date_epoch, security_id, name) DO UPDATE SET "
+                                      "scrape_batch_id = excluded.scrape_batch_id")
+# correlated on securities s, the latest scrape batch wins and within it the latest date, re-scraped older dates
+# move into the new batch with their old ids
+NEWEST_BLOOMBERG_DATE_ID_SQL = ("SELECT bloomberg_date_id FROM bloomberg_earnings_dates "
+                                "WHERE security_id = s.security_id "
+                                "ORDER BY scrape_batch_id DESC, date_epoch DESC LIMIT 1")
+DEFAULT_SEARCH_LIMIT = 20
+# parameters: match query, prefix pattern twice, limit; one row per security, ticker or name prefix matches first
+SEARCH_SECURITIES_SQL = ("SELECT s.ticker, s.name, s.ir_website FROM (SELECT security_id, "
+                         "MIN(CASE WHEN ticker LIKE ? OR name LIKE ? THEN 0 ELSE 1 END) AS prefix_rank, "
+                         f"MIN(rank) AS match_rank FROM {SECURITIES_SEARCH_TABLE} "
+                         f"WHERE {SECURITIES_SEARCH_TABLE} MATCH ? GROUP BY security_id) f, securities s "
+                         "WHERE s.security_id = f.security_id ORDER BY f.prefix_rank, f.match_rank, s.ticker LIMIT ?")
+# parameters: trigrams of the text as JSON, match query, minimum shared trigrams, limit; one row per security,
+# the names sharing the most trigrams first
+SEARCH_SECURITIES_FUZZY_SQL = ("SELECT s.ticker, s.name, s.ir_website FROM (SELECT security_id, MAX(shared) AS shared, "
+                               "MIN(match_rank) AS match_rank FROM (SELECT security_id, rank AS match_rank, "
+                               "(SELECT COUNT(*) FROM json_each(?) t WHERE instr(lower(name), t.value) > 0 "
+                               "OR instr(lower(ticker), t.value) > 0) AS shared "
+                               f"FROM {SECURITIES_SEARCH_TABLE} WHERE {SECURITIES_SEARCH_TABLE} MATCH ?) "
+                               "GROUP BY security_id) f, securities s WHERE s.security_id = f.security_id "
+                               "AND f.shared >= ? ORDER BY f.shared DESC, f.match_rank, s.ticker LIMIT ?")
+# parameters: pattern three times, prefix pattern twice, limit; used for texts shorter than a trigram
+SEARCH_SECURITIES_LIKE_SQL = ("SELECT s.ticker, s.name, s.ir_website FROM securities s WHERE s.ticker LIKE ? "
+                              "OR s.name LIKE ? OR EXISTS (SELECT 1 FROM securities_alt_names a "
+                              "WHERE a.security_id = s.security_id AND a.alt_name LIKE ?) "
+                              "ORDER BY CASE WHEN s.ticker LIKE ? OR s.name LIKE ? THEN 0 ELSE 1 END, s.ticker LIMIT ?")
+# deeper than any real list hierarchy, stops the recursion should parent_list_id ever form a cycle
+MAX_LIST_DEPTH = 32
+# parameters: root list_id, MAX_LIST_DEPTH; sort_path orders depth first by ticker, id_path finds the subtree of a node
+LIST_TREE_CTE_SQL = ("WITH RECURSIVE tree(list_id, depth, sort_path, id_path) AS ("
+                     "SELECT list_id, 0, ticker, '/' || list_id || '/' FROM lists WHERE list_id = ? UNION ALL "
+                     "SELECT l.list_id, t.depth + 1, t.sort_path || '/' || l.ticker, t.id_path || l.list_id || '/' "
+                     "FROM lists l, tree t WHERE l.parent_list_id = t.list_id AND t.depth < ?) ")
+STREAM_BATCH_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_ATTACHED_SCHEMA = "public"
+# quarterly reporters have a date at least every ~90 days, a previous date older than this misses a quarter
+STALE_EARNINGS_DAYS = 120
+# a Bloomberg date this close to a native date confirms it
+EARNINGS_DATE_TOLERANCE_DAYS = 3
+# written by triggers on the tables they are derived from
+TRIGGER_MAINTAINED_TABLES = {SECURITIES_SEARCH_TABLE: ("securities", "securities_alt_names")}
+CACHED_STATEMENT_PREFIXES = ("SELECT", "WITH")
 
 ListInfoResult = namedtuple("ListInfoResult", ["name", "weight", "parent_list_weight"])
 ListComponentDateResult = NamedTuple("ListComponentDateResult", [("name", str), ("ticker", str),
@@ -27,50 +112,275 @@ SecurityHistoryResult = NamedTuple("SecurityHistoryResult", [("list_name", str),
                                                              ("event_date_timestamp", int), ("pref_list", str),
                                                              ("event_note", str)])
 SecurityCountryResult = namedtuple("SecurityCountryResult", ["ticker", "name", "ir_website", "country"])
+ListMembershipMismatchResult = NamedTuple("ListMembershipMismatchResult", [("list_id", int), ("security_id", int),
+                                                                           ("expected", tuple), ("actual", tuple)])
 ListAggregateSignResult = NamedTuple("ListAggregateSignResult", [("name", str), ("ticker", str),
                                                                  ("aggregate_event_value_sign", int)])
+ListSetResult = NamedTuple("ListSetResult", [("name", str), ("ticker", str), ("number_of_lists", int),
+                                             ("first_added_timestamp", int), ("last_added_timestamp", int)])
+ListTreeResult = NamedTuple("ListTreeResult", [("ticker", str), ("name", str), ("depth", int), ("parent_list", str),
+                                               ("weight", str), ("parent_list_weight", str), ("effective_weight", int),
+                                               ("points", int), ("subtree_points", int)])
+SourceComponentResult = NamedTuple("SourceComponentResult", [("name", str), ("ticker", str), ("sources", str),
+                                                             ("latest_change_timestamp", int)])
+SourceDateResult = NamedTuple("SourceDateResult", [("source", str), ("table", str), ("date_timestamp", int)])
+MissingEarningsResult = NamedTuple("MissingEarningsResult", [("name", str), ("ticker", str), ("ir_website", str),
+                                                             ("number_of_lists", int), ("points", int),
+                                                             ("next_date_timestamp", int),
+                                                             ("previous_date_timestamp", int),
+                                                             ("bloomberg_date_timestamp", int), ("missing_next", bool),
+                                                             ("stale_previous", bool), ("bloomberg_mismatch", bool)])
+CompositeScoreResult = NamedTuple("CompositeScoreResult", [("name", str), ("ticker", str), ("score", float)])
+ChangeEventResult = NamedTuple("ChangeEventResult", [("pref_list", str), ("name", str), ("ticker", str),
+                                                     ("event_value", int), ("event_value_sign", int),
+                                                     ("event_date_timestamp", int)])
+UpcomingEarningsResult = NamedTuple("UpcomingEarningsResult", [("date_timestamp", int), ("sources", str),
+                                                               ("name", str), ("ticker", str), ("lists", str)])
+DatesSummaryResult = NamedTuple("DatesSummaryResult", [("ticker", str), ("ir_website", str),
+                                                       ("next_date_timestamp", int), ("previous_date_timestamp", int),
+                                                       ("bloomberg_date_timestamp", int)])
 
 
 class Database:
-    def __init__(self, path):
+    def __init__(self, path, read_connections=DEFAULT_READ_CONNECTIONS, result_cache_bytes=DEFAULT_RESULT_CACHE_BYTES,
+                 freshness_seconds=DEFAULT_FRESHNESS_SECONDS):
         self.path = path
         self.connection = None
         self.cursor = None
+        self.number_of_read_connections = read_connections
+        self.read_connections = Queue()
+        self.executor = None
+        # set to a read connection while a worker thread runs a parallel call
+        self.local = threading.local()
+        self.schema_version = None
+        self.has_search_index = False
+        self.attached_schema = None
+        self.reference_data = ReferenceDataCache(self)
+        self.primary_key_columns = {}
+        self.query_statistics = QueryStatistics()
+        self.result_cache = ResultCache(result_cache_bytes)
+        self.freshness_seconds = freshness_seconds
+        # PRAGMA data_version per schema as last seen, it changes when another connection commits to the file
+        self.data_versions = {}
 
+    def connect(self):
         try:
             # sqlite will create a new db if file doesn't exist, check before connecting
             open(self.path, READ_FILE_OPEN_MODE).close()
         except IOError:
             raise IOError("Couldn't find database file.")
 
-    def connect(self):
-        self.connection = connect(self.path)
+        self.connection = connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
         self.connection.text_factory = str
+        # readers in wal mode see the last commit and don't block the writer, nor does it block them
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        register_score_functions(self.connection)
         self.cursor = self.connection.cursor()
-        print(f"Database connection established: {self.path}")
+        self.schema_version = upgrade(self.connection)
+        self.has_search_index = ensure_securities_search_index(self.connection)
+        self.rebase_security_scores()
+        self.open_read_connections()
+        self.result_cache.set_table_names(name for name, in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"))
+        self.data_versions = self.current_data_versions()
+        self.reference_data.load()
+        print(f"Database connection established: {self.path} (schema version {self.schema_version})")
+
+    def attach_database(self, path, schema=DEFAULT_ATTACHED_SCHEMA):
+        # a second file on the writer connection, read through the merged all_* views; read connections don't
+        # attach it, so queries on the views must not go through run_parallel
+        try:
+            open(path, READ_FILE_OPEN_MODE).close()
+        except IOError:
+            raise IOError(f"Couldn't find database file: {path}")
+
+        if self.attached_schema is not None:
+            self.detach_database()
+        self.connection.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        # the merged views name main tables, results read from an earlier attached file would look valid
+        self.result_cache.clear()
+        self.attached_schema = schema
+        for statement in attached_database_statements(schema):
+            self.cursor.execute(statement)
+        self.connection.commit()
+        self.data_versions = self.current_data_versions()
+
+    def current_data_versions(self):
+        schemas = ["main"] if self.attached_schema is None else ["main", self.attached_schema]
+        return {schema: self.connection.execute(f"PRAGMA {schema}.data_version").fetchone()[0] for schema in schemas}
+
+    def refresh_if_changed_externally(self):
+        # writes of other processes don't go through record_write, all cached results and reference rows are
+        # dropped once one of them committed; returns whether they were
+        data_versions = self.current_data_versions()
+        changed = data_versions != self.data_versions
+        if changed:
+            self.result_cache.clear()
+            self.reference_data.invalidate()
+            if self.attached_schema is not None:
+                self.reconcile_attached_ids()
+        self.data_versions = data_versions
+        return changed
+
+    def reconcile_attached_ids(self):
+        # rows added to either file since the attach get their reconciled id, without one the merged views drop them;
+        # joins the caller's transaction if there is one
+        in_transaction = self.connection.in_transaction
+        for statement in attached_ids_statements(self.attached_schema):
+            self.cursor.execute(statement)
+        if not in_transaction:
+            self.connection.commit()
+
+    def detach_database(self):
+        for statement in detached_database_statements():
+            self.cursor.execute(statement)
+        self.connection.commit()
+        self.connection.execute(f"DETACH DATABASE {self.attached_schema}")
+        self.result_cache.clear()
+        self.attached_schema = None
+        self.data_versions = self.current_data_versions()
+
+    def sources(self, include_main=True, include_attached=True):
+        # source names as found in the merged views' source column
+        return [source for source, included in ((MAIN_SOURCE, include_main), (self.attached_schema, include_attached))
+                if included and source is not None]
+
+    def open_read_connections(self):
+        # opened after the upgrade, so readers never see an older schema
+        for unused in range(self.number_of_read_connections):
+            connection = connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False,
+                                 cached_statements=STATEMENT_CACHE_SIZE)
+            connection.text_factory = str
+            register_score_functions(connection)
+            self.read_connections.put(connection)
+        if self.number_of_read_connections:
+            self.executor = ThreadPoolExecutor(self.number_of_read_connections)
 
     def close(self):
+        if self.connection is None:
+            return
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        while not self.read_connections.empty():
+            self.read_connections.get().close()
         self.cursor.close()
         self.connection.close()
+        self.connection, self.cursor = None, None
         print(f"Database connection closed: {self.path}")
 
-    def run_query(self, sql):
-        self.cursor.execute(sql)
-        return self.cursor.fetchall()
+    def current_connection(self):
+        return getattr(self.local, "connection", None) or self.connection
+
+    def bucketed_time(self):
+        # the current time for time dependent queries, rounded down so their sql and parameters repeat within the
+        # freshness window and hit the result cache
+        current_time = int(time.time())
+        if self.result_cache.max_bytes and self.freshness_seconds:
+            return current_time - current_time % self.freshness_seconds
+        return current_time
+
+    def caches_result(self, sql, parameters):
+        # reads inside an open transaction may see writes that are rolled back without a record_write
+        return (self.result_cache.max_bytes > 0 and not self.connection.in_transaction
+                and sql.lstrip().upper().startswith(CACHED_STATEMENT_PREFIXES)
+                and all(isinstance(value, (int, float, str, bytes, type(None))) for value in parameters))
+
+    def run_query(self, sql, parameters=()):
+        # keep sql texts fixed and bind values, so the connection's statement cache is reused across calls
+        cached = self.caches_result(sql, parameters)
+        if cached:
+            parameters = tuple(parameters)
+            results = self.result_cache.get(sql, parameters)
+            if results is not None:
+                # a copy, callers may change the list they get
+                return list(results)
+            generations = self.result_cache.write_generations(sql)
+
+        start = time.perf_counter()
+        read_connection = getattr(self.local, "connection", None)
+        cursor = self.cursor if read_connection is None else read_connection.cursor()
+        cursor.execute(sql, parameters)
+        results = cursor.fetchall()
+        self.query_statistics.record_query(sql, parameters, time.perf_counter() - start, len(results),
+                                           self.explain_query_plan)
+        if cached:
+            self.result_cache.put(sql, parameters, list(results), generations)
+        return results
+
+    def stream_query(self, sql, parameters=()):
+        # rows in batches from a cursor of its own, for results too long to hold in a list; other queries may run
+        # while the stream is consumed
+        start, number_of_rows = time.perf_counter(), 0
+        cursor = self.current_connection().cursor()
+        cursor.arraysize = STREAM_BATCH_SIZE
+        try:
+            cursor.execute(sql, parameters)
+            for rows in iter(cursor.fetchmany, []):
+                number_of_rows += len(rows)
+                yield from rows
+        finally:
+            cursor.close()
+            self.query_statistics.record_query(sql, parameters, time.perf_counter() - start, number_of_rows,
+                                               self.explain_query_plan)
+
+    def explain_query_plan(self, sql, parameters=()):
+        # plan steps as indented lines, children below their parent step
+        depths = {0: -1}
+        plan = []
+        for step_id, parent_id, unused, detail in self.current_connection().execute(f"EXPLAIN QUERY PLAN {sql}",
+                                                                                      parameters):
+            depths[step_id] = depths.get(parent_id, -1) + 1
+            plan.append(f"{'  ' * depths[step_id]}{detail}")
+        return plan
+
+    def run_parallel(self, *calls):
+        # independent read-only calls (query methods without arguments left, e.g. partials) run on the read
+        # connections, results come back in call order; they only see committed writes
+        if self.executor is None or len(calls) < 2 or getattr(self.local, "connection", None) is not None:
+            # nested calls run in the worker they are in, waiting for further workers could exhaust the pool
+            return [call() for call in calls]
+
+        # loaded here, so workers don't all load it at once
+        self.reference_data.ensure_loaded()
+        return list(self.executor.map(self.run_on_read_connection, calls))
+
+    def run_on_read_connection(self, call):
+        connection = self.read_connections.get()
+        self.local.connection = connection
+        try:
+            return call()
+        finally:
+            self.local.connection = None
+            self.read_connections.put(connection)
+
+    def record_write(self, *table_names):
+        # every write path reports the tables it touched, so derived in-memory state can be dropped
+        if not REFERENCE_TABLES.keys().isdisjoint(table_names):
+            self.reference_data.invalidate()
+        if self.attached_schema is not None and not RECONCILED_TABLES.keys().isdisjoint(table_names):
+            self.reconcile_attached_ids()
+        self.result_cache.record_write(*table_names, *(derived_table for derived_table, source_tables
+                                                       in TRIGGER_MAINTAINED_TABLES.items()
+                                                       if not set(source_tables).isdisjoint(table_names)))
 
     def get_primary_key_for_table(self, table_name):
-        columns_in_table = self.run_query(f"PRAGMA table_info({table_name})")
-        cid, name, column_type, notnull, dflt_value, pk = next(column for column in columns_in_table)
-        if pk == 1:
-            return name
+        if table_name not in self.primary_key_columns:
+            columns_in_table = self.run_query(f"PRAGMA table_info({table_name})")
+            cid, name, column_type, notnull, dflt_value, pk = next(column for column in columns_in_table)
+            self.primary_key_columns[table_name] = name if pk == 1 else None
+        return self.primary_key_columns[table_name]
 
     def get_primary_key_value_for_ticker(self, table_name, ticker):
         return self.get_primary_key_value_for_column(table_name, "ticker", ticker)
 
     def get_primary_key_value_for_column(self, table_name, column_name, column_value):
+        if table_name in REFERENCE_TABLES and column_name == "ticker":
+            return self.reference_data.primary_key_for_ticker(table_name, column_value)
+
         primary_key_column_name = self.get_primary_key_for_table(table_name)
         row_matches_list = self.run_query(f"SELECT {primary_key_column_name} FROM {table_name} "
-                                          f"WHERE {column_name} = '{column_value}'")
+                                          f"WHERE {column_name} = ?", (column_value,))
 
         if len(row_matches_list) == 1:
             primary_key_column_value = row_matches_list[0][0]
@@ -86,10 +396,10 @@ class Database:
             print(f"Could not insert security. Reason: {e}")
 
         try:
-            self.cursor.execute("INSERT INTO securities(name, ticker, country_id, currency_id, ir_website) "
-                                "VALUES (?, ?, ?, ?, ?)",
+            self.cursor.execute(INSERT_SECURITY_SQL,
                                 (security.name, security.ticker, country_id, currency_id, security.ir_website))
             self.connection.commit()
+            self.record_write("securities")
         except IntegrityError as e:
             print(f"Integrity Error: {e}, primary key value: {security.ticker}")
 
@@ -99,9 +409,15 @@ class Database:
         except Exception as e:
             print(f"Could not insert earnings date. Reason: {e}")
 
-        self.cursor.execute("INSERT INTO earnings_dates(security_id, date_epoch) VALUES (?, ?)",
-                            (security_id, earnings_date.timestamp))
+        self.cursor.execute(INSERT_EARNINGS_DATE_SQL, (security_id, earnings_date.timestamp))
+        self.connection.commit()
+        self.record_write(NATIVE_DATES_TABLE)
+
+    def insert_security_alt_name(self, ticker, alt_name):
+        security_id = self.get_primary_key_value_for_ticker("securities", ticker)
+        self.cursor.execute(INSERT_SECURITY_ALT_NAME_SQL, (alt_name, security_id))
         self.connection.commit()
+        self.record_write("securities_alt_names")
 
     def insert_list_change(self, list_change):
         try:
@@ -112,120 +428,483 @@ class Database:
             print(f"Could not insert list change. Reason: {e}")
             return
 
-        self.cursor.execute("INSERT INTO list_changes(security_id, list_id, event_id, date_epoch) "
-                            "VALUES (?, ?, ?, ?)", (security_id, list_id, event_id, list_change.timestamp))
+        self.cursor.execute(INSERT_LIST_CHANGE_SQL,
+                            (security_id, list_id, event_id, list_change.timestamp, list_change.note))
+        self.update_list_membership(list_id, security_id, event_id, list_change.timestamp, list_change.note)
+        self.cursor.execute(ADD_LIST_CHANGE_SCORE_SQL, (list_id, list_change.timestamp, event_id, security_id))
         self.connection.commit()
+        self.record_write("list_changes", LIST_MEMBERSHIPS_TABLE, SECURITY_SCORES_TABLE)
 
-    def query_list_info(self, pref_list):
-        list_info = self.run_query("SELECT l1.name, w1.name, w2.name FROM lists l1, weights w1, weights w2 "
-                                   "LEFT JOIN lists l2 ON l1.parent_list_id = l2.list_id "
-                                   f"WHERE l1.ticker = '{pref_list}' AND l1.weight_id = w1.weight_id "
-                                   "AND l2.weight_id = w2.weight_id")
+    def update_list_membership(self, list_id, security_id, event_id, timestamp, note):
+        # caller commits, so the membership row changes in the same transaction as the list change itself
+        self.cursor.execute(UPDATE_LIST_MEMBERSHIP_SQL, (list_id, security_id, timestamp, note, event_id))
+
+    def query_primary_keys_by_ticker(self, table_name):
+        if table_name in REFERENCE_TABLES:
+            return self.reference_data.primary_keys_by_ticker(table_name)
+
+        primary_key_column_name = self.get_primary_key_for_table(table_name)
+        return dict(self.run_query(f"SELECT ticker, {primary_key_column_name} FROM {table_name}"))
+
+    def insert_bloomberg_scrape_batch(self, source):
+        self.cursor.execute("INSERT INTO bloomberg_scrape_batches(scraped_epoch, source) VALUES (?, ?)",
+                            (int(time.time()), source))
+        self.record_write("bloomberg_scrape_batches")
+        return self.cursor.lastrowid
+
+    # bulk inserts below don't commit, the caller decides how many rows go into one transaction
+
+    def insert_securities(self, security_rows):
+        self.cursor.executemany(INSERT_SECURITY_SQL, security_rows)
+        self.record_write("securities")
+        return self.cursor.rowcount
+
+    def insert_earnings_dates(self, earnings_date_rows):
+        self.cursor.executemany(INSERT_EARNINGS_DATE_SQL, earnings_date_rows)
+        self.record_write(NATIVE_DATES_TABLE)
+        return self.cursor.rowcount
+
+    def insert_list_changes(self, list_change_rows):
+        self.cursor.executemany(INSERT_LIST_CHANGE_SQL, list_change_rows)
+        number_of_list_changes = self.cursor.rowcount
+        self.cursor.executemany(UPDATE_LIST_MEMBERSHIP_SQL,
+                                [(list_id, security_id, timestamp, note, event_id)
+                                 for security_id, list_id, event_id, timestamp, note in list_change_rows])
+        self.cursor.executemany(ADD_LIST_CHANGE_SCORE_SQL,
+                                [(list_id, timestamp, event_id, security_id)
+                                 for security_id, list_id, event_id, timestamp, note in list_change_rows])
+        self.record_write("list_changes", LIST_MEMBERSHIPS_TABLE, SECURITY_SCORES_TABLE)
+        return number_of_list_changes
+
+    def upsert_bloomberg_earnings_dates(self, bloomberg_date_rows):
+        self.cursor.executemany(UPSERT_BLOOMBERG_EARNINGS_DATE_SQL, bloomberg_date_rows)
+        self.record_write(BLOOMBERG_DATES_TABLE)
+        return self.cursor.rowcount
+
+    def query_number_of_bloomberg_dates_since(self, bloomberg_date_id):
+        return self.run_query("SELECT COUNT(*) FROM bloomberg_earnings_dates WHERE bloomberg_date_id > ?",
+                              (bloomberg_date_id,))[0][0]
+
+    def query_max_bloomberg_date_id(self):
+        return self.run_query("SELECT COALESCE(MAX(bloomberg_date_id), 0) FROM bloomberg_earnings_dates")[0][0]
+
+    def rebuild_list_memberships(self):
+        self.cursor.execute(f"DELETE FROM {LIST_MEMBERSHIPS_TABLE}")
+        self.cursor.execute(f"INSERT INTO {LIST_MEMBERSHIPS_TABLE}(list_id, security_id, value_sign, since_epoch, "
+                            f"note) {LIST_MEMBERSHIPS_FROM_CHANGES_SQL}")
+        number_of_memberships = self.cursor.rowcount
+        self.connection.commit()
+        self.record_write(LIST_MEMBERSHIPS_TABLE)
+        return number_of_memberships
+
+    def rebuild_security_scores(self):
+        for statement in REBUILD_SECURITY_SCORES_STATEMENTS:
+            self.cursor.execute(statement)
+        number_of_scores = self.cursor.rowcount
+        self.connection.commit()
+        self.record_write(SECURITY_SCORES_TABLE)
+        return number_of_scores
+
+    def query_score_epoch(self):
+        return self.run_query(f"SELECT epoch FROM {SCORE_EPOCH_TABLE}")[0][0]
+
+    def rebase_security_scores(self, current_time=None):
+        # stored scores grow with the decay since the epoch, moving it to the current day on connect keeps them far
+        # from overflowing; the scores read at any time stay the same
+        current_time = int(time.time()) if current_time is None else current_time
+        if current_time - self.query_score_epoch() < days_to_seconds(SCORE_REBASE_DAYS):
+            return False
+        for statement in REBASE_SECURITY_SCORES_STATEMENTS:
+            self.cursor.execute(statement, (start_of_day(current_time),))
+        self.connection.commit()
+        self.record_write(SECURITY_SCORES_TABLE, SCORE_EPOCH_TABLE)
+        return True
+
+    def update_weight_value(self, weight_name, value):
+        # only the scores of securities whose lists, country or currency use the weight are recomputed, in the same
+        # transaction
+        self.cursor.execute("UPDATE weights SET value = ? WHERE name = ?", (value, weight_name))
+        if self.cursor.rowcount != 1:
+            self.connection.rollback()
+            raise ValueError(f"Found no primary key match for value: {weight_name}")
+        weight_id = self.cursor.execute("SELECT weight_id FROM weights WHERE name = ?", (weight_name,)).fetchone()[0]
+        for statement in UPDATE_WEIGHT_SCORES_STATEMENTS:
+            self.cursor.execute(statement, (weight_id, weight_id))
+        self.connection.commit()
+        self.record_write("weights", SECURITY_SCORES_TABLE)
+
+    def query_composite_scores(self, limit=None):
+        # stored scores are relative to the score epoch, the ranking is read from the score index as is
+        current_factor = 1.0 / score_decay(self.bucketed_time(), self.query_score_epoch())
+        limit_clause, limit_parameters = ("", ()) if limit is None else ("LIMIT ?", (limit,))
+        results = self.run_query(f"SELECT s.name, s.ticker, x.score FROM {SECURITY_SCORES_TABLE} x, securities s "
+                                 f"WHERE x.score > 0 AND s.security_id = x.security_id ORDER BY x.score DESC "
+                                 f"{limit_clause}", limit_parameters)
+
+        return [CompositeScoreResult(name, ticker, score * current_factor) for name, ticker, score in results]
+
+    def verify_list_memberships(self):
+        expected = {(row[0], row[1]): tuple(row[2:]) for row in self.run_query(LIST_MEMBERSHIPS_FROM_CHANGES_SQL)}
+        actual = {(row[0], row[1]): tuple(row[2:]) for row in
+                  self.run_query(f"SELECT list_id, security_id, value_sign, since_epoch, note "
+                                 f"FROM {LIST_MEMBERSHIPS_TABLE}")}
 
-        if len(list_info) != 1:
+        return [ListMembershipMismatchResult(*key, expected.get(key), actual.get(key))
+                for key in sorted(expected.keys() | actual.keys()) if expected.get(key) != actual.get(key)]
+
+    def query_list_info(self, pref_list):
+        # lists without a weighted parent list are reported as not found, like the former join did
+        try:
+            list_row = self.reference_data.row_for_ticker("lists", pref_list)
+            parent_list_row = self.reference_data.row("lists", list_row.parent_list_id)
+            weight_row = self.reference_data.row("weights", list_row.weight_id)
+            parent_weight_row = self.reference_data.row("weights", parent_list_row.weight_id)
+        except ValueError:
             raise Exception(f"Did not find unique list for list {pref_list}")
-        return next(map(ListInfoResult._make, list_info))
+        return ListInfoResult(list_row.name, weight_row.name, parent_weight_row.name)
+
+    def query_list_components(self, pref_list, as_of=None):
+        if as_of is not None:
+            return self.query_list_components_as_of(pref_list, as_of)
 
-    def query_list_components(self, pref_list):
         list_components = self.run_query(
-            "SELECT s.name, s.ticker, SUM(e.value_sign), MAX(c.date_epoch), c.note FROM lists l, securities s, "
-            f"list_changes c, list_change_events e WHERE l.ticker = '{pref_list}' AND e.event_id = c.event_id "
-            "AND c.list_id = l.list_id AND s.security_id = c.security_id GROUP BY s.ticker ORDER BY s.name ASC")
+            "SELECT s.name, s.ticker, m.value_sign, m.since_epoch, m.note FROM lists l, securities s, "
+            f"{LIST_MEMBERSHIPS_TABLE} m WHERE l.ticker = ? AND m.list_id = l.list_id "
+            "AND s.security_id = m.security_id AND m.value_sign > 0 ORDER BY s.name ASC", (pref_list,))
 
-        parsed_components = map(ListComponentDateResult._make, list_components)
-        return [component for component in parsed_components if component.aggregate_event_value_sign > 0]
+        return list(map(ListComponentDateResult._make, list_components))
+
+    def query_list_components_as_of(self, pref_list, as_of):
+        # replays only this list's changes up to as_of, read through the (list_id, date_epoch) index
+        list_components = self.run_query(
+            "SELECT s.name, s.ticker, SUM(e.value_sign), MAX(c.date_epoch), c.note FROM lists l, list_changes c, "
+            "list_change_events e, securities s WHERE l.ticker = ? AND c.list_id = l.list_id AND c.date_epoch <= ? "
+            "AND e.event_id = c.event_id AND s.security_id = c.security_id GROUP BY c.security_id "
+            "HAVING SUM(e.value_sign) > 0 ORDER BY s.name ASC", (pref_list, as_of))
+
+        return list(map(ListComponentDateResult._make, list_components))
+
+    def query_list_components_in_sources(self, pref_list, sources, as_of=None):
+        # members in any of the sources, each with the sources that have it as member; the event log is replayed
+        # per source, the materialized memberships only cover main
+        as_of_filter, as_of_parameters = ("", ()) if as_of is None else ("AND c.date_epoch <= ? ", (as_of,))
+        components = self.run_query(
+            "SELECT s.name, s.ticker, GROUP_CONCAT(m.source, ', '), MAX(m.since_epoch) FROM "
+            "(SELECT c.source, c.security_id, MAX(c.date_epoch) AS since_epoch FROM all_lists l, all_list_changes c, "
+            "all_list_change_events e WHERE l.ticker = ? AND c.list_id = l.list_id AND e.event_id = c.event_id "
+            f"AND c.source IN (SELECT value FROM json_each(?)) {as_of_filter}GROUP BY c.source, c.security_id "
+            "HAVING SUM(e.value_sign) > 0 ORDER BY c.source) m, all_securities s WHERE s.security_id = m.security_id "
+            "GROUP BY s.security_id ORDER BY s.name ASC", (pref_list, json.dumps(sources), *as_of_parameters))
+
+        return list(map(SourceComponentResult._make, components))
+
+    def query_earnings_dates_in_sources(self, ticker, sources):
+        dates = self.run_query(
+            f"SELECT d.source, '{NATIVE_DATES_TABLE}', d.date_epoch FROM all_securities s, all_earnings_dates d "
+            "WHERE s.ticker = ? AND d.security_id = s.security_id AND d.source IN (SELECT value FROM json_each(?)) "
+            f"UNION ALL SELECT d.source, '{BLOOMBERG_DATES_TABLE}', d.date_epoch FROM all_securities s, "
+            "all_bloomberg_earnings_dates d WHERE s.ticker = ? AND d.security_id = s.security_id "
+            "AND d.source IN (SELECT value FROM json_each(?)) ORDER BY 3 DESC, 1",
+            (ticker, json.dumps(sources), ticker, json.dumps(sources)))
+
+        return [SourceDateResult(source, table, int(date_epoch)) for source, table, date_epoch in dates]
+
+    def query_list_set(self, pref_lists, min_lists, excluded_pref_lists=()):
+        # current members of at least min_lists of pref_lists that are on none of excluded_pref_lists: min_lists of 1
+        # is the union, len(pref_lists) the intersection, and excluded lists turn either into a difference
+        list_ids = [self.reference_data.primary_key_for_ticker("lists", pref_list) for pref_list in pref_lists]
+        excluded_list_ids = [self.reference_data.primary_key_for_ticker("lists", pref_list)
+                             for pref_list in excluded_pref_lists]
+        excluded_filter = ("" if not excluded_list_ids else
+                           f"AND NOT EXISTS (SELECT 1 FROM {LIST_MEMBERSHIPS_TABLE} x "
+                           "WHERE x.security_id = m.security_id AND x.value_sign > 0 "
+                           f"AND x.list_id IN ({', '.join('?' * len(excluded_list_ids))}))")
+
+        results = self.run_query(
+            "SELECT s.name, s.ticker, COUNT(DISTINCT m.list_id), MIN(m.since_epoch), MAX(m.since_epoch) "
+            f"FROM {LIST_MEMBERSHIPS_TABLE} m, securities s WHERE m.list_id IN ({', '.join('?' * len(list_ids))}) "
+            f"AND m.value_sign > 0 AND s.security_id = m.security_id {excluded_filter} GROUP BY m.security_id "
+            "HAVING COUNT(DISTINCT m.list_id) >= ? ORDER BY s.name ASC", (*list_ids, *excluded_list_ids, min_lists))
+
+        return list(map(ListSetResult._make, results))
+
+    def query_change_events(self, from_time, to_time, pref_list=None):
+        # every list change in (from_time, to_time] oldest first, from_time None replays from the beginning
+        from_filter, from_parameters = ("", ()) if from_time is None else ("AND c.date_epoch > ?", (from_time,))
+        list_filter, list_parameters = ("", ()) if pref_list is None else ("AND l.ticker = ?", (pref_list,))
+        events = self.run_query(
+            "SELECT l.ticker, s.name, s.ticker, e.value, e.value_sign, c.date_epoch FROM lists l, list_changes c, "
+            "list_change_events e, securities s WHERE c.list_id = l.list_id AND e.event_id = c.event_id "
+            f"AND s.security_id = c.security_id AND c.date_epoch <= ? {from_filter} {list_filter} "
+            "ORDER BY c.date_epoch ASC, c.change_id ASC", (to_time, *from_parameters, *list_parameters))
+
+        return list(map(ChangeEventResult._make, events))
 
     def print_dates_summary(self, ticker):
-        next_date = self.safe_timestamp_to_swiss_date(self.query_next_earnings_date_for_ticker(ticker))
-        prev_date = self.safe_timestamp_to_swiss_date(self.query_previous_earnings_date_for_ticker(ticker))
-        bloomberg_date = self.safe_timestamp_to_swiss_date(self.query_newest_earnings_date_for_ticker(ticker))
+        return self.print_dates_summaries([ticker])[ticker]
+
+    def print_dates_summaries(self, tickers):
+        return {ticker: self.format_dates_summary(dates_summary)
+                for ticker, dates_summary in self.query_dates_summaries(tickers).items()}
+
+    def format_dates_summary(self, dates_summary):
+        next_date = self.safe_timestamp_to_swiss_date(dates_summary.next_date_timestamp)
+        prev_date = self.safe_timestamp_to_swiss_date(dates_summary.previous_date_timestamp)
+        bloomberg_date = self.safe_timestamp_to_swiss_date(dates_summary.bloomberg_date_timestamp)
 
         summary = f"[B: {bloomberg_date}, N: {next_date}, P: {prev_date}"
-        if (bloomberg_date is None and next_date) is None or prev_date is None:
-            return f"{summary}, URL: {self.query_url_for_ticker(ticker)}]"
+        if (bloomberg_date is None and next_date is None) or prev_date is None:
+            return f"{summary}, URL: {dates_summary.ir_website}]"
         else:
             return f"{summary}]"
 
+    def query_dates_summaries(self, tickers):
+        current_time = self.bucketed_time()
+        unique_tickers = list(dict.fromkeys(tickers))
+        # unknown tickers get an empty summary
+        dates_summaries = {ticker: DatesSummaryResult(ticker, None, None, None, None) for ticker in unique_tickers}
+
+        results = self.run_query(
+            "SELECT s.ticker, s.ir_website, n.date_epoch, p.date_epoch, b.date_epoch FROM securities s "
+            "LEFT JOIN (SELECT security_id, MIN(date_epoch) AS date_epoch FROM earnings_dates "
+            "WHERE date_epoch > ? GROUP BY security_id) n ON n.security_id = s.security_id "
+            "LEFT JOIN (SELECT security_id, MAX(date_epoch) AS date_epoch FROM earnings_dates "
+            "WHERE date_epoch < ? GROUP BY security_id) p ON p.security_id = s.security_id "
+            f"LEFT JOIN bloomberg_earnings_dates b ON b.bloomberg_date_id = ({NEWEST_BLOOMBERG_DATE_ID_SQL}) "
+            "WHERE s.ticker IN (SELECT value FROM json_each(?))",
+            (current_time, current_time, json.dumps(unique_tickers)))
+
+        for ticker, ir_website, next_date, previous_date, bloomberg_date in results:
+            dates_summaries[ticker] = DatesSummaryResult(ticker, ir_website, next_date or None,
+                                                         previous_date or None, bloomberg_date)
+
+        return dates_summaries
+
+    def query_missing_earnings(self, threshold_days, limit=None):
+        # every security without a future native date, with a stale previous one, or whose newest Bloomberg date
+        # has no native date near it, in one pass over each table; the securities on most lists come first, then
+        # those with the most points
+        current_time = self.bucketed_time()
+        tolerance_seconds = days_to_seconds(EARNINGS_DATE_TOLERANCE_DAYS)
+        missing_earnings = self.run_query(
+            "SELECT s.name, s.ticker, s.ir_website, COALESCE(m.number_of_lists, 0) AS number_of_lists, "
+            "COALESCE(p.points, 0) AS points, n.next_date, n.previous_date, b.date_epoch, "
+            "n.next_date IS NULL AS missing_next, COALESCE(n.previous_date < ?, 0) AS stale_previous, "
+            "b.date_epoch IS NOT NULL AND NOT EXISTS (SELECT 1 FROM earnings_dates d "
+            "WHERE d.security_id = s.security_id AND d.date_epoch BETWEEN b.date_epoch - ? AND b.date_epoch + ?) "
+            "AS bloomberg_mismatch FROM securities s "
+            f"LEFT JOIN (SELECT security_id, COUNT(*) AS number_of_lists FROM {LIST_MEMBERSHIPS_TABLE} "
+            "WHERE value_sign > 0 GROUP BY security_id) m ON m.security_id = s.security_id "
+            "LEFT JOIN (SELECT c.security_id, SUM(e.value) AS points FROM list_changes c, list_change_events e "
+            "WHERE e.event_id = c.event_id AND c.date_epoch > ? GROUP BY c.security_id) p "
+            "ON p.security_id = s.security_id "
+            "LEFT JOIN (SELECT security_id, MIN(CASE WHEN date_epoch > ? THEN date_epoch END) AS next_date, "
+            "MAX(CASE WHEN date_epoch < ? THEN date_epoch END) AS previous_date FROM earnings_dates "
+            "GROUP BY security_id) n ON n.security_id = s.security_id "
+            f"LEFT JOIN bloomberg_earnings_dates b ON b.bloomberg_date_id = ({NEWEST_BLOOMBERG_DATE_ID_SQL}) "
+            "WHERE missing_next OR stale_previous OR bloomberg_mismatch "
+            "ORDER BY number_of_lists DESC, points DESC, s.ticker LIMIT ?",
+            (current_time - days_to_seconds(STALE_EARNINGS_DAYS), tolerance_seconds, tolerance_seconds,
+             current_time - days_to_seconds(threshold_days), current_time, current_time,
+             -1 if limit is None else limit))
+
+        return [MissingEarningsResult(*row[:8], *map(bool, row[8:])) for row in missing_earnings]
+
+    def query_upcoming_earnings(self, from_time, to_time):
+        # one range scan per date table, Bloomberg only counts the date of the latest scrape for a security
+        upcoming_earnings = self.run_query(
+            "SELECT d.date_epoch, group_concat(DISTINCT d.source), s.name, s.ticker, "
+            "(SELECT group_concat(l.ticker, ', ') FROM list_memberships m, lists l WHERE m.security_id = s.security_id "
+            "AND m.value_sign > 0 AND l.list_id = m.list_id) FROM securities s, "
+            "(SELECT date_epoch, security_id, 'N' AS source FROM earnings_dates WHERE date_epoch BETWEEN ? AND ? "
+            "UNION ALL SELECT b.date_epoch, b.security_id, 'B' FROM securities s, bloomberg_earnings_dates b "
+            "WHERE b.date_epoch BETWEEN ? AND ? AND s.security_id = b.security_id "
+            f"AND b.bloomberg_date_id = ({NEWEST_BLOOMBERG_DATE_ID_SQL})) d "
+            "WHERE s.security_id = d.security_id GROUP BY d.date_epoch, s.security_id ORDER BY d.date_epoch, s.name",
+            (from_time, to_time, from_time, to_time))
+
+        return map(UpcomingEarningsResult._make, upcoming_earnings)
+
     @staticmethod
     def safe_timestamp_to_swiss_date(next_timestamp):
         return None if next_timestamp is None else timestamp_to_swiss_date(next_timestamp)
 
     def query_next_earnings_date_for_ticker(self, ticker):
-        current_time = int(time.time())
+        current_time = self.bucketed_time()
         results = self.run_query("SELECT MIN(d.date_epoch) FROM securities s, earnings_dates d "
-                                 f"WHERE s.ticker = '{ticker}' AND d.security_id = s.security_id "
-                                 f"AND d.date_epoch > {current_time}")
+                                 "WHERE s.ticker = ? AND d.security_id = s.security_id "
+                                 "AND d.date_epoch > ?", (ticker, current_time))
 
         return results[0][0] if results[0][0] else None
 
     def query_previous_earnings_date_for_ticker(self, ticker):
-        current_time = int(time.time())
+        current_time = self.bucketed_time()
         results = self.run_query("SELECT MAX(d.date_epoch) FROM securities s, earnings_dates d "
-                                 f"WHERE s.ticker = '{ticker}' AND d.security_id = s.security_id "
-                                 f"AND d.date_epoch < {current_time}")
+                                 "WHERE s.ticker = ? AND d.security_id = s.security_id "
+                                 "AND d.date_epoch < ?", (ticker, current_time))
 
         return results[0][0] if results[0][0] else None
 
     def query_newest_earnings_date_for_ticker(self, ticker):
-        results = self.run_query("SELECT b.date_epoch, MAX(b.bloomberg_date_id) FROM securities s, "
-                                 f"bloomberg_earnings_dates b WHERE s.ticker = '{ticker}' "
-                                 "AND b.security_id = s.security_id GROUP BY s.ticker")
+        results = self.run_query("SELECT b.date_epoch FROM securities s, bloomberg_earnings_dates b "
+                                 f"WHERE s.ticker = ? AND b.bloomberg_date_id = ({NEWEST_BLOOMBERG_DATE_ID_SQL})",
+                                 (ticker,))
 
         return results[0][0] if results else None
 
     def query_url_for_ticker(self, ticker):
-        results = self.run_query(f"SELECT ir_website FROM securities WHERE ticker = '{ticker}'")
+        results = self.run_query("SELECT ir_website FROM securities WHERE ticker = ?", (ticker,))
 
         return results[0][0]
 
     def query_security_info(self, name):
-        return map(SecurityInfoResult._make,
-                   self.run_query(f"SELECT ticker, name, ir_website FROM securities WHERE name LIKE '%%{name}%%'"))
+        return map(SecurityInfoResult._make, self.search_securities(name))
+
+    def search_securities(self, text, limit=DEFAULT_SEARCH_LIMIT):
+        # tickers, names and alt names containing text, or if there are none the names sharing most of its trigrams
+        text = text.strip()
+        if not text:
+            return []
+        prefix_pattern = f"{text}%"
+
+        if not self.has_search_index or len(text) < TRIGRAM_LENGTH:
+            pattern = f"%{text}%"
+            return self.run_query(SEARCH_SECURITIES_LIKE_SQL,
+                                  (pattern, pattern, pattern, prefix_pattern, prefix_pattern, limit))
+
+        results = self.run_query(SEARCH_SECURITIES_SQL, (prefix_pattern, prefix_pattern, phrase_query(text), limit))
+        if not results:
+            trigrams = text_trigrams(text)
+            results = self.run_query(SEARCH_SECURITIES_FUZZY_SQL, (json.dumps(trigrams), fuzzy_query(trigrams),
+                                                                   min_shared_trigrams(trigrams), limit))
+
+        return results
 
     def query_list_of_lists(self, pref_list):
-        children_lists = self.run_query(f"SELECT l1.ticker FROM lists l1, lists l2 WHERE l2.ticker = '{pref_list}' "
-                                        "AND l1.parent_list_id = l2.list_id")
+        children_lists = self.run_query("SELECT l1.ticker FROM lists l1, lists l2 WHERE l2.ticker = ? "
+                                        "AND l1.parent_list_id = l2.list_id", (pref_list,))
 
         return [child_list[0] for child_list in children_lists]
 
-    def query_points(self, threshold_days, ticker=None):
-        current_time = int(time.time())
+    def query_list_tree(self, pref_list, threshold_days):
+        # pref_list and all lists below it, depth first, with the points of each list and of its whole subtree
+        threshold_time = self.bucketed_time() - days_to_seconds(threshold_days)
+        list_id = self.reference_data.primary_key_for_ticker("lists", pref_list)
+
+        results = self.run_query(
+            f"{LIST_TREE_CTE_SQL}, list_points(list_id, points) AS (SELECT c.list_id, SUM(e.value) "
+            "FROM list_changes c, list_change_events e WHERE c.list_id IN (SELECT list_id FROM tree) "
+            "AND e.event_id = c.event_id AND c.date_epoch > ? GROUP BY c.list_id) "
+            "SELECT l.ticker, l.name, t.depth, p.ticker, w.name, pw.name, w.value * COALESCE(pw.value, 1), "
+            "COALESCE(lp.points, 0), (SELECT COALESCE(SUM(dp.points), 0) FROM tree d, list_points dp "
+            "WHERE dp.list_id = d.list_id AND substr(d.id_path, 1, length(t.id_path)) = t.id_path) "
+            "FROM tree t JOIN lists l ON l.list_id = t.list_id LEFT JOIN lists p ON p.list_id = l.parent_list_id "
+            "LEFT JOIN weights w ON w.weight_id = l.weight_id LEFT JOIN weights pw ON pw.weight_id = p.weight_id "
+            "LEFT JOIN list_points lp ON lp.list_id = t.list_id ORDER BY t.sort_path",
+            (list_id, MAX_LIST_DEPTH, threshold_time))
+
+        return list(map(ListTreeResult._make, results))
+
+    def query_list_tree_components(self, pref_list):
+        # (list ticker, component) for the current members of every list in the subtree, in query_list_tree order
+        list_id = self.reference_data.primary_key_for_ticker("lists", pref_list)
+
+        results = self.run_query(
+            f"{LIST_TREE_CTE_SQL}SELECT l.ticker, s.name, s.ticker, m.value_sign, m.since_epoch, m.note "
+            f"FROM tree t, lists l, {LIST_MEMBERSHIPS_TABLE} m, securities s WHERE l.list_id = t.list_id "
+            "AND m.list_id = t.list_id AND s.security_id = m.security_id AND m.value_sign > 0 "
+            "ORDER BY t.sort_path, s.name ASC", (list_id, MAX_LIST_DEPTH))
+
+        return [(list_ticker, ListComponentDateResult(*component)) for list_ticker, *component in results]
+
+    def query_list_tree_members(self, pref_list):
+        # securities on any list of the subtree, each once
+        list_id = self.reference_data.primary_key_for_ticker("lists", pref_list)
+
+        results = self.run_query(
+            f"{LIST_TREE_CTE_SQL}SELECT s.name, s.ticker, COUNT(DISTINCT m.list_id), MIN(m.since_epoch), "
+            f"MAX(m.since_epoch) FROM {LIST_MEMBERSHIPS_TABLE} m, securities s "
+            "WHERE m.list_id IN (SELECT list_id FROM tree) AND m.value_sign > 0 AND s.security_id = m.security_id "
+            "GROUP BY m.security_id ORDER BY s.name ASC", (list_id, MAX_LIST_DEPTH))
+
+        return list(map(ListSetResult._make, results))
+
+    def query_points(self, threshold_days, ticker=None, as_of=None):
+        current_time = self.bucketed_time() if as_of is None else as_of
         threshold_time = current_time - days_to_seconds(threshold_days)
-        ticker_filter = "" if ticker is None else f"AND s.ticker = '{ticker}'"
+        ticker_filter, ticker_parameters = ("", ()) if ticker is None else ("AND s.ticker = ?", (ticker,))
+        as_of_filter, as_of_parameters = ("", ()) if as_of is None else ("AND c.date_epoch <= ?", (as_of,))
 
         points = self.run_query("SELECT s.name, s.ticker, s.ir_website, SUM(e.value) as points FROM securities s, "
                                 "list_changes c, list_change_events e WHERE e.event_id = c.event_id "
-                                f"AND s.security_id = c.security_id AND c.date_epoch > {threshold_time} "
-                                f"{ticker_filter} GROUP BY s.ticker ORDER BY points DESC")
+                                f"AND s.security_id = c.security_id AND c.date_epoch > ? {as_of_filter} "
+                                f"{ticker_filter} GROUP BY s.ticker ORDER BY points DESC",
+                                (threshold_time, *as_of_parameters, *ticker_parameters))
         return map(PointsResult._make, points)
 
-    def query_time_weighted_points(self, threshold_days, ticker=None, country=None):
-        current_time = int(time.time())
+    def query_time_weighted_points(self, threshold_days, ticker=None, country=None, as_of=None):
+        current_time = self.bucketed_time() if as_of is None else as_of
         threshold_seconds = days_to_seconds(threshold_days)
         threshold_time = current_time - threshold_seconds
         country_id = None if country is None else self.get_primary_key_value_for_ticker("countries", country)
-        ticker_filter = "" if ticker is None else f"AND s.ticker = '{ticker}'"
-        country_filter = "" if country_id is None else f"AND c.country_id = '{country_id}'"
+        ticker_filter, ticker_parameters = ("", ()) if ticker is None else ("AND s.ticker = ?", (ticker,))
+        country_filter, country_parameters = ("", ()) if country_id is None else ("AND c.country_id = ?",
+                                                                                  (country_id,))
+        as_of_filter, as_of_parameters = ("", ()) if as_of is None else ("AND lc.date_epoch <= ?", (as_of,))
 
         results = self.run_query("SELECT s.name, s.ticker, e.value, lc.date_epoch FROM securities s, "
                                  "list_changes lc, list_change_events e, countries c WHERE e.event_id = lc.event_id "
-                                 f"AND s.security_id = lc.security_id AND lc.date_epoch > {threshold_time} "
-                                 f"AND s.country_id = c.country_id {ticker_filter} {country_filter} ORDER BY s.ticker")
+                                 f"AND s.security_id = lc.security_id AND lc.date_epoch > ? {as_of_filter} "
+                                 f"AND s.country_id = c.country_id {ticker_filter} {country_filter} ORDER BY s.ticker",
+                                 (threshold_time, *as_of_parameters, *ticker_parameters, *country_parameters))
 
         factor_calculator = TimeFactorCalculator(current_time, threshold_seconds)
         return map(TimeWeightedPointsResult._make, results), factor_calculator
 
-    def query_list_history(self, pref_list):
-        histories = self.run_query(
+    def query_points_in_sources(self, threshold_days, sources, as_of=None):
+        # events of any of the sources, a security on both counts the events of each
+        current_time = self.bucketed_time() if as_of is None else as_of
+        as_of_filter, as_of_parameters = ("", ()) if as_of is None else ("AND c.date_epoch <= ? ", (as_of,))
+
+        points = self.run_query("SELECT s.name, s.ticker, s.ir_website, SUM(e.value) AS points FROM all_securities s, "
+                                "all_list_changes c, all_list_change_events e WHERE e.event_id = c.event_id "
+                                "AND s.security_id = c.security_id AND c.source IN (SELECT value FROM json_each(?)) "
+                                f"AND c.date_epoch > ? {as_of_filter}GROUP BY s.ticker ORDER BY points DESC",
+                                (json.dumps(sources), current_time - days_to_seconds(threshold_days),
+                                 *as_of_parameters))
+        return map(PointsResult._make, points)
+
+    def query_time_weighted_points_in_sources(self, threshold_days, sources, country=None, as_of=None):
+        current_time = self.bucketed_time() if as_of is None else as_of
+        threshold_seconds = days_to_seconds(threshold_days)
+        country_filter, country_parameters = ("", ()) if country is None else ("AND co.ticker = ? ", (country,))
+        as_of_filter, as_of_parameters = ("", ()) if as_of is None else ("AND lc.date_epoch <= ? ", (as_of,))
+
+        results = self.run_query("SELECT s.name, s.ticker, e.value, lc.date_epoch FROM all_securities s, "
+                                 "all_list_changes lc, all_list_change_events e, all_countries co "
+                                 "WHERE e.event_id = lc.event_id AND s.security_id = lc.security_id "
+                                 "AND lc.source IN (SELECT value FROM json_each(?)) AND lc.date_epoch > ? "
+                                 f"{as_of_filter}AND s.country_id = co.country_id {country_filter}ORDER BY s.ticker",
+                                 (json.dumps(sources), current_time - threshold_seconds, *as_of_parameters,
+                                  *country_parameters))
+
+        factor_calculator = TimeFactorCalculator(current_time, threshold_seconds)
+        return map(TimeWeightedPointsResult._make, results), factor_calculator
+
+    def query_list_history(self, pref_list, page=None, page_size=DEFAULT_PAGE_SIZE):
+        # streamed, the full history of a large list does not fit a list of rows; page counts from 1
+        limit, offset = (-1, 0) if page is None else (page_size, (page - 1) * page_size)
+        histories = self.stream_query(
             "SELECT s.name, s.ticker, e.name, c.date_epoch FROM lists l, securities s, list_changes c, "
-            f"list_change_events e WHERE l.ticker = '{pref_list}' AND e.event_id = c.event_id "
-            "AND c.list_id = l.list_id AND s.security_id = c.security_id ORDER BY c.date_epoch DESC")
+            "list_change_events e WHERE l.ticker = ? AND e.event_id = c.event_id "
+            "AND c.list_id = l.list_id AND s.security_id = c.security_id ORDER BY c.date_epoch DESC, c.change_id DESC "
+            "LIMIT ? OFFSET ?", (pref_list, limit, offset))
 
         return map(ListHistoryResult._make, histories)
 
     def query_earnings_dates(self, ticker, table):
         dates = self.run_query(f"SELECT d.date_epoch FROM securities s, {table} d WHERE s.security_id = d.security_id "
-                               f"AND s.ticker = '{ticker}' ORDER BY d.date_epoch DESC")
+                               "AND s.ticker = ? ORDER BY d.date_epoch DESC", (ticker,))
 
         return [int(date[0]) for date in dates]
 
@@ -238,34 +917,82 @@ class Database:
     def query_security(self, ticker):
         securities = self.run_query(
             "SELECT s.name, co.name, cu.ticker, cow.name, cuw.name, s.ir_website FROM securities s, "
-            f"countries co, currencies cu, weights cow, weights cuw WHERE s.ticker = '{ticker}' "
+            "countries co, currencies cu, weights cow, weights cuw WHERE s.ticker = ? "
             "AND s.country_id = co.country_id AND s.currency_id = cu.currency_id "
-            "AND co.weight_id = cow.weight_id AND cu.weight_id = cuw.weight_id")
+            "AND co.weight_id = cow.weight_id AND cu.weight_id = cuw.weight_id", (ticker,))
 
         return next(map(SecurityResult._make, securities))
 
     def query_history(self, ticker):
         histories = self.run_query("SELECT l.name, e.name, c.date_epoch, l.ticker, c.note FROM lists l, securities s, "
-                                   f"list_changes c, list_change_events e WHERE s.ticker = '{ticker}' "
+                                   "list_changes c, list_change_events e WHERE s.ticker = ? "
                                    "AND e.event_id = c.event_id AND c.list_id = l.list_id "
-                                   "AND s.security_id = c.security_id ORDER BY l.ticker ASC, c.date_epoch DESC")
+                                   "AND s.security_id = c.security_id ORDER BY l.ticker ASC, c.date_epoch DESC",
+                                   (ticker,))
 
         return map(SecurityHistoryResult._make, histories)
 
     def query_all_securities(self):
         securities = self.run_query("SELECT s.ticker, s.name, s.ir_website, c.name FROM securities s, countries c WHERE "
-                                 "s.country_id = c.country_id")
-        securities += self.run_query("SELECT s.ticker, a.alt_name, s.ir_website, c.name FROM securities s, "
-                                  "securities_alt_names a, countries c WHERE a.security_id = s.security_id AND "
-                                  "s.country_id = c.country_id")
+                                    "s.country_id = c.country_id UNION ALL "
+                                    "SELECT s.ticker, a.alt_name, s.ir_website, c.name FROM securities s, "
+                                    "securities_alt_names a, countries c WHERE a.security_id = s.security_id AND "
+                                    "s.country_id = c.country_id")
 
         return map(SecurityCountryResult._make, securities)
 
     def query_number_of_active_lists(self, ticker):
-        list_sign_results = self.run_query(
-            "SELECT l.name, l.ticker, SUM(e.value_sign) FROM lists l, securities s, list_changes c, "
-            f"list_change_events e WHERE s.ticker = '{ticker}' AND e.event_id = c.event_id "
-            "AND c.list_id = l.list_id AND s.security_id = c.security_id GROUP BY l.ticker ORDER BY l.name DESC")
+        results = self.run_query(f"SELECT COUNT(*) FROM securities s, {LIST_MEMBERSHIPS_TABLE} m "
+                                 "WHERE s.ticker = ? AND m.security_id = s.security_id AND m.value_sign > 0", (ticker,))
+
+        return results[0][0]
+
+    # set-based counterparts of the per ticker queries above, results are keyed or prefixed by ticker
+    def query_securities(self, tickers):
+        securities = self.run_query(
+            "SELECT s.ticker, s.name, co.name, cu.ticker, cow.name, cuw.name, s.ir_website FROM securities s, "
+            "countries co, currencies cu, weights cow, weights cuw WHERE s.ticker IN (SELECT value FROM json_each(?)) "
+            "AND s.country_id = co.country_id AND s.currency_id = cu.currency_id "
+            "AND co.weight_id = cow.weight_id AND cu.weight_id = cuw.weight_id", (json.dumps(list(tickers)),))
+
+        return {ticker: SecurityResult(*security) for ticker, *security in securities}
+
+    def query_histories(self, tickers):
+        histories = self.run_query(
+            "SELECT s.ticker, l.name, e.name, c.date_epoch, l.ticker, c.note FROM lists l, securities s, "
+            "list_changes c, list_change_events e WHERE s.ticker IN (SELECT value FROM json_each(?)) "
+            "AND e.event_id = c.event_id AND c.list_id = l.list_id "
+            "AND s.security_id = c.security_id ORDER BY s.ticker, l.ticker ASC, c.date_epoch DESC",
+            (json.dumps(list(tickers)),))
+
+        return [(ticker, SecurityHistoryResult(*history)) for ticker, *history in histories]
+
+    def query_numbers_of_active_lists(self, tickers):
+        results = self.run_query(f"SELECT s.ticker, COUNT(*) FROM securities s, {LIST_MEMBERSHIPS_TABLE} m "
+                                 "WHERE s.ticker IN (SELECT value FROM json_each(?)) AND m.security_id = s.security_id "
+                                 "AND m.value_sign > 0 GROUP BY s.ticker", (json.dumps(list(tickers)),))
+
+        return dict(results)
+
+    def query_earnings_dates_for_tickers(self, tickers):
+        # (ticker, table, date_epoch) rows of both date tables, newest first per ticker
+        tickers_parameter = json.dumps(list(tickers))
+        return self.run_query(
+            f"SELECT s.ticker, '{NATIVE_DATES_TABLE}', d.date_epoch FROM securities s, {NATIVE_DATES_TABLE} d "
+            "WHERE s.security_id = d.security_id AND s.ticker IN (SELECT value FROM json_each(?)) UNION ALL "
+            f"SELECT s.ticker, '{BLOOMBERG_DATES_TABLE}', d.date_epoch FROM securities s, {BLOOMBERG_DATES_TABLE} d "
+            "WHERE s.security_id = d.security_id AND s.ticker IN (SELECT value FROM json_each(?)) ORDER BY 1, 3 DESC",
+            (tickers_parameter, tickers_parameter))
+
+    def query_time_weighted_points_for_tickers(self, tickers, threshold_days):
+        current_time = self.bucketed_time()
+        threshold_seconds = days_to_seconds(threshold_days)
 
-        parsed_results = map(ListAggregateSignResult._make, list_sign_results)
-        return len([result for result in parsed_results if result.aggregate_event_value_sign > 0])
\ No newline at end of file
+        results = self.run_query(
+            "SELECT s.name, s.ticker, e.value, lc.date_epoch FROM securities s, list_changes lc, "
+            "list_change_events e WHERE e.event_id = lc.event_id AND s.security_id = lc.security_id "
+            "AND lc.date_epoch > ? AND s.ticker IN (SELECT value FROM json_each(?)) ORDER BY s.ticker",
+            (current_time - threshold_seconds, json.dumps(list(tickers))))
+
+        factor_calculator = TimeFactorCalculator(current_time, threshold_seconds)
+        return list(map(TimeWeightedPointsResult._make, results)), factor_calculator
@@ -1,8 +1,10 @@
 import datetime
 import time
+from functools import lru_cache
 
 EPOCH = datetime.datetime(1970, 1, 1)
 SECONDS_IN_A_DAY = 24 * 60 * 60
+SWISS_DATE_CACHE_SIZE = 16384
 
 
 def swiss_date_to_timestamp(date):
@@ -11,7 +13,10 @@ def swiss_date_to_timestamp(date):
     return (parsed_date - EPOCH).total_seconds()
 
 
+@lru_cache(maxsize=SWISS_DATE_CACHE_SIZE)
 def timestamp_to_swiss_date(epoch):
+    # dates are stored as UTC midnight timestamps, so reports keep formatting the same few thousand values; keyed
+    # on the exact timestamp because the formatted day depends on the local timezone
     parsed_epoch = datetime.datetime.fromtimestamp(epoch)
     return parsed_epoch.strftime("%d.%m.%y")
 
@@ -20,10 +25,14 @@ def days_to_seconds(days):
     return days * SECONDS_IN_A_DAY
 
 
-def time_range_from_now(days):
-    current_time = int(time.time())
+def time_range_from_now(days, current_time=None):
+    current_time = int(time.time()) if current_time is None else current_time
     threshold_time = current_time + days_to_seconds(days)
 
     lower_timestamp = min(current_time, threshold_time)
     higher_timestamp = max(current_time, threshold_time)
     return lower_timestamp, higher_timestamp
+
+
+def start_of_day(epoch):
+    return epoch - epoch % SECONDS_IN_A_DAY
@@ -0,0 +1,46 @@
+from collections import defaultdict
+from functools import partial
+from typing import NamedTuple
+
+from database import BLOOMBERG_DATES_TABLE, NATIVE_DATES_TABLE
+from time_factor_calculator import LinearDecayKernel
+from weighted_points_processor import WeightedPointsEngine
+
+Dossier = NamedTuple("Dossier", [("ticker", str), ("security", tuple), ("histories", list), ("points", int),
+                                 ("time_weighted_points", float), ("number_of_active_lists", int),
+                                 ("native_dates", list), ("bloomberg_dates", list)])
+
+
+def load_dossiers(db, tickers, threshold_days):
+    # everything a ticker screen shows, for any number of tickers in the same five queries (per chunk of tickers),
+    # tickers without a security are left out; the four queries after the securities run in parallel
+    securities = db.query_securities(tickers)
+    found_tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker in securities]
+    if not found_tickers:
+        return {}
+
+    history_rows, numbers_of_active_lists, date_rows, (twp_results, factor_calculator) = db.run_parallel(
+        partial(db.query_histories, found_tickers), partial(db.query_numbers_of_active_lists, found_tickers),
+        partial(db.query_earnings_dates_for_tickers, found_tickers),
+        partial(db.query_time_weighted_points_for_tickers, found_tickers, threshold_days))
+
+    histories = defaultdict(list)
+    for ticker, history in history_rows:
+        histories[ticker].append(history)
+
+    dates = {NATIVE_DATES_TABLE: defaultdict(list), BLOOMBERG_DATES_TABLE: defaultdict(list)}
+    for ticker, table, date_epoch in date_rows:
+        dates[table][ticker].append(int(date_epoch))
+
+    points = defaultdict(int)
+    for result in twp_results:
+        points[result.ticker] += result.event_value
+    engine = WeightedPointsEngine(twp_results)
+    time_weighted_points = dict(zip(engine.tickers, engine.calculate_points(
+        factor_calculator.current_time, LinearDecayKernel(factor_calculator.max_time_diff))))
+
+    # time weighted points that decayed to zero or below count as no points, same as the points ranking
+    return {ticker: Dossier(ticker, securities[ticker], histories[ticker], points[ticker],
+                            max(time_weighted_points.get(ticker, 0.0), 0.0), numbers_of_active_lists.get(ticker, 0),
+                            dates[NATIVE_DATES_TABLE][ticker], dates[BLOOMBERG_DATES_TABLE][ticker])
+            for ticker in found_tickers}
@@ -0,0 +1,75 @@
+# source name of the connection's own file in the merged views, preferred.py opens private.db and attaches public.db
+MAIN_SOURCE = "private"
+ATTACHED_IDS_TABLE = "attached_ids"
+# reconciled reference tables: id column and the natural key that identifies a row in both files
+RECONCILED_TABLES = {"weights": ("weight_id", "name"), "countries": ("country_id", "ticker"),
+                     "currencies": ("currency_id", "ticker"), "lists": ("list_id", "ticker"),
+                     "list_change_events": ("event_id", "ticker"), "securities": ("security_id", "ticker")}
+# merged reference views, one row per reconciled id: main rows, then attached rows missing from main
+MERGED_REFERENCE_VIEWS = {"all_weights": ("weights", ["name", "value"], []),
+                          "all_countries": ("countries", ["name", "ticker", "ir_website"], ["weight_id"]),
+                          "all_currencies": ("currencies", ["name", "ticker"], ["weight_id"]),
+                          "all_lists": ("lists", ["name", "ticker"], ["weight_id", "parent_list_id"]),
+                          "all_list_change_events": ("list_change_events", ["name", "ticker", "value", "value_sign"],
+                                                     []),
+                          "all_securities": ("securities", ["name", "ticker", "ir_website"],
+                                             ["country_id", "currency_id"])}
+# reference columns of a row name the table their id reconciles in
+REFERENCE_COLUMNS = {"weight_id": "weights", "parent_list_id": "lists", "country_id": "countries",
+                     "currency_id": "currencies", "list_id": "lists", "event_id": "list_change_events",
+                     "security_id": "securities"}
+# merged fact views keep a row per file, source tells which one
+MERGED_FACT_VIEWS = {"all_list_changes": ("list_changes", ["change_id", "date_epoch", "note"],
+                                          ["list_id", "security_id", "event_id"]),
+                     "all_earnings_dates": ("earnings_dates", ["date_epoch"], ["security_id"]),
+                     "all_bloomberg_earnings_dates": ("bloomberg_earnings_dates", ["date_epoch", "name"],
+                                                      ["security_id"])}
+
+
+def reconciled_id_sql(column, alias):
+    # ids of attached rows without a match in main are negated, main ids are positive so the two never collide
+    return (f"(SELECT id FROM temp.{ATTACHED_IDS_TABLE} WHERE table_name = '{REFERENCE_COLUMNS[column]}' "
+            f"AND source_id = {alias}.{column})")
+
+
+def attached_ids_statements(schema):
+    # the id map is a snapshot of both files' reconciled tables, rerun after a row is added to either of them
+    statements = [f"DELETE FROM temp.{ATTACHED_IDS_TABLE}"]
+    for table_name, (id_column, key_column) in RECONCILED_TABLES.items():
+        statements.append(f"INSERT INTO temp.{ATTACHED_IDS_TABLE}(table_name, source_id, id) "
+                          f"SELECT '{table_name}', a.{id_column}, COALESCE((SELECT MIN(m.{id_column}) "
+                          f"FROM main.{table_name} m WHERE m.{key_column} = a.{key_column}), -a.{id_column}) "
+                          f"FROM {schema}.{table_name} a")
+    return statements
+
+
+def attached_database_statements(schema):
+    # temp objects live on this connection only and may read any attached schema
+    statements = [f"CREATE TEMP TABLE IF NOT EXISTS {ATTACHED_IDS_TABLE} (table_name text NOT NULL, "
+                  "source_id integer NOT NULL, id integer NOT NULL, PRIMARY KEY(table_name, source_id)) WITHOUT ROWID",
+                  *attached_ids_statements(schema)]
+
+    for view_name, (table_name, columns, reference_columns) in MERGED_REFERENCE_VIEWS.items():
+        id_column = RECONCILED_TABLES[table_name][0]
+        main_columns = ", ".join([id_column, *columns, *reference_columns])
+        attached_columns = ", ".join([f"-a.{id_column}", *(f"a.{column}" for column in columns),
+                                      *(reconciled_id_sql(column, "a") for column in reference_columns)])
+        statements += [f"DROP VIEW IF EXISTS temp.{view_name}",
+                       f"CREATE TEMP VIEW {view_name}({main_columns}) AS SELECT {main_columns} FROM main.{table_name} "
+                       f"UNION ALL SELECT {attached_columns} FROM {schema}.{table_name} a "
+                       f"WHERE {reconciled_id_sql(id_column, 'a')} < 0"]
+
+    for view_name, (table_name, columns, reference_columns) in MERGED_FACT_VIEWS.items():
+        view_columns = ", ".join(["source", *columns, *reference_columns])
+        attached_columns = ", ".join([f"'{schema}'", *(f"a.{column}" for column in columns),
+                                      *(reconciled_id_sql(column, "a") for column in reference_columns)])
+        statements += [f"DROP VIEW IF EXISTS temp.{view_name}",
+                       f"CREATE TEMP VIEW {view_name}({view_columns}) AS SELECT '{MAIN_SOURCE}', "
+                       f"{', '.join([*columns, *reference_columns])} FROM main.{table_name} "
+                       f"UNION ALL SELECT {attached_columns} FROM {schema}.{table_name} a"]
+    return statements
+
+
+def detached_database_statements():
+    return [*(f"DROP VIEW IF EXISTS temp.{view_name}" for view_name in [*MERGED_REFERENCE_VIEWS, *MERGED_FACT_VIEWS]),
+            f"DROP TABLE IF EXISTS temp.{ATTACHED_IDS_TABLE}"]
@@ -1,10 +1,14 @@
+import time
 from collections import Counter
 
+COMMENT_PREFIX = "#"
+
 
 class Menu:
-    def __init__(self, options, launcher_ref):
+    def __init__(self, options, launcher_ref=None, query_statistics=None):
         self.alias_to_method = {}
         self.launcher_ref = launcher_ref
+        self.query_statistics = query_statistics
 
         alias_counter = Counter(alias for option in options for alias in option.aliases)
         most_common_alias, most_common_count = alias_counter.most_common(1)[0]
@@ -23,10 +27,26 @@ class Menu:
             except KeyboardInterrupt:
                 continue
 
+    def run_commands(self, lines):
+        # non-interactive counterpart of wait_for_input, e.g. for a script file or a stdin pipe
+        for line in lines:
+            command = line.strip()
+            if command and not command.startswith(COMMENT_PREFIX):
+                self.parse_command(command)
+
     def parse_command(self, line):
         menu_option_name, space, arguments = line.strip().partition(" ")
         if menu_option_name in self.alias_to_method.keys():
-            return self.launcher_ref(self.alias_to_method[menu_option_name], arguments.split())
+            method_name = self.alias_to_method[menu_option_name]
+            if self.query_statistics is None:
+                return self.launcher_ref(method_name, arguments.split())
+
+            start, queries_before = time.perf_counter(), self.query_statistics.number_of_queries
+            try:
+                return self.launcher_ref(method_name, arguments.split())
+            finally:
+                self.query_statistics.record_command(method_name, time.perf_counter() - start,
+                                                     self.query_statistics.number_of_queries - queries_before)
         else:
             print("Alias not known")
             return True
@@ -0,0 +1,96 @@
+import os
+import sys
+from sqlite3 import connect, Error
+from typing import NamedTuple
+
+from composite_score import SCORE_EPOCH_STATEMENTS, security_scores_statements
+
+# statements is a list, or a callable taking the connection for steps that depend on the sqlite build
+Migration = NamedTuple("Migration", [("version", int), ("description", str), ("statements", list)])
+
+# ordered upgrade steps, never edit a released step, append a new one instead
+MIGRATIONS = [
+    Migration(1, "materialized current list memberships", [
+        "CREATE TABLE IF NOT EXISTS list_memberships (list_id integer NOT NULL, security_id integer NOT NULL, "
+        "value_sign smallint NOT NULL, since_epoch integer, note varchar(255), PRIMARY KEY(list_id, security_id), "
+        "FOREIGN KEY(list_id) REFERENCES lists(list_id), FOREIGN KEY(security_id) REFERENCES securities(security_id))",
+        "CREATE INDEX IF NOT EXISTS list_memberships_security_index ON list_memberships(security_id)",
+        "DELETE FROM list_memberships",
+        "INSERT INTO list_memberships(list_id, security_id, value_sign, since_epoch, note) "
+        "SELECT c.list_id, c.security_id, SUM(e.value_sign), MAX(c.date_epoch), c.note "
+        "FROM list_changes c, list_change_events e WHERE e.event_id = c.event_id GROUP BY c.list_id, c.security_id"]),
+    Migration(2, "indexes on join and date columns", [
+        "CREATE INDEX IF NOT EXISTS list_changes_security_date_index ON list_changes(security_id, date_epoch)",
+        "CREATE INDEX IF NOT EXISTS list_changes_list_security_index ON list_changes(list_id, security_id)",
+        "CREATE INDEX IF NOT EXISTS list_changes_date_index ON list_changes(date_epoch)",
+        "CREATE INDEX IF NOT EXISTS earnings_dates_security_date_index ON earnings_dates(security_id, date_epoch)",
+        "CREATE INDEX IF NOT EXISTS earnings_dates_date_index ON earnings_dates(date_epoch)",
+        "CREATE INDEX IF NOT EXISTS bloomberg_dates_security_date_index "
+        "ON bloomberg_earnings_dates(security_id, date_epoch)",
+        "CREATE INDEX IF NOT EXISTS securities_alt_names_security_index ON securities_alt_names(security_id)",
+        "CREATE INDEX IF NOT EXISTS securities_country_index ON securities(country_id)",
+        "CREATE INDEX IF NOT EXISTS lists_parent_index ON lists(parent_list_id)",
+        "CREATE INDEX IF NOT EXISTS lists_ticker_index ON lists(ticker)",
+        "CREATE INDEX IF NOT EXISTS countries_ticker_index ON countries(ticker)",
+        "CREATE INDEX IF NOT EXISTS currencies_ticker_index ON currencies(ticker)",
+        "CREATE INDEX IF NOT EXISTS list_change_events_ticker_index ON list_change_events(ticker)",
+        "ANALYZE"]),
+    Migration(3, "bloomberg scrape batches", [
+        "CREATE TABLE IF NOT EXISTS bloomberg_scrape_batches (scrape_batch_id integer PRIMARY KEY, "
+        "scraped_epoch integer, source varchar(255))",
+        "ALTER TABLE bloomberg_earnings_dates ADD COLUMN scrape_batch_id integer "
+        "REFERENCES bloomberg_scrape_batches(scrape_batch_id)",
+        # dates scraped before batches existed all go into one batch, ordered by bloomberg_date_id as before
+        "INSERT INTO bloomberg_scrape_batches(scraped_epoch, source) SELECT CAST(strftime('%s', 'now') AS integer), "
+        "'before scrape batches' WHERE EXISTS (SELECT 1 FROM bloomberg_earnings_dates)",
+        "UPDATE bloomberg_earnings_dates SET scrape_batch_id = (SELECT MAX(scrape_batch_id) "
+        "FROM bloomberg_scrape_batches)",
+        "CREATE INDEX IF NOT EXISTS bloomberg_dates_security_batch_index "
+        "ON bloomberg_earnings_dates(security_id, scrape_batch_id)"]),
+    Migration(4, "index for point-in-time list replays", [
+        "CREATE INDEX IF NOT EXISTS list_changes_list_date_index ON list_changes(list_id, date_epoch)"]),
+    # the optional trigram search index is kept by Database.connect for the sqlite build at hand, this step is empty
+    Migration(5, "trigram search index over security names and alt names", []),
+    Migration(6, "materialized composite security scores", security_scores_statements),
+    Migration(7, "rebase epoch of security scores", SCORE_EPOCH_STATEMENTS),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def query_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade(connection):
+    current_version = query_schema_version(connection)
+
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+
+        # one transaction per step, schema version is only bumped together with the step's changes
+        statements = migration.statements(connection) if callable(migration.statements) else migration.statements
+        script = ";\n".join(statements + [f"PRAGMA user_version = {migration.version}"])
+        try:
+            connection.executescript(f"BEGIN;\n{script};\nCOMMIT;")
+        except Error as e:
+            connection.rollback()
+            raise Error(f"Migration {migration.version} ({migration.description}) failed: {e}")
+        print(f"Applied migration {migration.version}: {migration.description}")
+        current_version = migration.version
+
+    return current_version
+
+
+def main(paths):
+    for path in paths:
+        if not os.path.isfile(path):
+            print(f"{path}: database file not found, skipped")
+            continue
+        connection = connect(path)
+        print(f"{path}: schema version {upgrade(connection)}")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["private.db", "public.db"])
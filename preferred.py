@@ -1,12 +1,26 @@
-from itertools import groupby
-
-from database import Database
-from date_util import timestamp_to_swiss_date
+import sys
+from argparse import ArgumentParser
+from contextlib import nullcontext, redirect_stdout
+from io import StringIO
+from functools import partial
+
+from bloomberg_scrape import BloombergScrapeLoader, MANUAL_SCRAPE_SOURCE
+from bulk_loader import BulkLoader, DEFAULT_BATCH_SIZE
+from database import Database, DEFAULT_PAGE_SIZE, NATIVE_DATES_TABLE
+from date_util import timestamp_to_swiss_date, swiss_date_to_timestamp, time_range_from_now, start_of_day
+from dossier import load_dossiers
 from earnings_date import EarningsDate
 from list_change import ListChange
 from menu import MenuOption, Menu
+from query_stats import DEFAULT_SLOW_QUERY_SECONDS
+from report import TextReport, JsonReport
+from result_cache import DEFAULT_FRESHNESS_SECONDS, DEFAULT_RESULT_CACHE_BYTES
 from security import Security
-from weighted_points_processor import WeightedPointsProcessor, AggregatedValue
+from server import DEFAULT_SOCKET_PATH, serve
+from snapshot import export_snapshot as export_columnar_snapshot
+from time_factor_calculator import LinearDecayKernel
+from time_series import query_daily_list_series
+from weighted_points_processor import WeightedPointsEngine
 
 MENU_OPTIONS = [MenuOption(["s"], "add_security"), MenuOption(["e", "ed"], "add_earnings_date"),
                 MenuOption(["u"], "query_upcoming_earnings"), MenuOption(["l", "lc"], "add_list_change"),
@@ -18,23 +32,49 @@ MENU_OPTIONS = [MenuOption(["s"], "add_security"), MenuOption(["e", "ed"], "add_
                 MenuOption(["hl"], "query_list_history"), MenuOption(["d"], "switch_databases"),
                 MenuOption(["he"], "query_earnings_for_ticker"), MenuOption(["a"], "query_ticker"),
                 MenuOption(["ra"], "add_analyst"), MenuOption(["salt"], "add_security_alt_name"),
-                MenuOption(["n"], "query_intersection_of_lists"), MenuOption(["q"], "clean_up")]
+                MenuOption(["n"], "query_intersection_of_lists"), MenuOption(["rebuild"], "rebuild_list_memberships"),
+                MenuOption(["verify"], "verify_list_memberships"), MenuOption(["bulk"], "bulk_load"),
+                MenuOption(["ts"], "query_list_series"), MenuOption(["nu"], "query_union_of_lists"),
+                MenuOption(["nd"], "query_difference_of_lists"), MenuOption(["nk"], "query_lists_at_least"),
+                MenuOption(["lt"], "query_list_tree"), MenuOption(["cs"], "query_composite_scores"),
+                MenuOption(["w"], "update_weight"), MenuOption(["stats"], "query_statistics"),
+                MenuOption(["snap"], "export_snapshot"),
+                MenuOption(["q"], "clean_up")]
 PRIVATE_DB_PATH = "private.db"
 PUBLIC_DB_PATH = "public.db"
 POINTS_DAYS_THRESHOLD = 90
+UPCOMING_EARNINGS_DAYS = 14
 BLOOMBERG_DATES_HEADER = "== Bloomberg dates =="
 SYNTAX_INPUT_ERROR = "Input syntax not correct."
+STDIN_PATH = "-"
+STATISTICS_TOP_STATEMENTS = 10
+STATISTICS_SQL_LENGTH = 160
+STATISTICS_PARAMETERS = 5
+# d <scope>: which database ls, he, p and twp report on, every other command reads private only; public is attached
+# to the private connection on first use
+DATABASE_SCOPES = {"private": (True, False), "public": (False, True), "both": (True, True)}
+DEFAULT_DATABASE_SCOPE = "private"
 
 
 def launch(method_name, argument_list):
     try:
         command = globals()[method_name]
-        return command(*argument_list)
     except KeyError:
         print(f"Method {method_name} not implemented")
+        return
+
+    # in every mode, other processes may have written to the files since the last command
+    db.refresh_if_changed_externally()
+    report.begin_command(method_name, argument_list)
+    try:
+        return command(*argument_list)
+    finally:
+        report.end_command()
 
 
 db = Database(PRIVATE_DB_PATH)
+report = TextReport()
+database_scope = DEFAULT_DATABASE_SCOPE
 
 
 def add_security(*args):
@@ -47,6 +87,19 @@ def add_security(*args):
     db.insert_security(Security(" ".join(name.split("-")), ticker, country, ir_website, currency))
 
 
+def add_security_alt_name(*args):
+    try:
+        ticker, alt_name = args
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: APD.US Air-Products-and-Chemicals")
+        return
+
+    try:
+        db.insert_security_alt_name(ticker, " ".join(alt_name.split("-")))
+    except ValueError as e:
+        print(f"Could not insert alt name. Reason: {e}")
+
+
 def add_earnings_date(*args):
     try:
         ticker, swiss_date = args
@@ -68,184 +121,558 @@ def add_list_change(*args):
     db.insert_list_change(ListChange(ticker, pref_list, event, event_swiss_date, note))
 
 
-def query_list_components(pref_list):
+def bulk_load(*args):
+    try:
+        kind, path = args[:2]
+        batch_size = int(args[2]) if len(args) > 2 else DEFAULT_BATCH_SIZE
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: {BulkLoader.example_input()}")
+        return
+
+    try:
+        result = BulkLoader(db, batch_size).load(kind, path)
+    except (IOError, ValueError) as e:
+        print(f"Could not load {path}. Reason: {e}")
+        return
+
+    for rejected_row in result.rejected_rows:
+        print(f"Rejected line {rejected_row.line_number}: {rejected_row.reason}")
+    print(f"Inserted {result.inserted} {result.kind}, rejected {len(result.rejected_rows)}")
+
+
+def add_bloomberg_scrape_date(*args):
+    loader = BloombergScrapeLoader(db)
+    try:
+        if len(args) == 1:
+            result = loader.load_scrape(args[0])
+        elif len(args) > 2:
+            ticker, swiss_date = args[:2]
+            record = {"ticker": ticker, "date": swiss_date, "name": " ".join(args[2:])}
+            result = loader.load_scrape_records([(1, record)], MANUAL_SCRAPE_SOURCE)
+        else:
+            print(f"{SYNTAX_INPUT_ERROR} Example: {BloombergScrapeLoader.example_input()}")
+            return
+    except (IOError, ValueError) as e:
+        print(f"Could not add Bloomberg dates. Reason: {e}")
+        return
+
+    for rejected_row in result.rejected_rows:
+        print(f"Rejected line {rejected_row.line_number}: {rejected_row.reason}")
+    print(f"Scrape batch {result.scrape_batch_id}: {result.ingested} dates ingested, {result.new} new, "
+          f"rejected {len(result.rejected_rows)}")
+
+
+def split_as_of(args):
+    # a trailing swiss date makes a query point-in-time, e.g. "ls CHCash 31.12.19"
+    try:
+        return args[:-1], int(swiss_date_to_timestamp(args[-1]))
+    except (IndexError, TypeError, ValueError):
+        return args, None
+
+
+def query_list_components(*args):
+    (pref_list, *_), as_of = split_as_of(args)
     try:
         list_info = db.query_list_info(pref_list)
     except Exception as e:
         print(f"Could not find list: Reason {e}")
         return
 
-    list_components = db.query_list_components(pref_list)
-    print(f"== {list_info.name} (weight {list_info.weight} / parent {list_info.parent_list_weight}) ==")
-    print_formatted_list_components(list_components)
+    report.write(f"== {list_info.name} (weight {list_info.weight} / parent {list_info.parent_list_weight}) ==",
+                 {"list": pref_list, **list_info._asdict()})
+    if database_scope == "private":
+        print_formatted_list_components(db.query_list_components(pref_list, as_of=as_of))
+        return
+
+    list_components = db.query_list_components_in_sources(pref_list, db.sources(*DATABASE_SCOPES[database_scope]),
+                                                          as_of=as_of)
+    # earnings dates are those of the private database, same as in private scope
+    dates_summaries = db.query_dates_summaries([component.ticker for component in list_components])
+    for component in list_components:
+        dates_summary = dates_summaries[component.ticker]
+        report.write(f"[added {timestamp_to_swiss_date(component.latest_change_timestamp)}] "
+                     f"{Security.summary(component.name, component.ticker)} ({component.sources}): "
+                     f"{db.format_dates_summary(dates_summary)}", {**component._asdict(), **dates_summary._asdict()})
 
 
-def print_formatted_list_components(list_components):
+def print_formatted_list_components(list_components, dates_summaries=None):
+    if dates_summaries is None:
+        dates_summaries = db.query_dates_summaries([component.ticker for component in list_components])
     for component in list_components:
-        print(f"[added {timestamp_to_swiss_date(component.latest_change_timestamp)}] "
-              f"{Security.summary(component.name, component.ticker)}: "
-              f"{db.print_dates_summary(component.ticker)}")
+        dates_summary = dates_summaries[component.ticker]
+        report.write(f"[added {timestamp_to_swiss_date(component.latest_change_timestamp)}] "
+                     f"{Security.summary(component.name, component.ticker)}: "
+                     f"{db.format_dates_summary(dates_summary)}", {**component._asdict(), **dates_summary._asdict()})
 
-def query_intersection_of_lists(*pref_lists):
+
+def query_list_set(operation, pref_lists, min_lists, excluded_pref_lists=()):
     try:
-        list_names = [item.name for item in map(db.query_list_info, pref_lists)]
+        list_names = [db.query_list_info(pref_list).name for pref_list in pref_lists]
+        excluded_list_names = [db.query_list_info(pref_list).name for pref_list in excluded_pref_lists]
     except Exception as e:
         print(f"Could not find list(s): Reason {e}")
         return
 
-    components_per_list = map(db.query_list_components, pref_lists)
-    components_results_flat = [item for list_result in components_per_list for item in list_result]
-    components_results_flat.sort(key=lambda item : (item.ticker, -item.latest_change_timestamp))
-    components_results_by_ticker = [list(result_for_ticker) for ticker, result_for_ticker
-                                    in groupby(components_results_flat, lambda item : item.ticker)]
+    list_set = db.query_list_set(pref_lists, min_lists, excluded_pref_lists)
+    report.write(f"== {' + '.join(list_names)} {operation} {' + '.join(excluded_list_names)}".rstrip() + " ==",
+                 {"lists": list(pref_lists), "min_lists": min_lists, "excluded_lists": list(excluded_pref_lists)})
+    print_list_set(list_set)
 
-    number_of_input_lists = len(pref_lists)
-    intersection_of_lists = [result_for_ticker[0] for result_for_ticker in components_results_by_ticker
-                             if len(result_for_ticker) == number_of_input_lists]
 
-    print(f"== {' + '.join(list_names)} intersection ==")
-    print_formatted_list_components(intersection_of_lists)
+def print_list_set(list_set):
+    dates_summaries = db.query_dates_summaries([result.ticker for result in list_set])
+    for result in list_set:
+        first_added, last_added = map(timestamp_to_swiss_date, (result.first_added_timestamp,
+                                                                result.last_added_timestamp))
+        added = first_added if first_added == last_added else f"{first_added} - {last_added}"
+        report.write(f"[added {added}] {Security.summary(result.name, result.ticker)}: "
+                     f"{db.format_dates_summary(dates_summaries[result.ticker])}",
+                     {**result._asdict(), **dates_summaries[result.ticker]._asdict()})
 
 
-def query_security(name):
-    for security in db.query_security_info(name):
-        print(f"{Security.summary(security.ticker, security.name)}: {security.ir_website}")
+def query_intersection_of_lists(*pref_lists):
+    if not pref_lists:
+        print(f"{SYNTAX_INPUT_ERROR} Example: CHCash USCash")
+        return
+    # the query counts distinct lists, a list named twice counts once
+    pref_lists = list(dict.fromkeys(pref_lists))
+    query_list_set("intersection", pref_lists, len(pref_lists))
+
+
+def query_union_of_lists(*pref_lists):
+    if not pref_lists:
+        print(f"{SYNTAX_INPUT_ERROR} Example: CHCash USCash")
+        return
+    query_list_set("union", pref_lists, 1)
+
+
+def query_difference_of_lists(*pref_lists):
+    # members of the first list that are on none of the others
+    if not pref_lists:
+        print(f"{SYNTAX_INPUT_ERROR} Example: CHCash USCash")
+        return
+    query_list_set("without", pref_lists[:1], 1, pref_lists[1:])
+
+
+def query_lists_at_least(*args):
+    try:
+        min_lists, *pref_lists = args
+        min_lists = int(min_lists)
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: 2 CHCash USCash DECash")
+        return
+    if not pref_lists:
+        print(f"{SYNTAX_INPUT_ERROR} Example: 2 CHCash USCash DECash")
+        return
+    query_list_set(f"on at least {min_lists}", list(dict.fromkeys(pref_lists)), min_lists)
+
+
+def query_security(*name_parts):
+    for security in db.query_security_info(" ".join(name_parts)):
+        report.write(f"{Security.summary(security.ticker, security.name)}: {security.ir_website}",
+                     security._asdict())
 
 
 def query_list_of_lists(parent_pref_list):
-    for pref_list in db.query_list_of_lists(parent_pref_list):
-        query_list_components(pref_list)
+    # components of every list below parent_pref_list, all levels loaded with two parallel queries
+    try:
+        list_tree, tree_components = db.run_parallel(
+            partial(db.query_list_tree, parent_pref_list, POINTS_DAYS_THRESHOLD),
+            partial(db.query_list_tree_components, parent_pref_list))
+    except ValueError as e:
+        print(f"Could not find list: Reason {e}")
+        return
+
+    dates_summaries = db.query_dates_summaries([component.ticker for list_ticker, component in tree_components])
+    components_by_list = {}
+    for list_ticker, component in tree_components:
+        components_by_list.setdefault(list_ticker, []).append(component)
+
+    for tree_list in list_tree[1:]:
+        report.write(f"== {tree_list.name} (weight {tree_list.weight} / parent {tree_list.parent_list_weight}) ==",
+                     {"list": tree_list.ticker, "name": tree_list.name, "weight": tree_list.weight,
+                      "parent_list_weight": tree_list.parent_list_weight})
+        print_formatted_list_components(components_by_list.get(tree_list.ticker, []), dates_summaries)
+
+
+def query_list_tree(*args):
+    try:
+        pref_list = args[0]
+        threshold_days = int(args[1]) if len(args) > 1 else POINTS_DAYS_THRESHOLD
+    except (IndexError, ValueError):
+        print(f"{SYNTAX_INPUT_ERROR} Example: Empty 90")
+        return
+
+    try:
+        list_tree, list_set = db.run_parallel(partial(db.query_list_tree, pref_list, threshold_days),
+                                              partial(db.query_list_tree_members, pref_list))
+    except ValueError as e:
+        print(f"Could not find list: Reason {e}")
+        return
+
+    for tree_list in list_tree:
+        report.write(f"{'  ' * tree_list.depth}{tree_list.name} ({tree_list.ticker}): weight {tree_list.weight} / "
+                     f"parent {tree_list.parent_list_weight} = {tree_list.effective_weight}, "
+                     f"P: {tree_list.points}, subtree P: {tree_list.subtree_points}", tree_list._asdict())
+
+    report.write(f"== {len(list_set)} securities in {pref_list} and its sublists ==", {"list": pref_list})
+    print_list_set(list_set)
 
 
 def query_points(*args):
+    args, as_of = split_as_of(args)
     threshold_days = int(args[0]) if args else POINTS_DAYS_THRESHOLD
 
-    points_results = db.query_points(threshold_days)
+    points = db.query_points(threshold_days, as_of=as_of) if database_scope == "private" else \
+        db.query_points_in_sources(threshold_days, db.sources(*DATABASE_SCOPES[database_scope]), as_of=as_of)
+    points_results = [result for result in points if result.aggregate_points_value > 0]
+    dates_summaries = db.query_dates_summaries([result.ticker for result in points_results])
 
     for result in points_results:
-        if result.aggregate_points_value > 0:
-            print(f"{result.aggregate_points_value}: {Security.summary(result.name, result.ticker)} "
-                  f"{db.print_dates_summary(result.ticker)}")
+        dates_summary = dates_summaries[result.ticker]
+        report.write(f"{result.aggregate_points_value}: {Security.summary(result.name, result.ticker)} "
+                     f"{db.format_dates_summary(dates_summary)}", {**result._asdict(), **dates_summary._asdict()})
 
 
 def query_time_weighted_points(*args):
+    args, as_of = split_as_of(args)
     country_ticker = args[0] if args else None
 
-    aggregated_values = process_weighted_points_results(*db.query_time_weighted_points(POINTS_DAYS_THRESHOLD,
-                                                                                       country=country_ticker))
+    if database_scope == "private":
+        twp_results = db.query_time_weighted_points(POINTS_DAYS_THRESHOLD, country=country_ticker, as_of=as_of)
+    else:
+        twp_results = db.query_time_weighted_points_in_sources(
+            POINTS_DAYS_THRESHOLD, db.sources(*DATABASE_SCOPES[database_scope]), country=country_ticker, as_of=as_of)
+    aggregated_values = process_weighted_points_results(*twp_results)
 
-    aggregated_values.sort(reverse=True)
+    dates_summaries = db.query_dates_summaries([value.ticker for value in aggregated_values])
     for value in aggregated_values:
-        print(f"{value} {db.print_dates_summary(value.ticker)}")
+        dates_summary = dates_summaries[value.ticker]
+        report.write(f"{value} {db.format_dates_summary(dates_summary)}",
+                     {"name": value.name, "time_weighted_points": value.value, **dates_summary._asdict()})
 
 
-def process_weighted_points_results(twp_results, factor_calculator):
-    aggregated_values = []
+def query_composite_scores(*args):
+    try:
+        top_k = int(args[0]) if args else None
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: 20")
+        return
 
-    processor = None
-    current_result = None
-    for result in twp_results:
-        if processor is None:
-            pass
-        elif result.ticker == processor.ticker:
-            processor.update_current_points(result)
-            continue
-        elif processor.points > 0:
-            aggregated_values.append(AggregatedValue(processor.points, current_result))
+    composite_scores = db.query_composite_scores(top_k)
+    dates_summaries = db.query_dates_summaries([result.ticker for result in composite_scores])
+    for result in composite_scores:
+        dates_summary = dates_summaries[result.ticker]
+        report.write(f"{result.score:.2f}: {Security.summary(result.name, result.ticker)} "
+                     f"{db.format_dates_summary(dates_summary)}", {**result._asdict(), **dates_summary._asdict()})
 
-        processor = WeightedPointsProcessor(result, factor_calculator)
-        current_result = result
 
-    if processor is not None and processor.points > 0:
-        aggregated_values.append(AggregatedValue(processor.points, current_result))
+def update_weight(*args):
+    try:
+        weight_name, value = args
+        value = int(value)
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: Buy 2")
+        return
 
-    return aggregated_values
+    try:
+        db.update_weight_value(weight_name, value)
+    except ValueError as e:
+        print(f"Could not update weight. Reason: {e}")
 
 
-def query_list_history(pref_list):
-    for history_event in db.query_list_history(pref_list):
-        print(f"{Security.summary(history_event.name, history_event.ticker)}: {history_event.event_name} "
-              f"[{timestamp_to_swiss_date(history_event.event_date_timestamp)}]")
+def process_weighted_points_results(twp_results, factor_calculator, kernel=None, top_k=None):
+    kernel = LinearDecayKernel(factor_calculator.max_time_diff) if kernel is None else kernel
+    return WeightedPointsEngine(twp_results).top(factor_calculator.current_time, kernel, top_k)
 
 
-def query_earnings_for_ticker(ticker):
-    print(f"{print_earnings_for_ticker(ticker)}")
+def query_list_series(*args):
+    try:
+        pref_list, start_swiss_date, end_swiss_date = args[:3]
+        start_time, end_time = swiss_date_to_timestamp(start_swiss_date), swiss_date_to_timestamp(end_swiss_date)
+        threshold_days = int(args[3]) if len(args) > 3 else POINTS_DAYS_THRESHOLD
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: CHCash 01.01.19 31.12.19 90")
+        return
 
+    for snapshot in query_daily_list_series(db, pref_list, start_time, end_time, threshold_days):
+        members = ", ".join(f"{ticker} ({snapshot.points[ticker]}/{snapshot.time_weighted_points[ticker]:.2f})"
+                            for ticker in snapshot.members)
+        report.write(f"{timestamp_to_swiss_date(snapshot.timestamp)}: {len(snapshot.members)} members {members}",
+                     snapshot._asdict())
 
-def print_earnings_for_ticker(ticker):
-    result = ""
-    for date in db.query_native_earnings_dates(ticker):
-        result += f"\n{timestamp_to_swiss_date(date)}"
 
-    result += f"\n{BLOOMBERG_DATES_HEADER}"
-    for date in db.query_bloomberg_earnings_dates(ticker):
-        result += f"\n{timestamp_to_swiss_date(date)}"
+def query_missing_earnings(*args):
+    # work queue for data entry, one pass over the whole universe
+    try:
+        limit = int(args[0]) if args else None
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: 50 for the first 50 securities")
+        return
 
-    return result
+    for result in db.query_missing_earnings(POINTS_DAYS_THRESHOLD, limit):
+        issues = [issue for issue, flagged in (("no next date", result.missing_next),
+                                               ("stale previous date", result.stale_previous),
+                                               ("Bloomberg date not in native dates", result.bloomberg_mismatch))
+                  if flagged]
+        report.write(f"{result.number_of_lists} lists, P: {result.points}: "
+                     f"{Security.summary(result.name, result.ticker)}: {', '.join(issues)} "
+                     f"[B: {db.safe_timestamp_to_swiss_date(result.bloomberg_date_timestamp)}, "
+                     f"N: {db.safe_timestamp_to_swiss_date(result.next_date_timestamp)}, "
+                     f"P: {db.safe_timestamp_to_swiss_date(result.previous_date_timestamp)}, "
+                     f"URL: {result.ir_website}]", result._asdict())
 
 
-def query_ticker(ticker):
+def query_upcoming_earnings(*args):
     try:
-        security = db.query_security(ticker)
-    except StopIteration:
-        print(f"No security found for ticker {ticker}")
+        days = int(args[0]) if args else UPCOMING_EARNINGS_DAYS
+    except ValueError:
+        print(f"{SYNTAX_INPUT_ERROR} Example: 14 for the next 14 days, -7 for the past week")
         return
+    lower_timestamp, higher_timestamp = time_range_from_now(days, db.bucketed_time())
 
-    histories = db.query_history(ticker)
+    current_date_timestamp = None
+    for result in db.query_upcoming_earnings(start_of_day(lower_timestamp), higher_timestamp):
+        if result.date_timestamp != current_date_timestamp:
+            current_date_timestamp = result.date_timestamp
+            report.write(f"== {timestamp_to_swiss_date(current_date_timestamp)} ==")
+        report.write(f"{Security.summary(result.name, result.ticker)} [{result.sources}]"
+                     f"{'' if result.lists is None else f' lists: {result.lists}'}", result._asdict())
 
-    print(f"Name: {security.name}\nCountry: {security.country} ({security.country_weight})"
-          f"\nCurrency: {security.currency} ({security.currency_weight})\nIR: {security.ir_website}"
-          f"\nPoints: {print_points_summary_for_ticker(ticker)}")
-    print(f"\n\n### List History ({print_number_of_active_lists_for_ticker(ticker)}) ###"
-          f"{print_histories(histories)}")
-    print(f"\n### Earnings History ###{print_earnings_for_ticker(ticker)}")
 
+def query_list_history(*args):
+    try:
+        pref_list = args[0]
+        page = int(args[1]) if len(args) > 1 else None
+        page_size = int(args[2]) if len(args) > 2 else DEFAULT_PAGE_SIZE
+    except (IndexError, ValueError):
+        print(f"{SYNTAX_INPUT_ERROR} Example: CHCash, or CHCash 2 50 for the second page of 50 changes")
+        return
 
-def print_points_summary_for_ticker(ticker):
-    points_result = db.query_points(POINTS_DAYS_THRESHOLD, ticker=ticker)
-    time_weighted_points_result = process_weighted_points_results(*db.query_time_weighted_points(POINTS_DAYS_THRESHOLD,
-                                                                                                 ticker=ticker))
+    for history_event in db.query_list_history(pref_list, page, page_size):
+        report.write(f"{Security.summary(history_event.name, history_event.ticker)}: {history_event.event_name} "
+                     f"[{timestamp_to_swiss_date(history_event.event_date_timestamp)}]", history_event._asdict())
 
-    # queried one ticker so expect zero or one results
-    try:
-        points = next(points_result).aggregate_points_value
-    except StopIteration:
-        points = 0
-    time_weighted_points = 0.00 if len(time_weighted_points_result) == 0 else time_weighted_points_result[0].value
 
+def query_earnings_for_ticker(ticker):
+    if database_scope != "private":
+        source_dates = db.query_earnings_dates_in_sources(ticker, db.sources(*DATABASE_SCOPES[database_scope]))
+        report.write("".join(f"\n{timestamp_to_swiss_date(date.date_timestamp)} {date.source} "
+                             f"{'' if date.table == NATIVE_DATES_TABLE else '(Bloomberg)'}".rstrip()
+                             for date in source_dates),
+                     {"ticker": ticker, "dates": [date._asdict() for date in source_dates]})
+        return
+
+    native_dates, bloomberg_dates = db.query_native_earnings_dates(ticker), db.query_bloomberg_earnings_dates(ticker)
+    report.write(format_earnings_dates(native_dates, bloomberg_dates),
+                 {"ticker": ticker, "native_dates": native_dates, "bloomberg_dates": bloomberg_dates})
+
+
+def format_earnings_dates(native_dates, bloomberg_dates):
+    return "".join([*(f"\n{timestamp_to_swiss_date(date)}" for date in native_dates), f"\n{BLOOMBERG_DATES_HEADER}",
+                    *(f"\n{timestamp_to_swiss_date(date)}" for date in bloomberg_dates)])
+
+
+def query_ticker(*tickers):
+    dossiers = load_dossiers(db, tickers, POINTS_DAYS_THRESHOLD)
+
+    for ticker in tickers:
+        if ticker not in dossiers:
+            print(f"No security found for ticker {ticker}")
+            continue
+
+        dossier = dossiers[ticker]
+        security = dossier.security
+        text = (f"Name: {security.name}\nCountry: {security.country} ({security.country_weight})"
+                f"\nCurrency: {security.currency} ({security.currency_weight})\nIR: {security.ir_website}"
+                f"\nPoints: {format_points_summary(dossier.time_weighted_points, dossier.points)}"
+                f"\n\n\n### List History ({format_number_of_active_lists(dossier.number_of_active_lists)}) ###"
+                f"{print_histories(dossier.histories)}"
+                f"\n\n### Earnings History ###{format_earnings_dates(dossier.native_dates, dossier.bloomberg_dates)}")
+        report.write(text, {"ticker": ticker, **security._asdict(), "time_weighted_points": dossier.time_weighted_points,
+                            "points": dossier.points, "active_lists": dossier.number_of_active_lists,
+                            "history": [history_event._asdict() for history_event in dossier.histories],
+                            "native_dates": dossier.native_dates, "bloomberg_dates": dossier.bloomberg_dates})
+
+
+def format_points_summary(time_weighted_points, points):
     return f"[T: {time_weighted_points:.2f}, P: {points}]"
 
 
 def print_histories(histories):
     current_list_ticker = None
-    result = ""
+    lines = []
 
     for history_event in histories:
         if history_event.pref_list != current_list_ticker:
             current_list_ticker = history_event.pref_list
             current_list_info = db.query_list_info(current_list_ticker)
-        result += f"\n{history_event.list_name} ({current_list_info.weight}/{current_list_info.parent_list_weight}): " \
-                  f"{history_event.event_name} [{timestamp_to_swiss_date(history_event.event_date_timestamp)}] " \
-                  f"{'' if history_event.event_note is None else history_event.event_note}"
+        lines.append(f"\n{history_event.list_name} ({current_list_info.weight}/{current_list_info.parent_list_weight}): "
+                     f"{history_event.event_name} [{timestamp_to_swiss_date(history_event.event_date_timestamp)}] "
+                     f"{'' if history_event.event_note is None else history_event.event_note}")
 
-    return result
+    return "".join(lines)
 
 
-def print_number_of_active_lists_for_ticker(ticker):
-    number_of_lists = db.query_number_of_active_lists(ticker)
+def format_number_of_active_lists(number_of_lists):
     list_word = "lists" if number_of_lists != 1 else "list"
     return f"{number_of_lists} active {list_word}"
 
 
+def rebuild_list_memberships():
+    print(f"Rebuilt {db.rebuild_list_memberships()} list memberships from list changes")
+    print(f"Rebuilt {db.rebuild_security_scores()} security scores from list changes")
+
+
+def verify_list_memberships():
+    mismatches = db.verify_list_memberships()
+    for mismatch in mismatches:
+        print(f"List {mismatch.list_id}, security {mismatch.security_id}: "
+              f"expected {mismatch.expected}, found {mismatch.actual}")
+    print(f"{len(mismatches)} list membership mismatches")
+
+
+def query_statistics(*args):
+    if args and args[0] == "reset":
+        db.query_statistics.reset()
+        return
+
+    top_k = int(args[0]) if args and args[0].isdigit() else STATISTICS_TOP_STATEMENTS
+    statistics = db.query_statistics
+    report.write("== Commands ==", {"slow_query_seconds": statistics.slow_query_seconds})
+    for command in statistics.top_commands():
+        report.write(f"{command.command}: {command.calls} calls, {command.total_seconds * 1000:.1f} ms total, "
+                     f"{command.total_seconds * 1000 / command.calls:.1f} ms avg, "
+                     f"{command.max_seconds * 1000:.1f} ms max, {command.queries / command.calls:.1f} queries avg",
+                     command._asdict())
+
+    report.write(f"== Top {top_k} statements by total time ==")
+    for statement in statistics.top_statements(top_k):
+        report.write(f"{statement.calls} calls, {statement.rows} rows, {statement.total_seconds * 1000:.1f} ms total, "
+                     f"{statement.max_seconds * 1000:.1f} ms max: {format_sql(statement.sql)}", statement._asdict())
+
+    cache = db.result_cache
+    report.write(f"== Result cache: {len(cache.entries)} results, {cache.number_of_bytes / 1024:.0f} KiB, "
+                 f"{cache.hits} hits, {cache.misses} misses ==",
+                 {"results": len(cache.entries), "bytes": cache.number_of_bytes, "hits": cache.hits,
+                  "misses": cache.misses})
+
+    report.write(f"== Slow queries (>= {statistics.slow_query_seconds * 1000:.0f} ms) ==")
+    for slow_query in statistics.slow_queries:
+        plan = "".join(f"\n    {step}" for step in slow_query.plan)
+        parameters = ", ".join(map(repr, slow_query.parameters[:STATISTICS_PARAMETERS]))
+        if len(slow_query.parameters) > STATISTICS_PARAMETERS:
+            parameters += f", ... ({len(slow_query.parameters)} parameters)"
+        report.write(f"{slow_query.seconds * 1000:.1f} ms, {slow_query.rows} rows, parameters ({parameters}): "
+                     f"{format_sql(slow_query.sql)}{plan}", slow_query._asdict())
+
+
+def format_sql(sql):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= STATISTICS_SQL_LENGTH else f"{sql[:STATISTICS_SQL_LENGTH]}..."
+
+
+def export_snapshot(*args):
+    # columnar .npy files and a manifest, for analytics that memory map them through snapshot.Snapshot
+    if len(args) != 1:
+        print(f"{SYNTAX_INPUT_ERROR} Example: snapshots/2020-01")
+        return
+
+    manifest = export_columnar_snapshot(db, args[0])
+    for table_name, table in manifest["tables"].items():
+        report.write(f"{table_name}: {table['rows']} rows", {"table": table_name, "rows": table["rows"]})
+
+
+def switch_databases(*args):
+    # without reconnecting: public is attached once and read through merged views, ids reconciled by ticker
+    global database_scope
+    scope = args[0] if args else ("public" if database_scope == "private" else "private")
+    if scope not in DATABASE_SCOPES:
+        print(f"{SYNTAX_INPUT_ERROR} Example: public, or one of {', '.join(DATABASE_SCOPES)}")
+        return
+
+    if scope != "private" and db.attached_schema is None:
+        try:
+            db.attach_database(PUBLIC_DB_PATH)
+        except IOError as e:
+            print(f"Could not attach database. Reason: {e}")
+            return
+    database_scope = scope
+    print(f"ls, he, p and twp report on: {scope}, other commands on private")
+
+
 def clean_up():
     db.close()
     raise SystemExit
 
 
-def main():
+def parse_arguments(argv):
+    parser = ArgumentParser(description="Track changes to \"Most Preferred\" lists by equity analysts")
+    parser.add_argument("--batch", metavar="FILE", help=f"run the menu commands in FILE, {STDIN_PATH} for stdin")
+    parser.add_argument("--json", action="store_true", help="in batch mode, print query results as JSON lines")
+    parser.add_argument("--serve", metavar="SOCKET", nargs="?", const=DEFAULT_SOCKET_PATH,
+                        help=f"serve menu commands to client.py on a unix socket, {DEFAULT_SOCKET_PATH} by default")
+    parser.add_argument("--slow-query-ms", type=float, default=DEFAULT_SLOW_QUERY_SECONDS * 1000,
+                        help="log queries at least this slow with their query plan, shown by the stats command")
+    parser.add_argument("--result-cache-mb", type=float, default=DEFAULT_RESULT_CACHE_BYTES / (1 << 20),
+                        help="memory for results of repeated queries, 0 turns the cache off")
+    parser.add_argument("--freshness-seconds", type=int, default=DEFAULT_FRESHNESS_SECONDS,
+                        help="time dependent queries may return results up to this old")
+    return parser.parse_args(argv)
+
+
+def run_batch(commands_path):
+    with (nullcontext(sys.stdin) if commands_path == STDIN_PATH else open(commands_path)) as command_lines:
+        Menu(MENU_OPTIONS, launch, db.query_statistics).run_commands(command_lines)
+
+
+def run_server(socket_path):
+    # connection and caches stay warm between commands; q stops the server
+    menu = Menu(MENU_OPTIONS, launch, db.query_statistics)
+
+    def run_command(command, as_json, session):
+        # commands run one at a time, the globals hold the state of the client whose command runs
+        global report, database_scope
+        stdout, stderr = StringIO(), StringIO()
+        report = JsonReport(stdout) if as_json else TextReport()
+        database_scope = session.get("database_scope", DEFAULT_DATABASE_SCOPE)
+        try:
+            with redirect_stdout(stderr if as_json else stdout):
+                menu.parse_command(command)
+        finally:
+            session["database_scope"] = database_scope
+        return stdout.getvalue(), stderr.getvalue()
+
     db.connect()
-    menu = Menu(MENU_OPTIONS, launch)
-    menu.wait_for_input()
+    try:
+        serve(socket_path, run_command)
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    global report
+    arguments = parse_arguments(argv)
+    db.query_statistics.slow_query_seconds = arguments.slow_query_ms / 1000
+    db.result_cache.max_bytes = int(arguments.result_cache_mb * (1 << 20))
+    db.freshness_seconds = arguments.freshness_seconds
+
+    if arguments.serve is not None:
+        run_server(arguments.serve)
+        return
+
+    if arguments.batch is None:
+        db.connect()
+        menu = Menu(MENU_OPTIONS, launch, db.query_statistics)
+        menu.wait_for_input()
+        return
+
+    # JSON lines go to stdout, any other output of the commands to stderr
+    report = JsonReport(sys.stdout) if arguments.json else TextReport()
+    with redirect_stdout(sys.stderr if arguments.json else sys.stdout):
+        db.connect()
+        run_batch(arguments.batch)
+        db.close()
 
 
 if __name__ == "__main__":
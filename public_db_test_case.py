@@ -0,0 +1,26 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from database import Database
+
+PUBLIC_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public.db")
+
+
+class PublicDatabaseTestCase(TestCase):
+    # every test connects to its own copy of public.db in a temp directory, the tracked file is never written
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = self.copy_public_database("test.db")
+        self.db = Database(self.db_path)
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def copy_public_database(self, name):
+        path = os.path.join(self.temp_dir, name)
+        shutil.copyfile(PUBLIC_DB_PATH, path)
+        return path
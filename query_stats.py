@@ -0,0 +1,56 @@
+import threading
+from collections import deque
+from typing import NamedTuple
+
+DEFAULT_SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_LOG_SIZE = 50
+
+StatementStatistics = NamedTuple("StatementStatistics", [("sql", str), ("calls", int), ("rows", int),
+                                                         ("total_seconds", float), ("max_seconds", float)])
+CommandStatistics = NamedTuple("CommandStatistics", [("command", str), ("calls", int), ("queries", int),
+                                                     ("total_seconds", float), ("max_seconds", float)])
+SlowQuery = NamedTuple("SlowQuery", [("sql", str), ("parameters", tuple), ("seconds", float), ("rows", int),
+                                     ("plan", list)])
+
+
+def add_call(statistics, seconds, **counts):
+    # statistics are immutable NamedTuples, a call returns the next aggregate
+    return statistics._replace(calls=statistics.calls + 1, total_seconds=statistics.total_seconds + seconds,
+                               max_seconds=max(statistics.max_seconds, seconds),
+                               **{name: getattr(statistics, name) + count for name, count in counts.items()})
+
+
+class QueryStatistics:
+    # aggregated per sql text, which run_query keeps fixed, and per menu command
+    def __init__(self, slow_query_seconds=DEFAULT_SLOW_QUERY_SECONDS):
+        self.slow_query_seconds = slow_query_seconds
+        # never reset, commands count their queries as the difference before and after
+        self.number_of_queries = 0
+        # queries run in parallel record from worker threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.statements = {}
+        self.commands = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def record_query(self, sql, parameters, seconds, rows, explain):
+        with self.lock:
+            self.number_of_queries += 1
+            statistics = self.statements.get(sql) or StatementStatistics(sql, 0, 0, 0.0, 0.0)
+            self.statements[sql] = add_call(statistics, seconds, rows=rows)
+
+        # the plan is only worth its extra statement for the offenders
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self.slow_queries.append(SlowQuery(sql, tuple(parameters), seconds, rows, explain(sql, parameters)))
+
+    def record_command(self, command, seconds, queries):
+        statistics = self.commands.get(command) or CommandStatistics(command, 0, 0, 0.0, 0.0)
+        self.commands[command] = add_call(statistics, seconds, queries=queries)
+
+    def top_statements(self, k):
+        return sorted(self.statements.values(), key=lambda statistics: statistics.total_seconds, reverse=True)[:k]
+
+    def top_commands(self):
+        return sorted(self.commands.values(), key=lambda statistics: statistics.total_seconds, reverse=True)
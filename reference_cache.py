@@ -0,0 +1,64 @@
+from collections import Counter
+from typing import NamedTuple
+
+WeightRow = NamedTuple("WeightRow", [("weight_id", int), ("name", str), ("value", int)])
+CountryRow = NamedTuple("CountryRow", [("country_id", int), ("ticker", str), ("name", str), ("weight_id", int)])
+CurrencyRow = NamedTuple("CurrencyRow", [("currency_id", int), ("ticker", str), ("name", str), ("weight_id", int)])
+ListRow = NamedTuple("ListRow", [("list_id", int), ("ticker", str), ("name", str), ("weight_id", int),
+                                 ("parent_list_id", int)])
+EventRow = NamedTuple("EventRow", [("event_id", int), ("ticker", str), ("name", str), ("value", int),
+                                   ("value_sign", int)])
+
+# small lookup tables, first field of each row type is the table's primary key
+REFERENCE_TABLES = {"weights": WeightRow, "countries": CountryRow, "currencies": CurrencyRow, "lists": ListRow,
+                    "list_change_events": EventRow}
+
+
+class ReferenceDataCache:
+    def __init__(self, db):
+        self.db = db
+        self.rows_by_id = None
+        self.ids_by_ticker = None
+
+    def load(self):
+        self.rows_by_id = {}
+        self.ids_by_ticker = {}
+
+        for table_name, row_type in REFERENCE_TABLES.items():
+            rows = list(map(row_type._make, self.db.run_query(f"SELECT {', '.join(row_type._fields)} "
+                                                              f"FROM {table_name}")))
+            self.rows_by_id[table_name] = {row[0]: row for row in rows}
+
+            if "ticker" in row_type._fields:
+                # ambiguous tickers are left out, same as a lookup query returning more than one row
+                ticker_counts = Counter(row.ticker for row in rows)
+                self.ids_by_ticker[table_name] = {row.ticker: row[0] for row in rows if ticker_counts[row.ticker] == 1}
+
+    def invalidate(self):
+        self.rows_by_id = None
+        self.ids_by_ticker = None
+
+    def ensure_loaded(self):
+        if self.rows_by_id is None:
+            self.load()
+
+    def primary_key_for_ticker(self, table_name, ticker):
+        self.ensure_loaded()
+        try:
+            return self.ids_by_ticker[table_name][ticker]
+        except KeyError:
+            raise ValueError(f"Found no primary key match for value: {ticker}")
+
+    def primary_keys_by_ticker(self, table_name):
+        self.ensure_loaded()
+        return dict(self.ids_by_ticker[table_name])
+
+    def row(self, table_name, primary_key):
+        self.ensure_loaded()
+        try:
+            return self.rows_by_id[table_name][primary_key]
+        except KeyError:
+            raise ValueError(f"Found no {table_name} row for primary key: {primary_key}")
+
+    def row_for_ticker(self, table_name, ticker):
+        return self.row(table_name, self.primary_key_for_ticker(table_name, ticker))
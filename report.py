@@ -0,0 +1,59 @@
+import io
+import json
+import sys
+from contextlib import redirect_stdout
+
+# a command's output is written out in pieces of about this size instead of line by line
+FLUSH_SIZE = 1 << 20
+
+
+class TextReport:
+    def __init__(self):
+        self.buffer = None
+        self.redirect = None
+        self.stream = None
+
+    def write(self, text, record=None):
+        print(text)
+        if self.buffer is not None and self.buffer.tell() >= FLUSH_SIZE:
+            self.flush()
+
+    def begin_command(self, method_name, argument_list):
+        # everything the command prints, report lines and messages alike, goes through one buffer in order
+        self.stream = sys.stdout
+        self.buffer = io.StringIO()
+        self.redirect = redirect_stdout(self.buffer)
+        self.redirect.__enter__()
+
+    def flush(self):
+        self.stream.write(self.buffer.getvalue())
+        self.stream.flush()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def end_command(self):
+        if self.buffer is None:
+            return
+        self.redirect.__exit__(None, None, None)
+        self.flush()
+        self.buffer = self.redirect = self.stream = None
+
+
+class JsonReport(TextReport):
+    # one JSON line per command, holding the records its query produced instead of the formatted text
+    def __init__(self, stream):
+        self.stream = stream
+        self.command = None
+        self.records = []
+
+    def write(self, text, record=None):
+        if record is not None:
+            self.records.append(record)
+
+    def begin_command(self, method_name, argument_list):
+        self.command = {"command": method_name, "arguments": list(argument_list)}
+        self.records = []
+
+    def end_command(self):
+        self.stream.write(f"{json.dumps({**self.command, 'records': self.records})}\n")
+        self.stream.flush()
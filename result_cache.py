@@ -0,0 +1,91 @@
+import re
+import sys
+import threading
+from collections import OrderedDict, Counter
+
+DEFAULT_RESULT_CACHE_BYTES = 64 << 20
+# time dependent queries read the current time rounded down to this, so repeats within it hit the cache
+DEFAULT_FRESHNESS_SECONDS = 60
+SQL_WORD_PATTERN = re.compile(r"[a-z_][a-z0-9_]*")
+# the merged views of an attached database depend on their main tables
+MERGED_VIEW_PREFIX = "all_"
+
+
+def result_size(results):
+    # rough, values shared between rows count once per row
+    return sys.getsizeof(results) + sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in results)
+
+
+class ResultCache:
+    # query results keyed by sql and parameters, valid while no table the sql names was written since
+    def __init__(self, max_bytes=DEFAULT_RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.table_names = frozenset()
+        self.generations = Counter()
+        self.dependencies = {}
+        self.entries = OrderedDict()
+        self.number_of_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # parallel queries read and fill the cache from worker threads
+        self.lock = threading.Lock()
+
+    def set_table_names(self, table_names):
+        with self.lock:
+            self.table_names = frozenset(table_names)
+            self.dependencies = {}
+
+    def tables_for_sql(self, sql):
+        if sql not in self.dependencies:
+            words = (word[len(MERGED_VIEW_PREFIX):] if word.startswith(MERGED_VIEW_PREFIX) else word
+                     for word in SQL_WORD_PATTERN.findall(sql.lower()))
+            self.dependencies[sql] = tuple(sorted(self.table_names.intersection(words)))
+        return self.dependencies[sql]
+
+    def write_generations(self, sql):
+        with self.lock:
+            return self.current_generations(sql)
+
+    def current_generations(self, sql):
+        return tuple(self.generations[table_name] for table_name in self.tables_for_sql(sql))
+
+    def get(self, sql, parameters):
+        # None on a miss, results are never None
+        with self.lock:
+            entry = self.entries.get((sql, parameters))
+            if entry is None or entry[0] != self.current_generations(sql):
+                self.remove((sql, parameters))
+                self.misses += 1
+                return None
+            self.entries.move_to_end((sql, parameters))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, sql, parameters, results, generations):
+        # generations as read before the query ran, a write during it leaves the entry outdated
+        size = result_size(results)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            self.remove((sql, parameters))
+            self.entries[(sql, parameters)] = (generations, results, size)
+            self.number_of_bytes += size
+            # least recently used first
+            while self.number_of_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.number_of_bytes -= entry[2]
+
+    def record_write(self, *table_names):
+        # entries of older generations are dropped on their next lookup or by eviction
+        with self.lock:
+            self.generations.update(table_names)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.number_of_bytes = 0
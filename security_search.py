@@ -0,0 +1,94 @@
+from math import ceil
+from sqlite3 import Error
+
+SECURITIES_SEARCH_TABLE = "securities_search"
+TRIGRAM_LENGTH = 3
+# a fuzzy hit shares at least this share of the trigrams of the text, so one common trigram doesn't match
+MIN_FUZZY_TRIGRAM_SHARE = 0.5
+SECURITIES_SEARCH_TRIGGERS = ["securities_search_insert", "securities_search_update", "securities_search_delete",
+                              "securities_alt_names_search_insert", "securities_alt_names_search_update",
+                              "securities_alt_names_search_delete"]
+
+# one row per security name (rowid = security_id) and per alt name (rowid = -alt_name_id), kept in sync by triggers
+SECURITIES_SEARCH_INDEX_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SECURITIES_SEARCH_TABLE} USING fts5(ticker, name, "
+    "security_id UNINDEXED, tokenize = 'trigram')",
+    f"DELETE FROM {SECURITIES_SEARCH_TABLE}",
+    f"INSERT INTO {SECURITIES_SEARCH_TABLE}(rowid, ticker, name, security_id) "
+    "SELECT security_id, ticker, name, security_id FROM securities",
+    f"INSERT INTO {SECURITIES_SEARCH_TABLE}(rowid, ticker, name, security_id) "
+    "SELECT -a.alt_name_id, s.ticker, a.alt_name, s.security_id FROM securities_alt_names a, securities s "
+    "WHERE s.security_id = a.security_id",
+    "CREATE TRIGGER IF NOT EXISTS securities_search_insert AFTER INSERT ON securities BEGIN "
+    f"INSERT INTO {SECURITIES_SEARCH_TABLE}(rowid, ticker, name, security_id) "
+    "VALUES (new.security_id, new.ticker, new.name, new.security_id); END",
+    "CREATE TRIGGER IF NOT EXISTS securities_search_update AFTER UPDATE OF ticker, name ON securities BEGIN "
+    f"UPDATE {SECURITIES_SEARCH_TABLE} SET ticker = new.ticker WHERE security_id = new.security_id; "
+    f"UPDATE {SECURITIES_SEARCH_TABLE} SET name = new.name WHERE rowid = new.security_id; END",
+    "CREATE TRIGGER IF NOT EXISTS securities_search_delete AFTER DELETE ON securities BEGIN "
+    f"DELETE FROM {SECURITIES_SEARCH_TABLE} WHERE security_id = old.security_id; END",
+    "CREATE TRIGGER IF NOT EXISTS securities_alt_names_search_insert AFTER INSERT ON securities_alt_names BEGIN "
+    f"INSERT INTO {SECURITIES_SEARCH_TABLE}(rowid, ticker, name, security_id) "
+    "SELECT -new.alt_name_id, ticker, new.alt_name, security_id FROM securities "
+    "WHERE security_id = new.security_id; END",
+    "CREATE TRIGGER IF NOT EXISTS securities_alt_names_search_update AFTER UPDATE ON securities_alt_names BEGIN "
+    f"DELETE FROM {SECURITIES_SEARCH_TABLE} WHERE rowid = -old.alt_name_id; "
+    f"INSERT INTO {SECURITIES_SEARCH_TABLE}(rowid, ticker, name, security_id) "
+    "SELECT -new.alt_name_id, ticker, new.alt_name, security_id FROM securities "
+    "WHERE security_id = new.security_id; END",
+    "CREATE TRIGGER IF NOT EXISTS securities_alt_names_search_delete AFTER DELETE ON securities_alt_names BEGIN "
+    f"DELETE FROM {SECURITIES_SEARCH_TABLE} WHERE rowid = -old.alt_name_id; END",
+]
+
+
+def supports_trigram_search(connection):
+    try:
+        connection.execute("CREATE VIRTUAL TABLE temp.trigram_probe USING fts5(text, tokenize = 'trigram')")
+        connection.execute("DROP TABLE temp.trigram_probe")
+        return True
+    except Exception:
+        return False
+
+
+def ensure_securities_search_index(connection):
+    # the index follows the sqlite build the file is opened with, not the schema version: built when trigram search
+    # is supported and the table or one of its triggers is missing, otherwise the triggers are dropped so writes to
+    # securities don't need fts5; returns whether the index can be searched
+    search_objects = [SECURITIES_SEARCH_TABLE, *SECURITIES_SEARCH_TRIGGERS]
+    existing = {name for name, in connection.execute(
+        f"SELECT name FROM sqlite_master WHERE name IN ({', '.join('?' * len(search_objects))})", search_objects)}
+
+    if supports_trigram_search(connection):
+        # a build without trigram support may have left the table behind, out of date, without its triggers
+        if existing != set(search_objects):
+            connection.executescript(f"BEGIN;\n{';'.join(SECURITIES_SEARCH_INDEX_STATEMENTS)};\nCOMMIT;")
+            print(f"Built {SECURITIES_SEARCH_TABLE} index")
+        return True
+
+    if existing:
+        connection.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in SECURITIES_SEARCH_TRIGGERS))
+        try:
+            connection.execute(f"DROP TABLE IF EXISTS {SECURITIES_SEARCH_TABLE}")
+        except Error:
+            # without fts5 the table can't be dropped, unused without its triggers
+            pass
+        connection.commit()
+    return False
+
+
+def phrase_query(text):
+    return f"\"{text.replace(chr(34), chr(34) * 2)}\""
+
+
+def text_trigrams(text):
+    return list(dict.fromkeys(text[start:start + TRIGRAM_LENGTH].lower()
+                              for start in range(len(text) - TRIGRAM_LENGTH + 1)))
+
+
+def fuzzy_query(trigrams):
+    # candidates sharing any trigram, filtered and ranked by how many they share
+    return " OR ".join(map(phrase_query, trigrams))
+
+
+def min_shared_trigrams(trigrams):
+    return ceil(len(trigrams) * MIN_FUZZY_TRIGRAM_SHARE)
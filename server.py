@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from queue import Queue
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+
+DEFAULT_SOCKET_PATH = "preferred.sock"
+ENCODING = "utf-8"
+# how long a stopping server waits for the answer to the stop command to be sent
+STOP_RESPONSE_SECONDS = 5
+
+
+# one json object per line both ways: {"command": str, "json": bool} in, {"stdout": str, "stderr": str} out
+def encode_message(message):
+    return (json.dumps(message) + "\n").encode(ENCODING)
+
+
+def decode_message(line):
+    return json.loads(line.decode(ENCODING))
+
+
+class PendingCommand:
+    def __init__(self, command, as_json, session):
+        self.command = command
+        self.as_json = as_json
+        self.session = session
+        self.response = None
+        self.done = threading.Event()
+        self.sent = threading.Event()
+
+
+class CommandRequestHandler(StreamRequestHandler):
+    # any number of commands per connection, each answered before the next one is read
+    def handle(self):
+        # state the commands of this connection keep between them, e.g. the database scope
+        session = {}
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            request = decode_message(line)
+            pending = PendingCommand(request["command"], request.get("json", False), session)
+            self.server.pending_commands.put(pending)
+            pending.done.wait()
+            try:
+                self.wfile.write(encode_message(pending.response))
+                self.wfile.flush()
+            finally:
+                pending.sent.set()
+
+
+class CommandServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, CommandRequestHandler)
+        self.pending_commands = Queue()
+
+
+def serve(socket_path, run_command):
+    # clients connect and wait concurrently, commands run one at a time on the calling thread, which owns the
+    # database's writer connection; run_command(command, as_json, session) returns (stdout, stderr), session is a
+    # dict of the client connection's own state; SystemExit stops serving
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = CommandServer(socket_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on {socket_path}")
+
+    try:
+        while True:
+            pending = server.pending_commands.get()
+            try:
+                stdout, stderr = run_command(pending.command, pending.as_json, pending.session)
+                pending.response = {"stdout": stdout, "stderr": stderr}
+            except SystemExit:
+                pending.response = {"stdout": "", "stderr": "Server stopped\n"}
+                pending.done.set()
+                pending.sent.wait(STOP_RESPONSE_SECONDS)
+                return
+            except Exception as e:
+                pending.response = {"stdout": "", "stderr": f"Command failed. Reason: {e}\n"}
+            finally:
+                pending.done.set()
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
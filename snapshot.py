@@ -0,0 +1,166 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from database import BLOOMBERG_DATES_TABLE, NATIVE_DATES_TABLE
+
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_FORMAT_VERSION = 1
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# room for any row count, so the header can be rewritten in place once the rows are counted
+NPY_HEADER_SIZE = 128
+BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+# array typecode per numpy type, 'i' and 'q' are 4 and 8 bytes on every platform python supports
+TYPECODES = {"i4": "i", "i8": "q"}
+# dictionary encoded columns hold the position of the id in the dictionary, not the id itself
+DICTIONARIES = {
+    "securities": "SELECT security_id, ticker FROM securities ORDER BY security_id",
+    "lists": "SELECT list_id, ticker FROM lists ORDER BY list_id",
+    "list_change_events": "SELECT event_id, ticker, value, value_sign FROM list_change_events ORDER BY event_id"}
+# (column, numpy type, dictionary or None) per table; rows in date order, the order backtests read them in
+SNAPSHOT_TABLES = {
+    "list_changes": ("SELECT change_id, list_id, security_id, event_id, date_epoch FROM list_changes "
+                     "ORDER BY date_epoch, change_id",
+                     [("change_id", "i8", None), ("list", "i4", "lists"), ("security", "i4", "securities"),
+                      ("event", "i4", "list_change_events"), ("date_epoch", "i8", None)]),
+    NATIVE_DATES_TABLE: (f"SELECT security_id, date_epoch FROM {NATIVE_DATES_TABLE} "
+                         "ORDER BY date_epoch, earnings_date_id",
+                         [("security", "i4", "securities"), ("date_epoch", "i8", None)]),
+    BLOOMBERG_DATES_TABLE: (f"SELECT security_id, date_epoch, scrape_batch_id FROM {BLOOMBERG_DATES_TABLE} "
+                            "ORDER BY date_epoch, bloomberg_date_id",
+                            [("security", "i4", "securities"), ("date_epoch", "i8", None),
+                             ("scrape_batch_id", "i8", None)])}
+# nulls in integer columns, and codes of ids without a dictionary entry
+MISSING_VALUE = -1
+WRITE_BATCH_ROWS = 1 << 16
+
+
+def npy_header(numpy_type, rows):
+    # .npy format version 1.0, readable by numpy.load(path, mmap_mode="r") as well
+    header = repr({"descr": BYTE_ORDER + numpy_type, "fortran_order": False, "shape": (rows,)})
+    header = header.ljust(NPY_HEADER_SIZE - len(NPY_MAGIC) - 3) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class ColumnWriter:
+    def __init__(self, path, numpy_type):
+        self.file = open(path, "wb")
+        self.numpy_type = numpy_type
+        self.values = array(TYPECODES[numpy_type])
+        self.rows = 0
+        self.file.write(npy_header(numpy_type, 0))
+
+    def append(self, value):
+        self.values.append(value)
+
+    def flush(self):
+        self.values.tofile(self.file)
+        self.rows += len(self.values)
+        del self.values[:]
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header(self.numpy_type, self.rows))
+        self.file.close()
+
+
+def column_file(table_name, column_name):
+    return f"{table_name}.{column_name}.npy"
+
+
+def export_snapshot(db, directory):
+    # tables are streamed in batches, one batch of each column in memory at a time
+    os.makedirs(directory, exist_ok=True)
+    dictionaries, codes = {}, {}
+    for name, sql in DICTIONARIES.items():
+        rows = db.run_query(sql)
+        codes[name] = {row[0]: code for code, row in enumerate(rows)}
+        dictionaries[name] = {"ids": [row[0] for row in rows], "tickers": [row[1] for row in rows]}
+        if name == "list_change_events":
+            dictionaries[name].update(values=[row[2] for row in rows], value_signs=[row[3] for row in rows])
+
+    tables = {}
+    for table_name, (sql, columns) in SNAPSHOT_TABLES.items():
+        writers = [ColumnWriter(os.path.join(directory, column_file(table_name, column_name)), numpy_type)
+                   for column_name, numpy_type, dictionary in columns]
+        # ids missing from their dictionary table (rows left behind by a deleted security) are encoded as missing
+        column_codes = [codes[dictionary] if dictionary else None for unused, unused, dictionary in columns]
+        try:
+            for row in db.stream_query(sql):
+                for writer, codes_by_id, value in zip(writers, column_codes, row):
+                    if value is None:
+                        writer.append(MISSING_VALUE)
+                    else:
+                        writer.append(int(value) if codes_by_id is None else codes_by_id.get(value, MISSING_VALUE))
+                if len(writers[0].values) >= WRITE_BATCH_ROWS:
+                    for writer in writers:
+                        writer.flush()
+        finally:
+            for writer in writers:
+                writer.close()
+        tables[table_name] = {"rows": writers[0].rows, "columns": {
+            column_name: {"file": column_file(table_name, column_name), "dtype": BYTE_ORDER + numpy_type,
+                          "dictionary": dictionary} for column_name, numpy_type, dictionary in columns}}
+
+    manifest = {"format_version": SNAPSHOT_FORMAT_VERSION, "created_epoch": int(time.time()), "source": db.path,
+                "schema_version": db.schema_version, "tables": tables, "dictionaries": dictionaries}
+    # written last, a directory without a manifest is an unfinished export
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class Snapshot:
+    # columns are memoryviews over read-only memory maps, nothing is copied until a value is read
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+        if self.manifest["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Snapshot format version {self.manifest['format_version']} not supported")
+        self.maps = []
+        self.views = []
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def rows(self, table_name):
+        return self.manifest["tables"][table_name]["rows"]
+
+    def column(self, table_name, column_name):
+        if (table_name, column_name) not in self.columns:
+            column = self.manifest["tables"][table_name]["columns"][column_name]
+            if column["dtype"][0] != BYTE_ORDER:
+                raise ValueError(f"Column {column['file']} was written with a different byte order")
+
+            with open(os.path.join(self.directory, column["file"]), "rb") as file:
+                header_size = len(NPY_MAGIC) + 2 + struct.unpack("<H", file.read(len(NPY_MAGIC) + 2)[-2:])[0]
+                # the mapping stays valid after the file is closed
+                column_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(column_map)
+            self.maps.append(column_map)
+            self.views.append(view)
+            self.columns[(table_name, column_name)] = view[header_size:].cast(TYPECODES[column["dtype"][1:]])
+        return self.columns[(table_name, column_name)]
+
+    def dictionary(self, name):
+        return self.manifest["dictionaries"][name]
+
+    def close(self):
+        # views first, mmap refuses to close while one is alive; columns read from this snapshot become unusable
+        for view in [*self.columns.values(), *self.views]:
+            view.release()
+        self.columns.clear()
+        self.views.clear()
+        for column_map in self.maps:
+            column_map.close()
+        self.maps.clear()
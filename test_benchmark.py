@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from benchmark import (choose_sample, database_cases, generate_database, report_cases, run_benchmarks,
+                       uncovered_query_methods)
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = generate_database(os.path.join(self.temp_dir, "benchmark.db"), securities=300, list_changes=3000,
+                                    earnings_dates=1200, lists=30)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_generated_database_is_consistent(self):
+        self.assertEqual(3000, self.db.run_query("SELECT COUNT(*) FROM list_changes")[0][0])
+        self.assertEqual(1200, self.db.run_query("SELECT COUNT(*) FROM earnings_dates")[0][0])
+        self.assertEqual([], self.db.verify_list_memberships())
+
+    def test_every_query_method_and_report_runs(self):
+        sample = choose_sample(self.db)
+        self.assertEqual([], uncovered_query_methods(sample))
+
+        results = run_benchmarks(self.db, repeat=1, sample=sample)
+        self.assertEqual(len(database_cases(sample)) + len(report_cases(sample)), len(results))
@@ -0,0 +1,46 @@
+import os
+
+from bloomberg_scrape import BloombergScrapeLoader
+from bulk_loader import BulkLoader
+from date_util import swiss_date_to_timestamp
+from public_db_test_case import PublicDatabaseTestCase
+
+
+class TestBulkLoader(PublicDatabaseTestCase):
+    def write_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_load_list_changes_rejects_unknown_tickers(self):
+        path = self.write_file("changes.jsonl", '{"ticker": "APD.US", "list": "CHCash", "event": "add", '
+                                                '"date": "01.01.21"}\n'
+                                                '{"ticker": "UNKNOWN", "list": "CHCash", "event": "add", '
+                                                '"date": "01.01.21"}\n')
+        result = BulkLoader(self.db, batch_size=1).load("list_changes", path)
+
+        self.assertEqual(1, result.inserted)
+        self.assertEqual([2], [rejected_row.line_number for rejected_row in result.rejected_rows])
+        self.assertIn("APD.US", [component.ticker for component in self.db.query_list_components("CHCash")])
+        self.assertEqual([], self.db.verify_list_memberships())
+
+    def test_load_securities_rejects_duplicate_tickers(self):
+        path = self.write_file("securities.csv", "name,ticker,country,ir_website,currency\n"
+                                                 "New Co,NEW.US,US,http://new.example,USD\n"
+                                                 "New Co,NEW.US,US,http://new.example,USD\n"
+                                                 "Air Products,APD.US,US,http://new.example,USD\n")
+        result = BulkLoader(self.db).load("securities", path)
+
+        self.assertEqual(1, result.inserted)
+        self.assertEqual([3, 4], [rejected_row.line_number for rejected_row in result.rejected_rows])
+
+    def test_reingesting_bloomberg_scrape_is_idempotent(self):
+        path = self.write_file("scrape.csv", "ticker,date,name\n"
+                                             "APD.US,30.04.20,Earnings Announcement for Period Ending Q1/2020\n")
+        first_result = BloombergScrapeLoader(self.db).load_scrape(path)
+        second_result = BloombergScrapeLoader(self.db).load_scrape(path)
+
+        self.assertEqual((1, 1), (first_result.ingested, first_result.new))
+        self.assertEqual((1, 0), (second_result.ingested, second_result.new))
+        self.assertEqual(swiss_date_to_timestamp("30.04.20"), self.db.query_newest_earnings_date_for_ticker("APD.US"))
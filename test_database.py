@@ -0,0 +1,324 @@
+import sqlite3
+import time
+from contextlib import closing, redirect_stdout
+from functools import partial
+from io import StringIO
+from unittest.mock import patch
+
+import preferred
+from composite_score import score_decay, SCORE_EPOCH, SCORE_EPOCH_TABLE, SCORE_REBASE_DAYS, SECURITY_SCORES_TABLE
+from date_util import days_to_seconds, start_of_day, swiss_date_to_timestamp, timestamp_to_swiss_date
+from earnings_date import EarningsDate
+from dossier import load_dossiers
+from list_change import ListChange
+from migrations import LATEST_SCHEMA_VERSION
+from public_db_test_case import PublicDatabaseTestCase
+from report import TextReport
+from time_series import query_daily_list_series
+
+
+class TestDatabase(PublicDatabaseTestCase):
+    def test_list_memberships_match_event_log(self):
+        self.assertEqual([], self.db.verify_list_memberships())
+
+    def test_insert_list_change_updates_list_memberships(self):
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "add", "01.01.21", None))
+        self.assertIn("APD.US", [component.ticker for component in self.db.query_list_components("CHCash")])
+
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "rem", "02.01.21", None))
+        self.assertNotIn("APD.US", [component.ticker for component in self.db.query_list_components("CHCash")])
+        self.assertEqual([], self.db.verify_list_memberships())
+
+    def test_dates_summaries_include_unknown_tickers(self):
+        summaries = self.db.print_dates_summaries(["APD.US", "UNKNOWN"])
+        self.assertEqual({"APD.US", "UNKNOWN"}, summaries.keys())
+
+    def test_connect_upgrades_to_latest_schema_version(self):
+        self.assertEqual(LATEST_SCHEMA_VERSION, self.db.schema_version)
+        index_names = [row[0] for row in self.db.run_query("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn("list_changes_security_date_index", index_names)
+
+    def test_reference_data_reloads_after_write(self):
+        self.db.run_query("INSERT INTO lists(name, weight_id, parent_list_id, ticker) VALUES ('New', 2, 3, 'New')")
+        with self.assertRaises(Exception):
+            self.db.query_list_info("New")
+
+        self.db.record_write("lists")
+        self.assertEqual("New", self.db.query_list_info("New").name)
+
+    def test_writes_of_other_connections_drop_cached_data(self):
+        self.assertFalse(self.db.refresh_if_changed_externally())
+        number_of_lists = self.db.run_query("SELECT COUNT(*) FROM lists")[0][0]
+        with closing(sqlite3.connect(self.db_path)) as other_connection, other_connection:
+            other_connection.execute("INSERT INTO lists(name, weight_id, parent_list_id, ticker) "
+                                     "VALUES ('New', 2, 3, 'New')")
+        self.assertEqual(number_of_lists, self.db.run_query("SELECT COUNT(*) FROM lists")[0][0])
+
+        self.assertTrue(self.db.refresh_if_changed_externally())
+        self.assertEqual(number_of_lists + 1, self.db.run_query("SELECT COUNT(*) FROM lists")[0][0])
+        self.assertEqual("New", self.db.query_list_info("New").name)
+
+    def test_every_command_sees_writes_of_other_connections(self):
+        number_of_lists = self.db.run_query("SELECT COUNT(*) FROM lists")[0][0]
+        with closing(sqlite3.connect(self.db_path)) as other_connection, other_connection:
+            other_connection.execute("INSERT INTO lists(name, weight_id, parent_list_id, ticker) "
+                                     "VALUES ('New', 2, 3, 'New')")
+
+        with patch.object(preferred, "db", self.db), patch.object(preferred, "report", TextReport()), \
+                redirect_stdout(StringIO()):
+            preferred.launch("query_list_of_lists", ["Empty"])
+        self.assertEqual(number_of_lists + 1, self.db.run_query("SELECT COUNT(*) FROM lists")[0][0])
+
+    def test_list_set_matches_list_components(self):
+        ch_cash, us_cross = ({component.ticker for component in self.db.query_list_components(pref_list)}
+                             for pref_list in ("CHCash", "USCross"))
+
+        self.assertEqual(ch_cash | us_cross,
+                         {result.ticker for result in self.db.query_list_set(["CHCash", "USCross"], 1)})
+        self.assertEqual(ch_cash & us_cross,
+                         {result.ticker for result in self.db.query_list_set(["CHCash", "USCross"], 2)})
+        self.assertEqual(ch_cash - us_cross,
+                         {result.ticker for result in self.db.query_list_set(["CHCash"], 1, ["USCross"])})
+
+    def test_dossiers_match_per_ticker_queries(self):
+        dossiers = load_dossiers(self.db, ["APD.US", "UBSN.SW", "UNKNOWN"], 90)
+
+        self.assertEqual({"APD.US", "UBSN.SW"}, dossiers.keys())
+        for ticker, dossier in dossiers.items():
+            self.assertEqual(self.db.query_security(ticker), dossier.security)
+            self.assertEqual(list(self.db.query_history(ticker)), dossier.histories)
+            self.assertEqual(self.db.query_number_of_active_lists(ticker), dossier.number_of_active_lists)
+            self.assertEqual(self.db.query_bloomberg_earnings_dates(ticker), dossier.bloomberg_dates)
+
+    def test_list_tree_rolls_up_nested_lists(self):
+        self.db.run_query("INSERT INTO lists(name, weight_id, parent_list_id, ticker) VALUES ('Sub', 6, 134, 'CHSub')")
+        self.db.record_write("lists")
+        self.db.insert_list_change(ListChange("APD.US", "CHSub", "add", "01.01.21", None))
+
+        list_tree = {tree_list.ticker: tree_list for tree_list in self.db.query_list_tree("Empty", 36500)}
+        self.assertEqual(2, list_tree["CHSub"].depth)
+        self.assertEqual(list_tree["CHCash"].points + list_tree["CHSub"].points, list_tree["CHCash"].subtree_points)
+        self.assertEqual(sum(tree_list.points for tree_list in list_tree.values()), list_tree["Empty"].subtree_points)
+        self.assertIn("APD.US", [member.ticker for member in self.db.query_list_tree_members("Empty")])
+
+    def test_incremental_scores_match_rebuild(self):
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "add", "01.01.21", None))
+        self.db.update_weight_value("Neutral", 2)
+        # a weight of countries and currencies only
+        self.db.update_weight_value("Underweight", 1)
+        self.db.insert_list_change(ListChange("UBSN.SW", "USCross", "add", "02.01.21", None))
+        incremental_scores = {result.ticker: result.score for result in self.db.query_composite_scores()}
+
+        self.db.rebuild_security_scores()
+        rebuilt_scores = {result.ticker: result.score for result in self.db.query_composite_scores()}
+        self.assertEqual(rebuilt_scores.keys(), incremental_scores.keys())
+        for ticker, score in rebuilt_scores.items():
+            self.assertAlmostEqual(score, incremental_scores[ticker], delta=score * 1e-9)
+        # the newest add ranks first
+        self.assertEqual("UBSN.SW", self.db.query_composite_scores(1)[0].ticker)
+
+    def test_rebased_scores_read_the_same(self):
+        # connecting moved the epoch of the scores stored relative to 01.01.20
+        now = int(time.time())
+        self.assertGreater(self.db.query_score_epoch(), now - days_to_seconds(SCORE_REBASE_DAYS))
+
+        self.db.run_query(f"UPDATE {SCORE_EPOCH_TABLE} SET epoch = ?", (SCORE_EPOCH,))
+        self.db.record_write(SCORE_EPOCH_TABLE)
+        self.db.rebuild_security_scores()
+        scores = dict(self.db.run_query(f"SELECT security_id, score FROM {SECURITY_SCORES_TABLE}"))
+        self.assertTrue(self.db.rebase_security_scores(now))
+        self.assertEqual(start_of_day(now), self.db.query_score_epoch())
+        self.assertFalse(self.db.rebase_security_scores(now))
+
+        # the same scores at any time, relative to the new epoch
+        factor = score_decay(start_of_day(now), SCORE_EPOCH)
+        rebased_scores = dict(self.db.run_query(f"SELECT security_id, score FROM {SECURITY_SCORES_TABLE}"))
+        self.assertEqual(scores.keys(), rebased_scores.keys())
+        for security_id, score in scores.items():
+            self.assertAlmostEqual(score, rebased_scores[security_id] * factor, delta=abs(score) * 1e-9)
+
+    def test_query_statistics_log_slow_queries_with_plan(self):
+        self.db.query_statistics.reset()
+        self.db.query_statistics.slow_query_seconds = 0
+        self.db.query_list_components("CHCash")
+        self.db.query_list_components("USCross")
+
+        statement = self.db.query_statistics.top_statements(1)[0]
+        self.assertEqual(2, statement.calls)
+        self.assertEqual(len(self.db.query_list_components("CHCash")) + len(self.db.query_list_components("USCross")),
+                         statement.rows)
+        self.assertTrue(any("SEARCH" in step for step in self.db.query_statistics.slow_queries[0].plan))
+
+    def test_search_finds_inserted_alt_names_and_typos(self):
+        self.assertEqual("APD.US", self.db.search_securities("prodcts")[0][0])
+
+        self.db.insert_security_alt_name("APD.US", "Airgas Holding")
+        self.assertEqual(["APD.US"], [result[0] for result in self.db.search_securities("airgas")])
+
+    def test_fuzzy_search_needs_most_trigrams_of_the_text(self):
+        self.assertEqual(["CAT.US"], [result[0] for result in self.db.search_securities("Caterpilar")])
+        self.assertEqual(["APD.US"], [result[0] for result in self.db.search_securities("Air Prodcuts")])
+        # sharing one trigram like "lly" or "rei" with a name isn't enough
+        self.assertEqual([], self.db.search_securities("t O'Reilly"))
+        self.assertEqual([], self.db.search_securities("xqzvwk"))
+
+    def test_search_index_follows_trigram_support_of_the_sqlite_build(self):
+        self.db.close()
+        with patch("security_search.supports_trigram_search", return_value=False):
+            self.db.connect()
+        self.assertFalse(self.db.has_search_index)
+        # no trigger writes to the index any more, the LIKE search still finds the alt name
+        self.db.insert_security_alt_name("APD.US", "Airgas Holding")
+        self.assertEqual(["APD.US"], [result[0] for result in self.db.search_securities("airgas")])
+
+        self.db.close()
+        self.db.connect()
+        self.assertTrue(self.db.has_search_index)
+        self.assertEqual("APD.US", self.db.search_securities("airgsa holding")[0][0])
+
+    def test_daily_list_series_matches_point_in_time_queries(self):
+        start_time, end_time = swiss_date_to_timestamp("20.12.19"), swiss_date_to_timestamp("31.12.19")
+        snapshots = query_daily_list_series(self.db, "CHCash", start_time, end_time, 90)
+
+        self.assertEqual(12, len(snapshots))
+        for snapshot in snapshots:
+            components = self.db.query_list_components("CHCash", as_of=snapshot.timestamp)
+            self.assertEqual(sorted(component.ticker for component in components), snapshot.members)
+
+    def test_list_history_pages_cover_full_history(self):
+        full_history = list(self.db.query_list_history("USCross"))
+        pages = [list(self.db.query_list_history("USCross", page, 20)) for page in range(1, 4)]
+
+        self.assertEqual([20, 20, len(full_history) - 40], [len(page) for page in pages])
+        self.assertEqual(full_history, [history for page in pages for history in page])
+
+    def test_parallel_calls_read_committed_data_in_call_order(self):
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "add", "01.01.21", None))
+        results = self.db.run_parallel(partial(self.db.query_list_components, "CHCash"),
+                                       partial(self.db.query_list_components, "USCross"))
+
+        self.assertEqual([self.db.query_list_components("CHCash"), self.db.query_list_components("USCross")], results)
+        self.assertIn("APD.US", [component.ticker for component in results[0]])
+
+    def test_attached_database_merges_sources_with_reconciled_ids(self):
+        public_path = self.copy_public_database("public.db")
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "add", "01.01.21", None))
+        self.db.attach_database(public_path)
+
+        components = {component.ticker: component.sources
+                      for component in self.db.query_list_components_in_sources("CHCash", self.db.sources())}
+        self.assertEqual("private", components.pop("APD.US"))
+        self.assertEqual({"private, public"}, set(components.values()))
+        self.assertEqual(self.db.run_query("SELECT COUNT(*) FROM securities"),
+                         self.db.run_query("SELECT COUNT(*) FROM all_securities"))
+        public_components = self.db.query_list_components_in_sources("CHCash", self.db.sources(include_main=False))
+        self.assertEqual(sorted(components), sorted(component.ticker for component in public_components))
+        # before the add, APD.US is on neither list
+        as_of_components = self.db.query_list_components_in_sources("CHCash", self.db.sources(),
+                                                                     as_of=swiss_date_to_timestamp("31.12.20"))
+        self.assertEqual(sorted(components), sorted(component.ticker for component in as_of_components))
+
+    def test_points_in_sources_count_the_events_of_each_source(self):
+        self.db.attach_database(self.copy_public_database("public.db"))
+        points = {result.ticker: result.aggregate_points_value for result in self.db.query_points(36500)}
+        self.assertEqual(points, {result.ticker: result.aggregate_points_value
+                                  for result in self.db.query_points_in_sources(36500, self.db.sources(True, False))})
+        # public is a copy, both sources count every event twice
+        self.assertEqual({ticker: value * 2 for ticker, value in points.items()},
+                         {result.ticker: result.aggregate_points_value
+                          for result in self.db.query_points_in_sources(36500, self.db.sources())})
+
+        twp_results = self.db.query_time_weighted_points_in_sources(36500, self.db.sources(), "CH")[0]
+        self.assertEqual(2 * len(list(self.db.query_time_weighted_points(36500, country="CH")[0])),
+                         len(list(twp_results)))
+
+    def test_attached_ids_follow_writes_to_either_database(self):
+        public_path = self.copy_public_database("public.db")
+        self.db.attach_database(public_path)
+        with closing(sqlite3.connect(public_path)) as other_connection, other_connection:
+            other_connection.execute("INSERT INTO securities(name, ticker, country_id, currency_id) "
+                                     "SELECT 'Public Only', 'PUB.SW', country_id, currency_id FROM securities "
+                                     "WHERE ticker = 'UBSN.SW'")
+            other_connection.execute("INSERT INTO list_changes(security_id, list_id, event_id, date_epoch) "
+                                     "SELECT s.security_id, l.list_id, e.event_id, ? FROM securities s, lists l, "
+                                     "list_change_events e WHERE s.ticker = 'PUB.SW' AND l.ticker = 'CHCash' "
+                                     "AND e.ticker = 'add'", (swiss_date_to_timestamp("01.01.21"),))
+
+        self.assertTrue(self.db.refresh_if_changed_externally())
+        public_ids = dict(self.db.run_query("SELECT ticker, security_id FROM all_securities"))
+        self.assertLess(public_ids["PUB.SW"], 0)
+        public_components = self.db.query_list_components_in_sources("CHCash", self.db.sources(include_main=False))
+        self.assertIn("PUB.SW", [component.ticker for component in public_components])
+
+        # added to private as well, the public row now reconciles to the private id
+        self.db.run_query("INSERT INTO securities(name, ticker, country_id, currency_id) "
+                          "SELECT 'Public Only', 'PUB.SW', country_id, currency_id FROM securities "
+                          "WHERE ticker = 'UBSN.SW'")
+        self.db.connection.commit()
+        self.db.record_write("securities")
+        components = {component.ticker: component.sources
+                      for component in self.db.query_list_components_in_sources("CHCash", self.db.sources())}
+        self.assertEqual("public", components["PUB.SW"])
+        self.assertEqual(self.db.get_primary_key_value_for_ticker("securities", "PUB.SW"),
+                         dict(self.db.run_query("SELECT ticker, security_id FROM all_securities"))["PUB.SW"])
+
+    def test_result_cache_serves_repeats_until_a_write(self):
+        components = self.db.query_list_components("CHCash")
+        number_of_queries = self.db.query_statistics.number_of_queries
+        self.assertEqual(components, self.db.query_list_components("CHCash"))
+        self.assertEqual(number_of_queries, self.db.query_statistics.number_of_queries)
+
+        self.db.insert_list_change(ListChange("APD.US", "CHCash", "add", "01.01.21", None))
+        self.assertIn("APD.US", [component.ticker for component in self.db.query_list_components("CHCash")])
+
+    def test_missing_earnings_flags_gaps_members_first(self):
+        now = int(time.time())
+        for days in (-30, 30):
+            self.db.insert_earnings_date(EarningsDate("APD.US", timestamp_to_swiss_date(now + days_to_seconds(days))))
+        # a Bloomberg date between the two native dates, outside the tolerance of both
+        security_id = self.db.get_primary_key_value_for_ticker("securities", "APD.US")
+        batch = self.db.insert_bloomberg_scrape_batch("test")
+        self.db.upsert_bloomberg_earnings_dates([(start_of_day(now + days_to_seconds(10)), security_id, "Q1", batch)])
+        self.db.connection.commit()
+        # an append keeps AFL.US on one list, like ABBN.SW, and gives it points within the threshold
+        self.db.insert_list_change(ListChange("AFL.US", "USCross", "app", timestamp_to_swiss_date(now), None))
+        missing_earnings = self.db.query_missing_earnings(90)
+
+        apd = next(result for result in missing_earnings if result.ticker == "APD.US")
+        self.assertEqual((False, False, True), (apd.missing_next, apd.stale_previous, apd.bloomberg_mismatch))
+        abb = next(result for result in missing_earnings if result.ticker == "ABBN.SW")
+        self.assertEqual((True, True), (abb.missing_next, abb.stale_previous))
+        afl = next(result for result in missing_earnings if result.ticker == "AFL.US")
+        self.assertEqual((abb.number_of_lists, 1, 0), (afl.number_of_lists, afl.points, abb.points))
+        self.assertLess(missing_earnings.index(afl), missing_earnings.index(abb))
+        self.assertEqual(sorted(missing_earnings, key=lambda result: (-result.number_of_lists, -result.points)),
+                         missing_earnings)
+
+    def test_newest_bloomberg_date_is_latest_date_of_latest_batch(self):
+        security_id = self.db.get_primary_key_value_for_ticker("securities", "APD.US")
+        old_date, new_date = swiss_date_to_timestamp("01.02.21"), swiss_date_to_timestamp("01.05.21")
+        first_batch = self.db.insert_bloomberg_scrape_batch("test")
+        self.db.upsert_bloomberg_earnings_dates([(new_date, security_id, "Q1", first_batch)])
+        # the older date gets the higher id, the newer one moves into the second batch with its lower id
+        second_batch = self.db.insert_bloomberg_scrape_batch("test")
+        self.db.upsert_bloomberg_earnings_dates([(old_date, security_id, "Q4", second_batch),
+                                                 (new_date, security_id, "Q1", second_batch)])
+        self.db.connection.commit()
+
+        self.assertEqual(new_date, self.db.query_dates_summaries(["APD.US"])["APD.US"].bloomberg_date_timestamp)
+
+    def test_upcoming_earnings_group_native_and_bloomberg_dates_by_day(self):
+        security_id = self.db.get_primary_key_value_for_ticker("securities", "APD.US")
+        first_date, second_date = swiss_date_to_timestamp("01.02.21"), swiss_date_to_timestamp("03.02.21")
+        self.db.insert_earnings_date(EarningsDate("APD.US", "01.02.21"))
+        self.db.insert_earnings_date(EarningsDate("UBSN.SW", "03.02.21"))
+        batch = self.db.insert_bloomberg_scrape_batch("test")
+        self.db.upsert_bloomberg_earnings_dates([(first_date, security_id, "Q4", batch)])
+        self.db.connection.commit()
+
+        upcoming_earnings = list(self.db.query_upcoming_earnings(first_date, second_date))
+        self.assertEqual([(first_date, "APD.US"), (second_date, "UBSN.SW")],
+                         [(result.date_timestamp, result.ticker) for result in upcoming_earnings])
+        # the same day from both sources is one row
+        self.assertEqual(["B", "N"], sorted(upcoming_earnings[0].sources.split(",")))
+        self.assertEqual("N", upcoming_earnings[1].sources)
@@ -19,3 +19,9 @@ class TestMenu(TestCase):
     def test_menu_with_duplicate_aliases_from_both_same_and_different_options(self):
         with self.assertRaises(ValueError):
             Menu([MenuOption(["alias", "alias"], "method"), MenuOption(["alias"], "method2")])
+
+    def test_run_commands_skips_blank_lines_and_comments(self):
+        launched = []
+        menu = Menu([MenuOption(["ls"], "method")], lambda method, arguments: launched.append((method, arguments)))
+        menu.run_commands(["ls A B\n", "\n", "# ls C\n", "  ls D  \n"])
+        self.assertEqual([("method", ["A", "B"]), ("method", ["D"])], launched)
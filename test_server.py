@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from socket import AF_UNIX, SOCK_STREAM, socket
+from unittest import TestCase
+
+from client import run_commands
+from server import decode_message, encode_message, serve
+
+
+def echo_command(command, as_json, session):
+    # "set VALUE" keeps a value for the connection, any other command is echoed with it
+    if command == "q":
+        raise SystemExit
+    if command.startswith("set "):
+        session["value"] = command[len("set "):]
+        return "", ""
+    value = f" {session['value']}" if "value" in session else ""
+    return f"{command} {as_json}{value}\n", ""
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, "test.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def start_server(self, run_command):
+        server_thread = threading.Thread(target=serve, args=(self.socket_path, run_command))
+        server_output = StringIO()
+        with redirect_stdout(server_output):
+            server_thread.start()
+            # printed once the socket listens
+            while "Serving" not in server_output.getvalue():
+                time.sleep(0.01)
+        return server_thread
+
+    def stop_server(self, server_thread):
+        with redirect_stderr(StringIO()):
+            run_commands(self.socket_path, ["q"])
+        server_thread.join()
+
+    def test_clients_get_their_own_output_until_stopped(self):
+        server_thread = self.start_server(echo_command)
+        outputs = [StringIO() for unused in range(3)]
+        for output, as_json in zip(outputs, (False, True, False)):
+            with redirect_stdout(output):
+                run_commands(self.socket_path, ["ls A", "ls B"], as_json)
+        self.stop_server(server_thread)
+
+        self.assertEqual(["ls A False\nls B False\n", "ls A True\nls B True\n", "ls A False\nls B False\n"],
+                         [output.getvalue() for output in outputs])
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_overlapping_clients_get_their_own_output(self):
+        server_thread = self.start_server(echo_command)
+        connections = [socket(AF_UNIX, SOCK_STREAM) for unused in range(3)]
+        try:
+            for connection in connections:
+                connection.connect(self.socket_path)
+            # every client sends before any of them reads, their commands wait in the queue together
+            for number, connection in enumerate(connections):
+                connection.sendall(encode_message({"command": f"ls {number}"}))
+            responses = []
+            for connection in reversed(connections):
+                with connection.makefile("rb") as response_lines:
+                    responses.append(decode_message(response_lines.readline()))
+        finally:
+            for connection in connections:
+                connection.close()
+        self.stop_server(server_thread)
+
+        self.assertEqual(["ls 2 False\n", "ls 1 False\n", "ls 0 False\n"],
+                         [response["stdout"] for response in responses])
+
+    def test_connections_keep_their_own_session(self):
+        server_thread = self.start_server(echo_command)
+        connections = [socket(AF_UNIX, SOCK_STREAM) for unused in range(2)]
+        try:
+            for connection in connections:
+                connection.connect(self.socket_path)
+            response_files = [connection.makefile("rb") for connection in connections]
+            responses = []
+            for connection, response_file, command in zip(connections * 2, response_files * 2,
+                                                            ["set A", "ls", "ls", "ls"]):
+                connection.sendall(encode_message({"command": command}))
+                responses.append(decode_message(response_file.readline())["stdout"])
+            for response_file in response_files:
+                response_file.close()
+        finally:
+            for connection in connections:
+                connection.close()
+        self.stop_server(server_thread)
+
+        # the second connection never sees the value the first one set
+        self.assertEqual(["", "ls False\n", "ls False A\n", "ls False\n"], responses)
@@ -0,0 +1,22 @@
+import os
+
+from public_db_test_case import PublicDatabaseTestCase
+from snapshot import export_snapshot, Snapshot
+
+
+class TestSnapshot(PublicDatabaseTestCase):
+    def test_snapshot_columns_decode_to_table_rows(self):
+        snapshot_path = os.path.join(self.temp_dir, "snapshot")
+        export_snapshot(self.db, snapshot_path)
+
+        with Snapshot(snapshot_path) as snapshot:
+            tickers, events = (snapshot.dictionary(name)["tickers"] for name in ("securities", "list_change_events"))
+            decoded_changes = [(tickers[security], events[event], date_epoch) for security, event, date_epoch in zip(
+                *(snapshot.column("list_changes", column) for column in ("security", "event", "date_epoch")))]
+            self.assertEqual(self.db.run_query(
+                "SELECT s.ticker, e.ticker, c.date_epoch FROM list_changes c, securities s, list_change_events e "
+                "WHERE s.security_id = c.security_id AND e.event_id = c.event_id ORDER BY c.date_epoch, c.change_id"),
+                decoded_changes)
+            self.assertEqual(self.db.run_query("SELECT COUNT(*), SUM(date_epoch) FROM bloomberg_earnings_dates")[0],
+                             (snapshot.rows("bloomberg_earnings_dates"),
+                              sum(snapshot.column("bloomberg_earnings_dates", "date_epoch"))))
@@ -0,0 +1,44 @@
+from unittest import skipIf, TestCase
+from unittest.mock import patch
+
+from database import TimeWeightedPointsResult
+from time_factor_calculator import LinearDecayKernel, ExponentialDecayKernel, StepDecayKernel
+from weighted_points_processor import np, WeightedPointsEngine
+
+RESULTS = [TimeWeightedPointsResult("Air Products", "APD.US", 2, 900),
+           TimeWeightedPointsResult("Air Products", "APD.US", 2, 500),
+           TimeWeightedPointsResult("UBS", "UBSN.SW", 2, 1000), TimeWeightedPointsResult("ABB", "ABBN.SW", -2, 1000)]
+
+
+class TestWeightedPointsEngine(TestCase):
+    def test_linear_kernel_sums_per_ticker(self):
+        values = WeightedPointsEngine(RESULTS).top(1000, LinearDecayKernel(1000))
+        self.assertEqual(["APD.US", "UBSN.SW"], [value.ticker for value in values])
+        self.assertAlmostEqual(2.8, values[0].value)
+
+    def test_top_k(self):
+        values = WeightedPointsEngine(RESULTS).top(1000, LinearDecayKernel(1000), k=1)
+        self.assertEqual(["APD.US"], [value.ticker for value in values])
+
+    def test_kernels_ignore_time_diffs_outside_window(self):
+        self.assertEqual([0.0, 1.0, 0.0], LinearDecayKernel(10).calculate_for_time_diffs([-1, 0, 11]))
+        self.assertEqual([1.0, 0.5, 0.0], ExponentialDecayKernel(5, 10).calculate_for_time_diffs([0, 5, 11]))
+        self.assertEqual([1.0, 0.5, 0.0], StepDecayKernel([(5, 1), (10, 0.5)]).calculate_for_time_diffs([5, 6, 11]))
+
+    @skipIf(np is None, "numpy not installed")
+    def test_numpy_path_matches_python_path(self):
+        # a tie on the k-th highest points keeps the lower code, like nlargest
+        results = RESULTS + [TimeWeightedPointsResult("Nestle", "NESN.SW", 2, 1000)]
+        kernels = [LinearDecayKernel(1000), ExponentialDecayKernel(300, 1000), StepDecayKernel([(200, 1), (600, 0.5)])]
+        for kernel in kernels:
+            for k in (None, 0, 1, 2):
+                values = WeightedPointsEngine(results).top(1000, kernel, k)
+                with patch("weighted_points_processor.np", None):
+                    python_values = WeightedPointsEngine(results).top(1000, kernel, k)
+                self.assertEqual([value.ticker for value in python_values], [value.ticker for value in values])
+                for python_value, value in zip(python_values, values):
+                    self.assertAlmostEqual(python_value.value, value.value)
+
+            time_diffs = [-1, 0, 200, 450, 1000, 1001]
+            self.assertEqual(kernel.calculate_for_time_diffs(time_diffs),
+                             list(kernel.calculate_for_time_diff_array(np.array(time_diffs, dtype=float))))
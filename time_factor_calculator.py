@@ -1,10 +1,65 @@
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
 class TimeFactorCalculator:
     def __init__(self, current_time, max_time_diff):
         self.current_time = current_time
         self.max_time_diff = max_time_diff
 
-    def calculate_for_change_time(self, change_time):
-        time_diff = (self.current_time - change_time)
-        if time_diff > self.max_time_diff or time_diff < 0:
-            raise Exception(f"Unexpected change time {change_time}")
-        return float(1 - float(time_diff) / float(self.max_time_diff))
\ No newline at end of file
+
+# decay kernels map a column of time diffs to a column of factors, time diffs outside [0, max_time_diff] get factor 0;
+# calculate_for_time_diff_array does the same for a numpy array, used when numpy is installed
+
+
+class LinearDecayKernel:
+    def __init__(self, max_time_diff):
+        self.max_time_diff = float(max_time_diff)
+
+    def calculate_for_time_diffs(self, time_diffs):
+        max_time_diff = self.max_time_diff
+        return [1.0 - time_diff / max_time_diff if 0 <= time_diff <= max_time_diff else 0.0
+                for time_diff in time_diffs]
+
+    def calculate_for_time_diff_array(self, time_diffs):
+        return np.where((time_diffs >= 0) & (time_diffs <= self.max_time_diff),
+                        1.0 - time_diffs / self.max_time_diff, 0.0)
+
+
+class ExponentialDecayKernel:
+    def __init__(self, half_life, max_time_diff):
+        self.half_life = float(half_life)
+        self.max_time_diff = float(max_time_diff)
+
+    def calculate_for_time_diffs(self, time_diffs):
+        max_time_diff = self.max_time_diff
+        half_life = self.half_life
+        return [2.0 ** (-time_diff / half_life) if 0 <= time_diff <= max_time_diff else 0.0
+                for time_diff in time_diffs]
+
+    def calculate_for_time_diff_array(self, time_diffs):
+        # clipped so time diffs outside the window, which get factor 0 anyway, can't overflow
+        factors = np.exp2(-np.clip(time_diffs, 0.0, self.max_time_diff) / self.half_life)
+        return np.where((time_diffs >= 0) & (time_diffs <= self.max_time_diff), factors, 0.0)
+
+
+class StepDecayKernel:
+    def __init__(self, steps):
+        # steps: (upper time diff, factor) pairs, e.g. [(30 days, 1.0), (90 days, 0.5)]
+        sorted_steps = sorted(steps)
+        self.upper_time_diffs = [upper_time_diff for upper_time_diff, factor in sorted_steps]
+        self.factors = [float(factor) for upper_time_diff, factor in sorted_steps] + [0.0]
+
+    def calculate_for_time_diffs(self, time_diffs):
+        upper_time_diffs = self.upper_time_diffs
+        factors = self.factors
+        return [factors[bisect_left(upper_time_diffs, time_diff)] if time_diff >= 0 else 0.0
+                for time_diff in time_diffs]
+
+    def calculate_for_time_diff_array(self, time_diffs):
+        factors = np.asarray(self.factors)[np.searchsorted(self.upper_time_diffs, time_diffs, side="left")]
+        return np.where(time_diffs >= 0, factors, 0.0)
@@ -0,0 +1,55 @@
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+from date_util import days_to_seconds, SECONDS_IN_A_DAY
+
+DailyListSnapshot = NamedTuple("DailyListSnapshot", [("timestamp", int), ("members", list), ("points", dict),
+                                                     ("time_weighted_points", dict)])
+
+
+def daily_timestamps(start_time, end_time):
+    return range(int(start_time), int(end_time) + 1, SECONDS_IN_A_DAY)
+
+
+def query_daily_list_series(db, pref_list, start_time, end_time, threshold_days):
+    # daily membership of pref_list with the points and time weighted points of its members, the events are loaded
+    # once and every day only applies the events that entered or left its window
+    threshold_seconds = days_to_seconds(threshold_days)
+    list_events = db.query_change_events(None, end_time, pref_list=pref_list)
+    window_events = db.query_change_events(start_time - threshold_seconds, end_time)
+
+    signs = Counter()
+    # per ticker sums of value and value * timestamp over the events in the points window, linear decay at day t is
+    # sum(value * (1 - (t - timestamp) / threshold)) = sum(value) + (sum(value * timestamp) - sum(value) * t) / threshold
+    value_sums = defaultdict(float)
+    weighted_timestamp_sums = defaultdict(float)
+    next_list_event = next_entering_event = next_leaving_event = 0
+    snapshots = []
+
+    for day in daily_timestamps(start_time, end_time):
+        while next_list_event < len(list_events) and list_events[next_list_event].event_date_timestamp <= day:
+            event = list_events[next_list_event]
+            signs[event.ticker] += event.event_value_sign
+            next_list_event += 1
+
+        while (next_entering_event < len(window_events)
+               and window_events[next_entering_event].event_date_timestamp <= day):
+            event = window_events[next_entering_event]
+            value_sums[event.ticker] += event.event_value
+            weighted_timestamp_sums[event.ticker] += event.event_value * event.event_date_timestamp
+            next_entering_event += 1
+
+        while (next_leaving_event < next_entering_event
+               and window_events[next_leaving_event].event_date_timestamp <= day - threshold_seconds):
+            event = window_events[next_leaving_event]
+            value_sums[event.ticker] -= event.event_value
+            weighted_timestamp_sums[event.ticker] -= event.event_value * event.event_date_timestamp
+            next_leaving_event += 1
+
+        members = sorted(ticker for ticker, sign in signs.items() if sign > 0)
+        snapshots.append(DailyListSnapshot(
+            day, members, {ticker: int(value_sums[ticker]) for ticker in members},
+            {ticker: value_sums[ticker] + (weighted_timestamp_sums[ticker] - value_sums[ticker] * day) /
+             threshold_seconds for ticker in members}))
+
+    return snapshots
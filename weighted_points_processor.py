@@ -1,24 +1,82 @@
+from array import array
+from heapq import nlargest
+from operator import mul
+
 from security import Security
 
+try:
+    import numpy as np
+except ImportError:
+    # the same results from the plain python columns, only slower
+    np = None
+
+
+class WeightedPointsEngine:
+    def __init__(self, twp_results):
+        # columnar copy of the results, tickers dictionary-encoded so sums reduce into one slot per ticker
+        self.names = []
+        self.tickers = []
+        self.ticker_codes = array("l")
+        self.event_values = array("d")
+        self.event_timestamps = array("d")
+
+        ticker_to_code = {}
+        for result in twp_results:
+            code = ticker_to_code.get(result.ticker)
+            if code is None:
+                code = ticker_to_code[result.ticker] = len(self.tickers)
+                self.tickers.append(result.ticker)
+                self.names.append(result.name)
+            self.ticker_codes.append(code)
+            self.event_values.append(result.event_value)
+            self.event_timestamps.append(result.event_date_timestamp)
+
+        if np is not None:
+            self.ticker_codes = np.asarray(self.ticker_codes, dtype=np.intp)
+            self.event_values = np.asarray(self.event_values)
+            self.event_timestamps = np.asarray(self.event_timestamps)
+
+    def __len__(self):
+        return len(self.event_values)
+
+    def calculate_points(self, current_time, kernel):
+        if np is not None:
+            weighted_values = self.event_values * kernel.calculate_for_time_diff_array(
+                current_time - self.event_timestamps)
+            return np.bincount(self.ticker_codes, weights=weighted_values, minlength=len(self.tickers))
 
-class WeightedPointsProcessor:
-    def __init__(self, twp_result, time_calculator):
-        self.time_calculator = time_calculator
-        self.points = self.get_current_points(twp_result)
-        self.ticker = twp_result.ticker
+        time_diffs = [current_time - timestamp for timestamp in self.event_timestamps]
+        weighted_values = map(mul, self.event_values, kernel.calculate_for_time_diffs(time_diffs))
+        points = [0.0] * len(self.tickers)
+        for code, value in zip(self.ticker_codes, weighted_values):
+            points[code] += value
+        return points
 
-    def get_current_points(self, twp_result):
-        return twp_result.event_value * self.time_calculator.calculate_for_change_time(twp_result.event_date_timestamp)
+    def top(self, current_time, kernel, k=None):
+        points = self.calculate_points(current_time, kernel)
+        top_codes = self.top_codes(points, k) if np is not None else nlargest(
+            len(points) if k is None else k, (code for code, value in enumerate(points) if value > 0),
+            key=points.__getitem__)
+        return [AggregatedValue(float(points[code]), self.names[code], self.tickers[code]) for code in top_codes]
 
-    def update_current_points(self, update_twp_result):
-        self.points += self.get_current_points(update_twp_result)
+    @staticmethod
+    def top_codes(points, k):
+        # same order as nlargest: highest points first, ties by code
+        positive_codes = np.flatnonzero(points > 0)
+        if k is not None and k < len(positive_codes):
+            if k <= 0:
+                return []
+            # only the codes with at least the k-th highest points are sorted
+            kth_points = points[positive_codes[np.argpartition(-points[positive_codes], k - 1)[k - 1]]]
+            positive_codes = positive_codes[points[positive_codes] >= kth_points]
+        return positive_codes[np.argsort(-points[positive_codes], kind="stable")][:k]
 
 
 class AggregatedValue:
-    def __init__(self, value, twp_result):
+    def __init__(self, value, name, ticker):
         self.value = value
-        self.name = twp_result.name
-        self.ticker = twp_result.ticker
+        self.name = name
+        self.ticker = ticker
 
     def __repr__(self):
         return f"{self.value:.2f}: {Security.summary(self.name, self.ticker)}"